@@ -0,0 +1,139 @@
+'''
+accounts.py
+
+Concurrent bulk creation and password reset of Netlab-VE+ user accounts.
+
+Account calls are made concurrently with a cap on how many are in flight,
+and each account's outcome is recorded so a run can be summarized (and
+safely repeated: accounts that already exist are skipped, not re-added).
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import asyncio
+
+
+##
+# find_class: The class_list entry a class_spec names (None if not unique)
+#
+# class_spec: cls_id (number) or string that uniquely matches a class name
+# class_list: result of class_list()
+#
+def find_class(class_spec, class_list):
+    class_spec = str(class_spec)
+    if class_spec.isnumeric():
+        matches = [x for x in class_list if x['cls_id'] == int(class_spec)]
+    else:
+        matches = [x for x in class_list if class_spec in x['cls_name']]
+    return matches[0] if len(matches) == 1 else None
+
+
+##
+# run_bounded: Run coroutine function call(item) for every item with at
+# most max_inflight running at once
+#
+# Returns a dict from item to call's result, or to the exception it raised.
+#
+async def run_bounded(items, call, max_inflight):
+    limit = asyncio.Semaphore(max_inflight)
+
+    async def bounded(item):
+        async with limit:
+            return await call(item)
+
+    results = await asyncio.gather(*[bounded(item) for item in items],
+                                   return_exceptions=True)
+    return dict(zip(items, results))
+
+
+##
+# add_accounts: Create accounts that do not already exist
+#
+# api: netlab client connection
+# acct_names: user ids of accounts to create
+# class_entry: class_list entry (with com_id and cls_id) for the accounts
+# passwd: initial password
+# existing: user ids of accounts that already exist
+# max_inflight: account creations that may run at once
+#
+# Returns a dict from user id to 'created', 'exists' or the exception
+# that stopped its creation.
+#
+async def add_accounts(api,
+                       acct_names,
+                       class_entry,
+                       passwd,
+                       existing=(),
+                       max_inflight=8):
+    existing = set(existing)
+
+    async def add(acct_name):
+        if acct_name in existing:
+            return 'exists'
+        await api.user_account_add(com_id=class_entry['com_id'],
+                                   acc_user_id=acct_name,
+                                   acc_password=passwd,
+                                   acc_pw_change=False,
+                                   cls_id=class_entry['cls_id'],
+                                   acc_full_name=acct_name)
+        return 'created'
+
+    return await run_bounded(acct_names, add, max_inflight)
+
+
+##
+# set_passwords: Set the password of many accounts
+#
+# api: netlab client connection
+# acct_ids: acc_ids of accounts to change
+# passwd: new password
+# max_inflight: password changes that may run at once
+#
+# Returns a dict from acc_id to 'reset' or the exception that stopped it.
+#
+async def set_passwords(api, acct_ids, passwd, max_inflight=8):
+
+    async def reset(acct_id):
+        await api.user_account_password_set(acc_id=acct_id,
+                                            new_password=passwd,
+                                            force_reset=False)
+        return 'reset'
+
+    return await run_bounded(acct_ids, reset, max_inflight)
+
+
+##
+# print_results: Print the per-account outcome of a bulk operation
+#
+# title: heading for the summary
+# results: dict from account to outcome (string or exception)
+# names: optional dict from account key to the name to print
+#
+def print_results(title, results, names=None):
+    names = names or {}
+    print(f'{title}:')
+    for acct, outcome in results.items():
+        if isinstance(outcome, BaseException):
+            outcome = f'FAILED {outcome}'
+        print(f'  {names.get(acct, acct)}: {outcome}')
@@ -0,0 +1,249 @@
+'''
+api_trace.py
+
+Recording and replay of Netlab-VE+ API traffic.
+
+RecordingClient wraps a NetlabClient and appends every call it makes
+(method, arguments, response or error, start time and duration) to a
+trace file as the call completes.  ReplayClient answers the same calls
+from a trace instead of the server, taking as long as each call took
+when it was recorded (or that divided by a speed factor), so a slow
+production run can be reproduced offline and a scheduling change
+compared on the same workload.
+
+Replayed calls are matched to recorded ones by method and arguments,
+in recorded order; a call with no exact match (e.g. a clone planned
+onto a different host) takes the next unused recording of the same
+method, and is counted as a mismatch.  Password arguments are never
+written to a trace; they are recorded (and matched) as "<redacted>".
+
+Scripts get their client from open_client(), which records when
+$NETLAB_RECORD names a trace file to write and replays when
+$NETLAB_REPLAY names one to read ($NETLAB_REPLAY_SPEED, default 1,
+speeds replay up):
+
+    NETLAB_RECORD=clone.trace ./clone_pod.py ...
+    NETLAB_REPLAY=clone.trace NETLAB_REPLAY_SPEED=10 ./clone_pod.py ...
+
+Traces are gzip-compressed JSON Lines files, one call per line, with
+netlab enums and datetimes encoded as in snapshot.py.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import asyncio
+import collections
+import copy
+import gzip
+import json
+import os
+import re
+import sys
+import time
+
+from netlab.async_client import NetlabClient
+
+from metrics import MetricsClient
+import snapshot
+
+SECRET_PATTERN = re.compile(r'pass|secret|token', re.IGNORECASE)
+
+
+class ReplayError(Exception):
+    pass
+
+
+##
+# redact: A call's keyword arguments with password-like values hidden
+#
+def redact(kwargs):
+    return {key: '<redacted>' if SECRET_PATTERN.search(key) else value
+            for key, value in kwargs.items()}
+
+
+##
+# call_key: Hashable form of a call's method and (redacted) arguments
+#
+def call_key(method, args, kwargs):
+    return (method,
+            json.dumps(list(args), default=snapshot.encode),
+            json.dumps(redact(kwargs), default=snapshot.encode,
+                       sort_keys=True))
+
+
+##
+# RecordingClient: NetlabClient wrapper that traces every call
+#
+# api: client to wrap (entered and exited along with this one)
+# path: trace file to write
+#
+class RecordingClient:
+
+    def __init__(self, api, path):
+        self.api = api
+        self.path = path
+        self.trace = None
+        self.start = None
+        self.seq = 0
+
+    async def __aenter__(self):
+        await self.api.__aenter__()
+        self.trace = gzip.open(self.path, 'wb')
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.trace.close()
+        return await self.api.__aexit__(*exc_info)
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            record = {'seq': self.seq,
+                      'method': name,
+                      'args': args,
+                      'kwargs': redact(kwargs),
+                      'start': time.monotonic() - self.start}
+            self.seq += 1
+            try:
+                record['result'] = await attr(*args, **kwargs)
+                return record['result']
+            except Exception as err:
+                record['error'] = f'{type(err).__name__}: {err}'
+                raise
+            finally:
+                record['elapsed'] = \
+                    time.monotonic() - self.start - record['start']
+                self.write(record)
+        return call
+
+    ##
+    # write: Append a record as one line, serialized in full before any
+    # of it is written so a failure cannot leave half a record
+    #
+    def write(self, record):
+        try:
+            line = json.dumps(record, default=snapshot.encode)
+        except (TypeError, ValueError):
+            record['result'] = repr(record.get('result'))
+            line = json.dumps(record, default=snapshot.encode)
+        self.trace.write((line + '\n').encode())
+        self.trace.flush()
+
+
+##
+# read_trace: The records of a trace file, in the order calls finished
+#
+def read_trace(path):
+    records = []
+    with gzip.open(path, 'rt') as trace:
+        try:
+            for line in trace:
+                records.append(json.loads(line, object_hook=snapshot.decode))
+        except (EOFError, ValueError):
+            pass    # a trace cut off mid-line by a crash
+    return records
+
+
+##
+# ReplayClient: Answers API calls from a trace
+#
+# path: trace file to read
+# speed: recorded durations are divided by this
+#
+class ReplayClient:
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.exact = collections.defaultdict(collections.deque)
+        self.by_method = collections.defaultdict(collections.deque)
+        self.used = set()
+        self.mismatches = collections.Counter()
+        for record in sorted(read_trace(path), key=lambda r: r['start']):
+            self.exact[call_key(record['method'], record['args'],
+                                record['kwargs'])].append(record)
+            self.by_method[record['method']].append(record)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.mismatches:
+            print(f'Replay of {self.path}: calls without an exact match:'
+                  f' {dict(self.mismatches)}', file=sys.stderr)
+        return False
+
+    ##
+    # take: Remove and return the next unused record from a queue
+    #
+    def take(self, queue):
+        while queue:
+            record = queue.popleft()
+            if record['seq'] not in self.used:
+                self.used.add(record['seq'])
+                return record
+        return None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            record = self.take(self.exact[call_key(name, args, kwargs)])
+            if record is None:
+                record = self.take(self.by_method[name])
+                if record is None:
+                    raise ReplayError(f'{name}: no call left in'
+                                      f' {self.path} to replay')
+                self.mismatches[name] += 1
+            await asyncio.sleep(record['elapsed'] / self.speed)
+            if 'error' in record:
+                raise ReplayError(record['error'])
+            return copy.deepcopy(record['result'])
+        return call
+
+
+##
+# open_client: The client scripts should use in place of NetlabClient()
+#
+# Replays $NETLAB_REPLAY if set, otherwise uses a NetlabClient,
+# recording to $NETLAB_RECORD if that is set.  Either way the calls'
+# metrics are exported when the client is closed (see metrics.py).
+#
+def open_client():
+    if os.environ.get('NETLAB_REPLAY'):
+        speed = float(os.environ.get('NETLAB_REPLAY_SPEED', 1))
+        if speed <= 0:
+            raise ValueError(f'NETLAB_REPLAY_SPEED must be positive,'
+                             f' not {speed}')
+        api = ReplayClient(os.environ['NETLAB_REPLAY'], speed)
+    elif os.environ.get('NETLAB_RECORD'):
+        api = RecordingClient(NetlabClient(), os.environ['NETLAB_RECORD'])
+    else:
+        api = NetlabClient()
+    return MetricsClient(api)
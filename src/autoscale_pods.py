@@ -0,0 +1,318 @@
+#! /usr/bin/env python3
+'''
+autoscale_pods.py
+
+usage: autoscale_pods.py [-h] --src_pid SRC_PID --pod_prefix POD_PREFIX
+                         [--start START] [--horizon HORIZON]
+                         [--window WINDOW]
+                         [--buffer N|P%] [--min_pods MIN_PODS]
+                         [--clone_datastore CLONE_DATASTORE]
+                         [--host_weight VH_ID=WEIGHT]
+                         [--datacenter DATACENTER]
+                         [-r {none,local,datacenter,disk}]
+                         [--max_per_host MAX_PER_HOST] [--retries RETRIES]
+                         [-adaptive] [-fresh] [-n] [-y] [-q]
+
+Size a pod pool to the reservations coming up for its pods
+
+options:
+  -h, --help            show this help message and exit
+  --src_pid SRC_PID     master pod the pool's pods are cloned from
+  --pod_prefix POD_PREFIX
+                        prefix of the pool's pod names
+  --start START         plan from this time, "[MM/DD/YYYY ]HH:MM"
+                        (default now)
+  --horizon HORIZON     hours ahead to provide for, more than 0
+                        (default 24)
+  --window WINDOW       minutes in each demand window, more than 0
+                        (default 60)
+  --buffer N|P%         pods to keep beyond peak demand, as a count or a
+                        percentage of the peak (default 10%)
+  --min_pods MIN_PODS   pods to keep however low demand is (default 0)
+  --clone_datastore CLONE_DATASTORE
+                        datastore for new clones
+  --host_weight VH_ID=WEIGHT
+                        relative capacity of a host (repeatable, default 1)
+  --datacenter DATACENTER
+                        datacenter whose hosts the pool is spread over
+                        (from environment var NETLAB_VDC if not specified)
+  -r {none,local,datacenter,disk}, --removal_type {none,local,datacenter,disk}
+                        how surplus pods' VMs are removed (default disk)
+  --max_per_host MAX_PER_HOST
+                        clones or removals each host may run at once
+                        (default 1)
+  --retries RETRIES     times to retry a call that failed transiently
+                        (default 3)
+  -adaptive             tune calls in flight to server latency and errors
+  -fresh                list from the server, not a saved snapshot
+                        (dry runs use a snapshot up to five minutes old)
+  -n                    dry run
+  -y                    act without asking for confirmation
+  -q                    quiet (no per-pod messages)
+
+The reservations of the pool's pods (the pods whose names start with
+--pod_prefix) are split into windows of --window minutes over the next
+--horizon hours, and the most reservations running at once in each
+window is reported.  Reservations of other pods, even of the same pod
+type, are left to whatever provides those pods.  The pool is then sized
+to the highest of those peaks plus --buffer, as pod_pool.py would size
+it: missing pods are cloned onto the least loaded hosts and surplus pods
+are deleted, never deleting a pod with a reservation still to come.
+Pool pods that are online but not reserved in the first window are
+offlined.
+
+Run it ahead of each window (e.g. hourly from cron) so clones are ready
+before the reservations that need them start.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import argparse
+import asyncio
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+
+from netlab.enums import PodState
+from netlab.enums import RemoveVMS
+
+import api_trace
+import clone_pod
+import delete_pods
+import placement
+import pod_pool
+import retry
+import set_pod_state
+from reservations import ReservationIndex, list_reservations, parse_time
+
+
+##
+# parse_buffer: Convert an --buffer argument to (pods, fraction of peak)
+#
+def parse_buffer(text):
+    try:
+        if text.endswith('%'):
+            buffer = (0, float(text[:-1]) / 100)
+        else:
+            buffer = (int(text), 0.0)
+    except ValueError:
+        buffer = (-1, 0.0)
+    if buffer[0] < 0 or buffer[1] < 0:
+        raise argparse.ArgumentTypeError(
+            f'buffer "{text}" is not a pod count or a percentage')
+    return buffer
+
+
+##
+# demand_windows: Peak reservations running at once in each window
+#
+# index: ReservationIndex of current and upcoming reservations
+# pod_ids: pods whose reservations count
+# start: start of the first window
+# horizon: timedelta covered by the windows
+# window: timedelta length of each window
+#
+# Returns a list of (window_start, window_end, peak).
+#
+def demand_windows(index, pod_ids, start, horizon, window):
+    windows = []
+    when = start
+    while when < start + horizon:
+        end = min(when + window, start + horizon)
+        windows.append((when, end, index.peak_demand(pod_ids, when, end)))
+        when = end
+    return windows
+
+
+##
+# pods_to_offline: Online pool pods with no reservation in a window
+#
+# plan: the pool's plan from pod_pool.plan_pools
+# all_pods: result of pod_list
+# index: ReservationIndex of current and upcoming reservations
+# start, end: the window
+#
+# Pods the plan deletes are left out; deleting offlines them anyway.
+#
+# Returns a list of (pod_id, pod_name).
+#
+def pods_to_offline(plan, all_pods, index, start, end):
+    deleted = {pod_id for pod_id, _ in plan['delete']}
+    return [(pod['pod_id'], pod['pod_name']) for pod in all_pods
+            if pod_pool.is_member(pod, plan['pool']['prefix'],
+                                  plan['pool']['source'])
+            and pod['pod_id'] not in deleted
+            and getattr(pod.get('pod_current_state'), 'name', None)
+            == 'ONLINE'
+            and index.is_free(pod['pod_id'], start, end)]
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Size a pod pool to the reservations coming up for its "
+        'pod type')
+    parser.add_argument('--src_pid',
+                        type=int,
+                        required=True,
+                        help="master pod the pool's pods are cloned from")
+    parser.add_argument('--pod_prefix',
+                        required=True,
+                        help="prefix of the pool's pod names")
+    parser.add_argument('--start',
+                        help='plan from this time, "[MM/DD/YYYY ]HH:MM"')
+    parser.add_argument('--horizon',
+                        type=float,
+                        default=24,
+                        help='hours ahead to provide for')
+    parser.add_argument('--window',
+                        type=float,
+                        default=60,
+                        help='minutes in each demand window')
+    parser.add_argument('--buffer',
+                        type=parse_buffer,
+                        default='10%',
+                        metavar='N|P%',
+                        help='pods to keep beyond peak demand, as a count '
+                        'or a percentage of the peak')
+    parser.add_argument('--min_pods',
+                        type=int,
+                        default=0,
+                        help='pods to keep however low demand is')
+    parser.add_argument('--clone_datastore',
+                        default='',
+                        help='datastore for new clones')
+    parser.add_argument('--host_weight',
+                        action='append',
+                        metavar='VH_ID=WEIGHT',
+                        help='relative capacity of a host (repeatable)')
+    parser.add_argument('--datacenter',
+                        help='datacenter whose hosts the pool is spread '
+                        'over (from environment var NETLAB_VDC if not '
+                        'specified)',
+                        default=os.environ.get('NETLAB_VDC'))
+    parser.add_argument('-r',
+                        '--removal_type',
+                        choices=tuple(t.name.lower() for t in RemoveVMS),
+                        default=RemoveVMS.DISK.name.lower(),
+                        help="how surplus pods' VMs are removed")
+    parser.add_argument('--max_per_host',
+                        type=int,
+                        default=1,
+                        help='clones or removals each host may run at once')
+    retry.add_arguments(parser)
+    parser.add_argument('-fresh',
+                        action='store_const',
+                        const=True,
+                        help='list from the server, not a saved snapshot')
+    parser.add_argument('-n',
+                        action='store_const',
+                        const=True,
+                        help='dry run')
+    parser.add_argument('-y',
+                        action='store_const',
+                        const=True,
+                        help='act without asking for confirmation')
+    parser.add_argument('-q',
+                        action='store_const',
+                        const=True,
+                        help='quiet (no per-pod messages)')
+    args = parser.parse_args()
+    if not args.datacenter:
+        parser.error('No datacenter given (--datacenter or NETLAB_VDC)')
+    if args.horizon <= 0 or args.window <= 0:
+        parser.error('--horizon and --window must be more than 0')
+    try:
+        host_weights = placement.parse_host_weights(args.host_weight)
+    except ValueError as err:
+        parser.error(str(err))
+    start = parse_time(args.start) if args.start else datetime.now()
+    window = timedelta(minutes=args.window)
+    clone_pod.Quiet = args.q
+    delete_pods.Quiet = args.q
+    set_pod_state.Quiet = args.q
+
+    async with api_trace.open_client() as api:
+        api = retry.wrap(api, args)
+
+        # A dry run may use a saved snapshot; real changes list afresh
+        all_pods, vms, hosts = await pod_pool.list_inventory(
+            api, args.datacenter, fresh=args.fresh or not args.n)
+        source = [pod for pod in all_pods if pod['pod_id'] == args.src_pid]
+        if not source:
+            print(f'Source pod {args.src_pid} does not exist',
+                  file=sys.stderr)
+            sys.exit(1)
+
+        # Demand is what the pool's pods are reserved for, window by
+        # window
+        pool_pids = [pod['pod_id'] for pod in all_pods
+                     if pod_pool.is_member(pod, args.pod_prefix,
+                                           args.src_pid)]
+        index = ReservationIndex(await list_reservations(api))
+        windows = demand_windows(index, pool_pids, start,
+                                 timedelta(hours=args.horizon), window)
+        print(f'Reservations of {args.pod_prefix}* pods running at once:')
+        for when, end, peak in windows:
+            print(f'  {when:%m/%d %H:%M}-{end:%H:%M}  {peak}')
+        peak = max((peak for _, _, peak in windows), default=0)
+        extra, fraction = args.buffer
+        target = max(args.min_pods, peak + extra + math.ceil(peak * fraction))
+        print(f'Peak {peak}; keeping {target} pods')
+
+        pool = {'name': args.pod_prefix,
+                'prefix': args.pod_prefix,
+                'source': args.src_pid,
+                'count': target,
+                'state': None,
+                'datastore': args.clone_datastore,
+                'host_weights': host_weights}
+        reserved = {pod_id for pod_id in pool_pids
+                    if not index.is_free(pod_id, start, datetime.max)}
+        plans, pod_hosts = pod_pool.plan_pools([pool], all_pods, vms, hosts,
+                                               reserved)
+        plans[0]['state'] = pods_to_offline(plans[0], all_pods, index,
+                                            start, start + window)
+        if plans[0]['state']:
+            pool['state'] = PodState.OFFLINE
+        pod_pool.print_plans(plans)
+        if args.n:
+            return
+        if not (plans[0]['clone'] or plans[0]['delete']
+                or plans[0]['state']):
+            print('Pool already matches demand')
+            return
+        if not args.y:
+            yes_no = input('Do you want to apply this plan (y/n)? ')
+            if yes_no[0].lower() != 'y':
+                sys.exit(2)
+
+        await pod_pool.apply_plans(api, plans, pod_hosts,
+                                   RemoveVMS[args.removal_type.upper()],
+                                   args.max_per_host)
+        print(api.report())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
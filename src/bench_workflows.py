@@ -0,0 +1,294 @@
+#! /usr/bin/env python3
+'''
+usage: bench_workflows.py [-h] [--sizes N,N,...] [--workflow WORKFLOW]
+                          [--hosts HOSTS] [--host_slots HOST_SLOTS]
+                          [--host_slowdown VH_ID=FACTOR]
+                          [--time_scale TIME_SCALE] [--jitter JITTER]
+                          [--failure_rate FAILURE_RATE]
+                          [--max_per_host MAX_PER_HOST] [--seed SEED]
+                          [--json FILE] [-debug]
+
+Benchmark pod workflows against an in-process fake Netlab
+
+options:
+  -h, --help            show this help message and exit
+  --sizes N,N,...       numbers of pods to run each workflow on
+                        (default 10,100,1000)
+  --workflow WORKFLOW   workflow to run: clone, delete, state or delete_vms
+                        (repeatable; default all)
+  --hosts HOSTS         number of vm hosts (default 4)
+  --host_slots HOST_SLOTS
+                        tasks each vm host runs at once (default 2)
+  --host_slowdown VH_ID=FACTOR
+                        make work on a host FACTOR times slower (repeatable)
+  --time_scale TIME_SCALE
+                        factor applied to nominal call latencies
+                        (default 0.001: a 60s clone takes 60ms)
+  --jitter JITTER       fraction by which latencies vary (default 0.2)
+  --failure_rate FAILURE_RATE
+                        chance that any one call fails (default 0)
+  --max_per_host MAX_PER_HOST
+                        workflow tasks run at once per host (default 1)
+  --seed SEED           seed for jitter and failures (default 1)
+  --json FILE           also write the results to FILE as JSON
+  -debug                show the workflows' own output
+
+Each workflow is run through the same functions the scripts use
+(clone_pod.do_clone, delete_pods.delete_pods,
+set_pod_state.change_pod_states and delete_unused_vms.do_delete_vms)
+against a fresh FakeNetlabClient (see fake_netlab.py).  For every
+workflow and size the wall time, throughput, failures and the
+utilisation of each host's task slots are reported, so a scheduling
+change can be measured before it is run on the real cluster.  Times
+are in scaled seconds; multiply by 1/time_scale for nominal seconds.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+
+from netlab.enums import PodCategory
+from netlab.enums import PodState
+from netlab.enums import RemoveVMS
+
+import clone_pod
+import delete_pods
+import delete_unused_vms
+import placement
+import pod_index
+import set_pod_state
+import snapshot
+from fake_netlab import FakeNetlabClient
+
+WORKFLOWS = ('clone', 'delete', 'state', 'delete_vms')
+
+MASTER_PID = 1
+
+
+##
+# populate: Fill a fake with what a workflow needs, spread over hosts
+#
+# api: FakeNetlabClient
+# workflow: name of the workflow
+# size: number of pods (or VMs) the workflow works on
+#
+# Returns the ids of the pods (or VMs) to work on.
+#
+def populate(api, workflow, size):
+    vh_ids = list(api.hosts)
+    api.add_pod(MASTER_PID, 'master', vh_ids[0], vms=2,
+                pod_cat=PodCategory.MASTER_VM)
+    if workflow == 'clone':
+        return clone_pod.allocate_pids(list(api.pods), size)
+    if workflow == 'delete_vms':
+        return [api.add_vm(f'orphan{number}', vh_ids[number % len(vh_ids)])
+                for number in range(size)]
+    pod_ids = list(range(MASTER_PID + 1, MASTER_PID + 1 + size))
+    for number, pod_id in enumerate(pod_ids):
+        api.add_pod(pod_id, f'pod{pod_id}', vh_ids[number % len(vh_ids)],
+                    vms=2)
+    return pod_ids
+
+
+async def bench_clone(api, pod_ids, max_per_host):
+    datacenter_id = await api.vm_datacenter_find(vdc_name=api.datacenter)
+    loads = await placement.get_host_loads(api, datacenter_id)
+    assignment = placement.weighted_assignment(pod_ids, loads, vms_per_pod=2)
+    await clone_pod.do_clone(api, MASTER_PID, assignment, 'bench', '',
+                             max_per_host=max_per_host)
+    return [pod_id for pod_id in pod_ids if pod_id not in api.pods]
+
+
+async def bench_delete(api, pod_ids, max_per_host):
+    pod_hosts = await pod_index.get_pod_hosts(api, api.datacenter)
+    await delete_pods.delete_pods(api, pod_ids, RemoveVMS.DISK, pod_hosts,
+                                  max_per_host=max_per_host)
+    return [pod_id for pod_id in pod_ids if pod_id in api.pods]
+
+
+async def bench_state(api, pod_ids, max_per_host):
+    pod_hosts = await pod_index.get_pod_hosts(api, api.datacenter)
+    results = await set_pod_state.change_pod_states(
+        api, pod_ids, [f'pod{pod_id}' for pod_id in pod_ids],
+        PodState.ONLINE, pod_hosts, max_per_host=max_per_host)
+    return [pod_id for pod_id, result in results.items()
+            if isinstance(result, BaseException)]
+
+
+async def bench_delete_vms(api, vm_ids, max_per_host):
+    by_host = {}
+    for vm_id in vm_ids:
+        by_host.setdefault(api.vms[vm_id]['vh_id'], []).append(vm_id)
+    await asyncio.gather(
+        *[delete_unused_vms.do_delete_vms(
+            api, ids, [api.vms[vm_id]['vm_name'] for vm_id in ids], 'disk')
+          for ids in by_host.values()])
+    return [vm_id for vm_id in vm_ids if vm_id in api.vms]
+
+
+BENCHMARKS = {'clone': bench_clone,
+              'delete': bench_delete,
+              'state': bench_state,
+              'delete_vms': bench_delete_vms}
+
+
+##
+# run_benchmark: Time one workflow on a fresh fake
+#
+# workflow: name of the workflow
+# size: number of pods (or VMs) to work on
+# fake_args: keyword arguments for FakeNetlabClient
+# max_per_host: workflow tasks run at once per host
+# debug: let the workflow print as it would from its script
+#
+# Returns a dict of results.
+#
+async def run_benchmark(workflow, size, fake_args, max_per_host, debug):
+    pod_index.invalidate()
+    async with FakeNetlabClient(**fake_args) as api:
+        items = populate(api, workflow, size)
+        output = contextlib.ExitStack()
+        if not debug:
+            output.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            output.enter_context(contextlib.redirect_stderr(io.StringIO()))
+        with output:
+            start = time.monotonic()
+            failed = await BENCHMARKS[workflow](api, items, max_per_host)
+            wall = time.monotonic() - start
+
+    return {'workflow': workflow,
+            'size': size,
+            'wall': wall,
+            'throughput': (size - len(failed)) / wall if wall else 0.0,
+            'failed': len(failed),
+            'calls': sum(api.calls.values()),
+            'utilisation': api.utilisation(wall)}
+
+
+def print_result(result):
+    hosts = ' '.join(f'{vh_id}:{util:.0%}'
+                     for vh_id, util in result['utilisation'].items())
+    print(f'{result["workflow"]:<10} {result["size"]:>5}'
+          f' {result["wall"]:>8.2f}s {result["throughput"]:>8.1f}/s'
+          f' {result["failed"]:>6} {result["calls"]:>6}  {hosts}')
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark pod workflows against an in-process '
+        'fake Netlab')
+    parser.add_argument('--sizes',
+                        default='10,100,1000',
+                        metavar='N,N,...',
+                        help='numbers of pods to run each workflow on')
+    parser.add_argument('--workflow',
+                        action='append',
+                        choices=WORKFLOWS,
+                        help='workflow to run (repeatable; default all)')
+    parser.add_argument('--hosts',
+                        type=int,
+                        default=4,
+                        help='number of vm hosts')
+    parser.add_argument('--host_slots',
+                        type=int,
+                        default=2,
+                        help='tasks each vm host runs at once')
+    parser.add_argument('--host_slowdown',
+                        action='append',
+                        metavar='VH_ID=FACTOR',
+                        help='make work on a host FACTOR times slower '
+                        '(repeatable)')
+    parser.add_argument('--time_scale',
+                        type=float,
+                        default=0.001,
+                        help='factor applied to nominal call latencies')
+    parser.add_argument('--jitter',
+                        type=float,
+                        default=0.2,
+                        help='fraction by which latencies vary')
+    parser.add_argument('--failure_rate',
+                        type=float,
+                        default=0.0,
+                        help='chance that any one call fails')
+    parser.add_argument('--max_per_host',
+                        type=int,
+                        default=1,
+                        help='workflow tasks run at once per host')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=1,
+                        help='seed for jitter and failures')
+    parser.add_argument('--json',
+                        metavar='FILE',
+                        help='also write the results to FILE as JSON')
+    parser.add_argument('-debug',
+                        action='store_const',
+                        const=True,
+                        help="show the workflows' own output")
+    args = parser.parse_args()
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        slowdown = placement.parse_host_weights(args.host_slowdown)
+    except ValueError as err:
+        print(f'Bad argument: {err}', file=sys.stderr)
+        sys.exit(1)
+    fake_args = {'hosts': args.hosts,
+                 'host_slots': args.host_slots,
+                 'host_slowdown': slowdown,
+                 'time_scale': args.time_scale,
+                 'jitter': args.jitter,
+                 'failure_rate': args.failure_rate,
+                 'seed': args.seed}
+
+    clone_pod.Quiet = True
+    delete_pods.Quiet = True
+
+    print(f'{"workflow":<10} {"size":>5} {"wall":>9} {"rate":>10}'
+          f' {"failed":>6} {"calls":>6}  host utilisation')
+    results = []
+    # Keep the fake's snapshots away from real ones, and clean them up
+    with tempfile.TemporaryDirectory(prefix='bench_netlab') as cache_dir:
+        snapshot.CACHE_DIR = cache_dir
+        for workflow in args.workflow or WORKFLOWS:
+            for size in sizes:
+                result = await run_benchmark(workflow, size, fake_args,
+                                             args.max_per_host, args.debug)
+                print_result(result)
+                results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
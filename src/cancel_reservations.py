@@ -1,6 +1,7 @@
 #! /usr/bin/env python3
 
 import argparse
+import asyncio
 import enum
 import sys
 import re
@@ -8,13 +9,70 @@ import re
 import datetime
 import exrex
 
-from netlab.client import Client
 from netlab.enums import PodState
-def main():
+
+import api_trace
+from reservations import list_reservations
+
+
+##
+# matching_reservations: Reservation ids that match an exrex pattern and
+# actually exist
+#
+# pattern: exrex pattern expanding to reservation ids
+# existing: ids (ints) of current reservations
+#
+# When the pattern expands to more ids than there are reservations, the
+# reservations are matched against the pattern instead of expanding it;
+# otherwise the expansion is streamed and checked one id at a time.
+# Either way the full expansion is never held in memory.
+#
+# Returns (ids, expanded) where ids lists the matching existing ids in
+# expansion order and expanded is how many ids the pattern covers.
+#
+def matching_reservations(pattern, existing):
+    expanded = exrex.count(pattern)
+    if expanded > len(existing):
+        prog = re.compile(pattern)
+        ids = sorted(res_id for res_id in existing
+                     if prog.fullmatch(str(res_id)))
+    else:
+        ids = [int(res_id) for res_id in exrex.generate(pattern)
+               if res_id.isnumeric() and int(res_id) in existing]
+    return ids, expanded
+
+
+##
+# cancel_reservations: Cancel reservations concurrently
+#
+# api: netlab client connection
+# res_ids: ids of reservations to cancel
+# max_inflight: cancellations that may run at once
+#
+async def cancel_reservations(api, res_ids, max_inflight):
+    limit = asyncio.Semaphore(max_inflight)
+
+    async def cancel(res_id):
+        async with limit:
+            print('Attempting cancellation of reservation '+str(res_id))
+            try:
+                result = await api.reservation_cancel(res_id=res_id)
+            except Exception as err:
+                result = f'FAILED {err}'
+        print('Cancellation Result:'+str(datetime.datetime.now())+':'+str(res_id)+':'+str(result))
+
+    await asyncio.gather(*[cancel(res_id) for res_id in res_ids])
+
+
+async def main():
 
     si = None
 
     parser = argparse.ArgumentParser(description='Cancel a number of NDG Reservations')
+    parser.add_argument('--max_inflight',
+                        type=int,
+                        default=8,
+                        help='cancellations that may run at once')
     parser.add_argument('res_ids',
                         help='reservation ids of pods to modify')
 
@@ -24,25 +82,23 @@ def main():
         print('No reservation IDs specified', file=sys.stderr)
         sys.exit(1)
 
-    args.res_ids = exrex.generate(args.res_ids)
-
-    # Get list of all VMs.
-    api = Client()
+    async with api_trace.open_client() as api:
 
-    res_id_copy = []
-    for res_id in args.res_ids:
-        res_id_copy.append(res_id)
-        print('  '+res_id)
+        # Only cancel ids that are real reservations
+        existing = {res['res_id'] for res in await list_reservations(api)}
+        res_ids, expanded = matching_reservations(args.res_ids, existing)
 
-    yes_no = input("Do you want to cancel these reservations? (y/n)? ")
-    if yes_no[0].lower() == 'y':
+        for res_id in res_ids:
+            print('  '+str(res_id))
+        print(f'{len(res_ids)} of {expanded} ids are current reservations')
+        if not res_ids:
+            return
 
-        for res_id in res_id_copy:
-            print('Attempting cancellation of reservation '+res_id)
-            result = api.reservation_cancel(res_id=int(res_id))
-            print('Cancellation Result:'+str(datetime.datetime.now())+':'+res_id+':'+result)
+        yes_no = input("Do you want to cancel these reservations? (y/n)? ")
+        if yes_no[0].lower() == 'y':
+            await cancel_reservations(api, res_ids, args.max_inflight)
 
 
 
 if __name__ == "__main__":
-   main()
+   asyncio.run(main())
@@ -3,9 +3,19 @@
 """
 clone_pod.py
 
-usage: clone_pod.py [-h] --src_pid SRC_PID --num_clones NUM_CLONES
-                    --pod_prefix POD_PREFIX
-                    [--clone_datastore CLONE_DATASTORE] [-debug] [-n] [-q]
+usage: clone_pod.py [-h] [--src_pid SRC_PID] [--num_clones NUM_CLONES]
+                    [--pod_prefix POD_PREFIX]
+                    [--clone_datastore CLONE_DATASTORE]
+                    [--placement {weighted,round_robin}]
+                    [--host_weight VH_ID=WEIGHT]
+                    [--straggler_factor STRAGGLER_FACTOR]
+                    [--max_per_host MAX_PER_HOST]
+                    [--max_inflight MAX_INFLIGHT]
+                    [--max_per_datastore MAX_PER_DATASTORE]
+                    [--tiered {off,keep,remove}] [--seed_prefix SEED_PREFIX]
+                    [--retries RETRIES] [-adaptive]
+                    [--journal JOURNAL] [-resume] [-no_steal]
+                    [-debug] [-n] [-q]
 
 Remove VMs from vcenter host
 
@@ -18,17 +28,75 @@ options:
                         prefix for cloned pod names
   --clone_datastore CLONE_DATASTORE
                         datastore for clones
+  --placement {weighted,round_robin}
+                        how clones are spread over hosts (default weighted)
+  --host_weight VH_ID=WEIGHT
+                        relative capacity of a host (repeatable, default 1)
+  --straggler_factor STRAGGLER_FACTOR
+                        report clones slower than this multiple of the
+                        median clone time (default 3.0)
+  --max_per_host MAX_PER_HOST
+                        clones each host may run at once (default 1)
+  --max_inflight MAX_INFLIGHT
+                        clones that may run at once overall (default no cap)
+  --max_per_datastore MAX_PER_DATASTORE
+                        clones that may run at once per datastore
+                        (default no cap)
+  --tiered {off,keep,remove}
+                        clone a seed pod per datastore/host first and clone
+                        the rest from it; keep or remove the seeds
+                        (removed seeds keep their disks)
+  --seed_prefix SEED_PREFIX
+                        prefix for seed pod names (default POD_PREFIX+"seed")
+  --retries RETRIES     times to retry a call that failed transiently
+                        (default 3)
+  -adaptive             tune calls in flight to server latency and errors
+  --journal JOURNAL     record the plan and each clone's progress in
+                        this file
+  -resume               finish the job recorded in --journal
+  -no_steal             keep every clone on its planned host
   -debug                debug mode (kind of verbose)
   -n                    dry run
   -q                    quiet (no pod messages)
 
-This script clones a master Netlab-VE+ pod and distributes the clones evenly
+This script clones a master Netlab-VE+ pod and distributes the clones
 across a set of hosts in a datacenter given by environment variable
 
   NETLAB_VDC
 
 To get the desired behavior, it determines the number of clones and
-available pod numbers and shuffles them across datacenter hosts.
+available pod numbers and places them on datacenter hosts.  With the
+default weighted placement, each host's current load is measured from
+the datacenter VM inventory and clones go to the least loaded hosts
+(relative to any --host_weight given), so a crowded host receives fewer
+clones than an idle one.  Round robin placement deals the clones out
+evenly regardless of load.
+
+Hosts then clone their pods, up to --max_per_host at a time, subject to
+the overall --max_inflight and --max_per_datastore caps.  A host that
+finishes early takes pending clones from the host with the most left, so
+one slow host does not hold up the whole run (unless -no_steal is
+given).  Clones that run far longer than the median clone time are
+reported as stragglers.
+
+With --tiered keep or --tiered remove, one seed pod is first cloned from
+the master onto each target datastore (or each target host when no
+datastore is given) and every other clone copies from its local seed,
+turning one storage bottleneck at the master into parallel local copies.
+Unless --tiered keep is given, the seed pods are removed afterwards and
+their VMs taken out of the datacenter inventory, but their disks are
+left in place: clones made from a seed may be linked clones that still
+read from its disks.
+
+With --journal, the plan (pod ids, hosts, seeds) and each clone's start
+and result are appended to the journal file and synced to disk as the
+run goes.  If the run dies, -resume with the same --journal finishes
+that plan instead of making a new one (--src_pid, --num_clones and
+--pod_prefix are then taken from the journal).  Clones recorded as done
+are skipped; clones that were in flight or failed are checked against
+the live inventory: a complete clone is kept, a partial one is removed
+and cloned again, and a pod id since taken by another pod is reported
+and left alone.
 
 MIT License
 
@@ -56,93 +124,448 @@ SOFTWARE.
 
 import argparse
 import asyncio
-from netlab.async_client import NetlabClient
 from typing import List, Any, Tuple, Union
 
 from netlab.enums import PodCategory
 from netlab.enums import HDRSeverity
+from netlab.enums import RemoveVMS
 import sys
 import os
 
+import api_trace
+import placement
+import retry
+from journal import Journal, JournalError, read_journal
+import snapshot
+from scheduler import WorkStealingScheduler
+
+Debug = False
+Dryrun = False
+Quiet = False
+Summary = []
+
 
 ##
-# do_one_vh: Clones the src_pid pod to each of the pod_ids,
+# clone_one_pod: Clones the src_pid pod to pod_id,
 # creating cloned vms on host vh_id associated with
 # the specified datastore.
 #
 # api: netlab client connection
 # src_pid: id of pod to clone
 # vh_id: id of vmhost to clone vms to
-# pod_ids: ids of pods to be created
+# pod_id: id of pod to be created
 # pod_prefix: prefix of name to assign to pod. Suffix is the pod_id
 # datastore: Either '' or name of datastore on which to store the vms
+# clone_role: role of the cloned pod ('NORMAL' or 'MASTER')
+# journal: optional Journal recording the clone's start and result
+# pod_name: name for the pod, if not pod_prefix followed by pod_id
+#
+# Returns True if the clone was made (or would be, in a dry run).
 #
-async def do_one_vh(api,
-                    src_pid,
-                    vh_id,
-                    pod_ids,
-                    pod_prefix,
-                    datastore):
+async def clone_one_pod(api,
+                        src_pid,
+                        vh_id,
+                        pod_id,
+                        pod_prefix,
+                        datastore,
+                        clone_role='NORMAL',
+                        journal=None,
+                        pod_name=None):
     global Debug
     global Dryrun
     global Quiet
     global Summary
 
-    for pod_id in pod_ids:
+    pod_name = pod_name or f'{pod_prefix}{pod_id}'
+    try:
+        if Dryrun or not Quiet:
+            print(f'requested pod_clone_task({src_pid},'
+                  f'{pod_id},{pod_name},{vh_id})')
+        if Dryrun:
+            return True
+
+        if journal:
+            journal.start(pod_id)
+        specs = {'clone_datastore': datastore,
+                 'clone_role': clone_role,
+                 'clone_vh_id': vh_id}
+        result = \
+            await api.pod_clone_task(source_pod_id=src_pid,
+                                     clone_pod_id=pod_id,
+                                     clone_pod_name=pod_name,
+                                     pc_clone_specs=specs,
+                                     severity_level=HDRSeverity.TRACE0)
+        Summary.append(f'{result["status"]}:{pod_id}')
+        if not Quiet:
+            print(f'{result["status"]}:{pod_id}')
+        if Debug:
+            print(f'result:{result}')
+        if journal:
+            journal.finish(pod_id, True)
+        return True
+    except Exception as err:
+        print(f'Exception:{err}')
+        print(f'  pod_id:{pod_id},pod_name:{pod_name},'
+              f'datastore:"{datastore}",vh_id:{vh_id}')
+        if journal:
+            journal.finish(pod_id, False, str(err))
+        return False
+
+
+##
+# make_seeds: Clone one seed pod from src_pid per datastore (or per host
+# when no datastore is given) for tiered cloning.
+#
+# api: netlab client connection
+# src_pid: id of the master pod
+# vh_ids: ids of vm hosts that will receive clones
+# seed_pids: ids for the seed pods, at least one per seed to be made
+# seed_prefix: prefix of seed pod names. Suffix is the pod_id
+# datastore: Either '' or name of datastore on which to store the vms
+# journal: optional Journal recording each seed's start and result
+# ready: ids of seeds that already exist (from a resumed run)
+#
+# Returns a dict from vh_id to the pod id each host should clone from;
+# hosts whose seed could not be made fall back to src_pid.
+#
+async def make_seeds(api,
+                     src_pid,
+                     vh_ids,
+                     seed_pids,
+                     seed_prefix,
+                     datastore,
+                     journal=None,
+                     ready=()):
+    seed_hosts = {}
+    for vh_id in vh_ids:
+        seed_hosts.setdefault(datastore or vh_id, vh_id)
+    seeds = dict(zip(seed_hosts, seed_pids))
+
+    async def make(group):
+        if seeds[group] in ready:
+            return True
+        return await clone_one_pod(api, src_pid, seed_hosts[group],
+                                   seeds[group], seed_prefix, datastore,
+                                   clone_role='MASTER', journal=journal)
+
+    results = await asyncio.gather(*[make(group) for group in seeds])
+    made = {group: seeds[group]
+            for group, ok in zip(seeds, results) if ok}
+    for group in seeds:
+        if group not in made:
+            print(f'Seed pod {seeds[group]} failed; clones for "{group}"'
+                  f' will copy from {src_pid}')
+    return {vh_id: made.get(datastore or vh_id, src_pid) for vh_id in vh_ids}
+
+
+##
+# remove_seeds: Remove seed pods once cloning is done
+#
+# The seeds' VMs leave the datacenter inventory but keep their disks,
+# which linked clones made from a seed go on reading from.
+#
+# api: netlab client connection
+# seed_pids: ids of seed pods to remove
+# journal: optional Journal recording each removal
+#
+async def remove_seeds(api, seed_pids, journal=None):
+    for pod_id in seed_pids:
+        if Dryrun or not Quiet:
+            print(f'removing seed pod {pod_id}')
+        if Dryrun:
+            continue
         try:
-            pod_name = f'{pod_prefix}{pod_id}'
-            if Dryrun or not Quiet:
-                print(f'requested pod_clone_task({src_pid},'
-                      f'{pod_id},{pod_name},{vh_id})')
-            if Dryrun:
-                return
-
-            specs = {'clone_datastore': datastore,
-                     'clone_role': 'NORMAL',
-                     'clone_vh_id': vh_id}
-            result = \
-                await api.pod_clone_task(source_pod_id=src_pid,
-                                         clone_pod_id=pod_id,
-                                         clone_pod_name=pod_name,
-                                         pc_clone_specs=specs,
-                                         severity_level=HDRSeverity.TRACE0)
-            Summary.append(f'{result["status"]}:{pod_id}')
-            if not Quiet:
-                print(f'{result["status"]}:{pod_id}')
-            if Debug:
-                print(f'result:{result}')
+            await api.pod_remove_task(pod_id=pod_id,
+                                      remove_vms=RemoveVMS.DATACENTER)
+            Summary.append(f'seed removed:{pod_id}')
+            if journal:
+                journal.removed(pod_id)
         except Exception as err:
-            print(f'Exception:{err}')
-            print(f'  pod_id:{pod_id},pod_name:{pod_name},'
-                  f'datastore:"{datastore}",vh_id:{vh_id}')
+            print(f'Exception removing seed pod {pod_id}:{err}')
+
+
+def report_straggler(vh_id, pod_id, elapsed, median):
+    print(f'Straggler: pod {pod_id} on vh_id {vh_id} running {elapsed:.0f}s'
+          f' (median clone {median:.0f}s); vh_id {vh_id} takes no other'
+          f' hosts\' clones while it runs')
 
 
 ##
 # do_clone: Clone pods
 #
+# Each vm_host works through its own list of pods.  Unless steal is
+# False, a host that runs out of pods takes pending pods from the host
+# with the most left (cloning them onto itself instead), so fast hosts
+# pick up the slack from slow ones.
+#
 # api: netlab client connection
 # src_pid: id of pod to clone
 # pid_assignment_dict: map from vm_host id to list of pods on that vm_host
 # pod_prefix: Prefix of name of pod to be created. Suffix will be pod_id
 # datastore: Either '' or name of datastore on which to store the vms
+# steal: whether idle hosts take pods assigned to busy hosts
+# straggler_factor: multiple of median clone time that marks a straggler
+# max_per_host: clones each host may run at once
+# max_inflight: clones that may run at once overall (None: no cap)
+# max_per_datastore: clones that may run at once against one datastore
+#                    (None: no cap). With no datastore given, each host's
+#                    default datastore is counted separately.
+# seed_pids: ids for seed pods; if given, cloning is tiered: a seed is
+#            cloned from src_pid onto each datastore (or host) first and
+#            the remaining pods are cloned from their local seed
+# seed_prefix: prefix of seed pod names
+# keep_seeds: leave the seed pods in place after cloning
+# journal: optional Journal recording each clone's start and result
+# ready_seeds: ids of seed pods that already exist (from a resumed run)
+# host_limits: optional dict from vh_id to a semaphore shared with
+#              other jobs on the hosts (see WorkStealingScheduler.run)
+#
+# Returns the scheduler, which records steals and stragglers.
 #
 async def do_clone(api,
                    src_pid,
                    pid_assignment_dict,
                    pod_prefix,
-                   datastore):
+                   datastore,
+                   steal=True,
+                   straggler_factor=3.0,
+                   max_per_host=1,
+                   max_inflight=None,
+                   max_per_datastore=None,
+                   seed_pids=None,
+                   seed_prefix=None,
+                   keep_seeds=False,
+                   journal=None,
+                   ready_seeds=(),
+                   host_limits=None):
     if Debug:
         print(f'do_clone({src_pid},pid_assignment_dict,'
               f'{pod_prefix},"{datastore}")')
-    tasks = []
-    for vh_id in pid_assignment_dict.keys():
-        tasks.append(asyncio.create_task(do_one_vh(api,
-                                                   src_pid,
-                                                   vh_id,
-                                                   pid_assignment_dict[vh_id],
-                                                   pod_prefix,
-                                                   datastore)))
-    await asyncio.gather(*tasks, return_exceptions=True)
+
+    vh_ids = [vh_id for vh_id in pid_assignment_dict
+              if pid_assignment_dict[vh_id]]
+    if seed_pids:
+        source = await make_seeds(api, src_pid, vh_ids, seed_pids,
+                                  seed_prefix or f'{pod_prefix}seed',
+                                  datastore, journal, ready_seeds)
+    else:
+        source = {}
+
+    async def worker(vh_id, pod_id):
+        return await clone_one_pod(api, source.get(vh_id, src_pid), vh_id,
+                                   pod_id, pod_prefix, datastore,
+                                   journal=journal)
+
+    sched = WorkStealingScheduler(pid_assignment_dict,
+                                  steal=steal and not Dryrun,
+                                  straggler_factor=straggler_factor,
+                                  on_straggler=report_straggler)
+    await sched.run(worker,
+                    slots_per_host=max_per_host,
+                    max_inflight=max_inflight,
+                    group_of=lambda vh_id: datastore or vh_id,
+                    max_per_group=max_per_datastore,
+                    host_limits=host_limits)
+
+    if seed_pids and not keep_seeds:
+        await remove_seeds(api,
+                           sorted(set(source.values()) - {src_pid}),
+                           journal)
+    return sched
+
+
+##
+# allocate_pids: Choose ids for new pods
+#
+# pod_ids: ids of pods that already exist (or are otherwise taken)
+# count: number of ids needed
+#
+# Unused low pod numbers are handed out first, then numbers above the
+# current high water mark.
+#
+def allocate_pids(pod_ids, count):
+    pid_hwm = max(pod_ids, default=0)
+    unused_low_pods = sorted(set(range(1, pid_hwm)) - set(pod_ids))
+    return unused_low_pods[:count] \
+        + list(range(pid_hwm+1, pid_hwm+1+count-len(unused_low_pods)))
+
+
+##
+# seed_groups: What the seeds of a tiered clone serve, in order: the
+# datastore, or each host given pods when no datastore is given
+#
+# pid_assignment_dict: map from vm_host id to list of pods on that vm_host
+# datastore: Either '' or name of datastore on which to store the vms
+#
+def seed_groups(pid_assignment_dict, datastore):
+    groups = []
+    for vh_id in pid_assignment_dict:
+        if pid_assignment_dict[vh_id] and (datastore or vh_id) not in groups:
+            groups.append(datastore or vh_id)
+    return groups
+
+
+##
+# plan_clones: Choose pod ids and hosts for a new clone job
+#
+# api: netlab client connection
+# args: parsed command line arguments
+# datacenter_id: id of the datacenter holding the hosts
+# vh_ids: ids of the datacenter's vm hosts
+# src_pod: pod_get result (with remote_pc) for the source pod
+#
+# Returns (pid_assignment_dict, seed_pids) for do_clone.
+#
+async def plan_clones(api, args, datacenter_id, vh_ids, src_pod):
+    # find currently allocated pods
+    pod_ids = list(map(lambda x: x["pod_id"], await api.pod_list()))
+
+    # get sorted list of available pids
+    # (assign unused low pod numbers first)
+    pids_to_assign = allocate_pids(pod_ids, int(args.num_clones))
+
+    # identify available hosts for VMs
+    num_hosts = len(vh_ids)
+
+    # Divvy up pods (or at least args to create them) to VM hosts.
+    #
+    # The theory is that students will grab them in order and this will
+    # do a static load balancing based on expected human behavior, so
+    # both placements deal consecutive pids to different hosts.
+
+    if Debug:
+        print(f'{vh_ids}, {len(vh_ids)}')
+        print(f'pids to assign:{pids_to_assign}')
+
+    try:
+        if args.placement == 'round_robin':
+            pid_assignment_dict = \
+                placement.round_robin_assignment(pids_to_assign, vh_ids)
+        else:
+            weights = placement.parse_host_weights(args.host_weight)
+            host_loads = await placement.get_host_loads(api, datacenter_id)
+            if Debug:
+                print(f'host loads:{host_loads} weights:{weights}')
+            pid_assignment_dict = \
+                placement.weighted_assignment(pids_to_assign,
+                                              host_loads,
+                                              len(src_pod['remote_pc'] or []),
+                                              weights)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+    if Debug:
+        print(f'{args.src_pid} {args.pod_prefix}'
+              f'{vh_ids} {pid_assignment_dict} {num_hosts}')
+
+    # For tiered cloning, set aside one more pid per seed
+    # (one per datastore, or per target host without a datastore)
+    seed_pids = None
+    if args.tiered != 'off':
+        num_seeds = len(seed_groups(pid_assignment_dict,
+                                    args.clone_datastore))
+        seed_pids = allocate_pids(pod_ids + pids_to_assign, num_seeds)
+        if Debug:
+            print(f'seed pids:{seed_pids}')
+
+    return pid_assignment_dict, seed_pids
+
+
+##
+# reconcile_clones: Find which pods of a journaled clone job are finished
+#
+# api: netlab client connection
+# pod_names: dict from each planned pod id (clones and seeds) to its name
+# states: dict from pod id to its last journaled event
+# vms_per_pod: number of VMs in a complete clone
+# journal: Journal to record what is found in (None in a dry run)
+#
+# Pods journaled as done or removed are finished.  Any other planned pod
+# that exists is checked: one with the planned name and all its VMs is
+# finished, one with fewer VMs (a clone cut short) is removed so it can
+# be cloned again, and one with another name (its id taken since) is a
+# conflict and is left alone.
+#
+# Returns (finished, conflicts): sets of pod ids not to clone.
+#
+async def reconcile_clones(api, pod_names, states, vms_per_pod, journal):
+    live = {pod['pod_id']: pod['pod_name'] for pod in await api.pod_list()}
+    finished = set()
+    conflicts = set()
+    for pod_id, pod_name in pod_names.items():
+        if states.get(pod_id) in ('done', 'removed'):
+            finished.add(pod_id)
+        elif pod_id not in live:
+            continue
+        elif live[pod_id] != pod_name:
+            print(f'Pod id {pod_id} now belongs to {live[pod_id]};'
+                  f' not cloning {pod_name}')
+            conflicts.add(pod_id)
+        else:
+            props = await api.pod_get(pod_id=pod_id, properties='remote_pc')
+            if len(props['remote_pc'] or []) >= vms_per_pod:
+                if journal:
+                    journal.finish(pod_id, True, 'found complete')
+                finished.add(pod_id)
+                continue
+            print(f'Removing partial clone {pod_name}')
+            if Dryrun:
+                continue
+            await api.pod_remove_task(pod_id=pod_id,
+                                      remove_vms=RemoveVMS.DISK)
+            if journal:
+                journal.finish(pod_id, False, 'partial clone removed')
+    return finished, conflicts
+
+
+##
+# resume_clones: Work out what is left of a journaled clone job
+#
+# api: netlab client connection
+# plan: the job's journaled plan
+# states: dict from pod id to its last journaled event
+# vms_per_pod: number of VMs in a complete clone
+# journal: Journal to record what is found in (None in a dry run)
+#
+# Returns (pid_assignment_dict, seed_pids, ready_seeds, stale_seeds):
+# the pods still to clone on each host, the seeds they need (in
+# do_clone order), which of those seeds already exist, and finished
+# seeds no remaining clone needs.
+#
+async def resume_clones(api, plan, states, vms_per_pod, journal):
+    assignment = {int(vh_id): pod_ids
+                  for vh_id, pod_ids in plan['assignment'].items()}
+    datastore = plan['clone_datastore']
+    seed_prefix = plan['seed_prefix'] or f'{plan["pod_prefix"]}seed'
+    pod_names = {pod_id: f'{plan["pod_prefix"]}{pod_id}'
+                 for pod_ids in assignment.values() for pod_id in pod_ids}
+    for pod_id in plan['seed_pids'] or []:
+        pod_names[pod_id] = f'{seed_prefix}{pod_id}'
+
+    finished, conflicts = \
+        await reconcile_clones(api, pod_names, states, vms_per_pod, journal)
+    remaining = {vh_id: [pod_id for pod_id in pod_ids
+                         if pod_id not in finished | conflicts]
+                 for vh_id, pod_ids in assignment.items()}
+
+    seed_pids = None
+    ready_seeds = set()
+    stale_seeds = []
+    if plan['seed_pids']:
+        seed_of = dict(zip(seed_groups(assignment, datastore),
+                           plan['seed_pids']))
+        seed_pids = [seed_of[group]
+                     for group in seed_groups(remaining, datastore)]
+        existing = {pod_id for pod_id in plan['seed_pids']
+                    if pod_id in finished and states.get(pod_id) != 'removed'}
+        ready_seeds = existing & set(seed_pids)
+        stale_seeds = sorted(existing - set(seed_pids))
+
+    todo = sum(len(pod_ids) for pod_ids in remaining.values())
+    print(f'Resuming: {len(finished)} pods finished, {todo} to clone,'
+          f' {len(conflicts)} ids taken by other pods')
+    return remaining, seed_pids, ready_seeds, stale_seeds
 
 
 async def main():
@@ -156,18 +579,59 @@ async def main():
     parser = \
         argparse.ArgumentParser(description='Remove VMs from vcenter host')
     parser.add_argument('--src_pid',
-                        required=True,
                         help='source pod id')
     parser.add_argument('--num_clones',
-                        required=True,
                         help='number of clones to generate')
     parser.add_argument('--pod_prefix',
-                        required=True,
                         help='prefix for cloned pod names')
     parser.add_argument('--clone_datastore',
                         required=False,
                         help='datastore for clones',
                         default='')
+    parser.add_argument('--placement',
+                        choices=('weighted', 'round_robin'),
+                        default='weighted',
+                        help='how clones are spread over hosts')
+    parser.add_argument('--host_weight',
+                        action='append',
+                        metavar='VH_ID=WEIGHT',
+                        help='relative capacity of a host (repeatable)')
+    parser.add_argument('--straggler_factor',
+                        type=float,
+                        default=3.0,
+                        help='report clones slower than this multiple '
+                        'of the median clone time')
+    parser.add_argument('--max_per_host',
+                        type=int,
+                        default=1,
+                        help='clones each host may run at once')
+    parser.add_argument('--max_inflight',
+                        type=int,
+                        help='clones that may run at once overall')
+    parser.add_argument('--max_per_datastore',
+                        type=int,
+                        help='clones that may run at once per datastore')
+    parser.add_argument('--tiered',
+                        choices=('off', 'keep', 'remove'),
+                        default='off',
+                        help='clone a seed pod per datastore/host first and '
+                        'clone the rest from it; keep or remove the seeds '
+                        '(removed seeds keep their disks)')
+    parser.add_argument('--seed_prefix',
+                        help='prefix for seed pod names '
+                        '(default POD_PREFIX + "seed")')
+    retry.add_arguments(parser)
+    parser.add_argument('--journal',
+                        help="record the plan and each clone's progress "
+                        'in this file')
+    parser.add_argument('-resume',
+                        action='store_const',
+                        const=True,
+                        help='finish the job recorded in --journal')
+    parser.add_argument('-no_steal',
+                        action='store_const',
+                        const=True,
+                        help='keep every clone on its planned host')
     parser.add_argument('-debug',
                         action='store_const',
                         const=True,
@@ -181,68 +645,101 @@ async def main():
                         const=True,
                         help='quiet (no pod messages)')
     args = parser.parse_args()
-    num_clones = int(args.num_clones)
+    if args.resume:
+        if not args.journal:
+            parser.error('-resume needs --journal')
+        try:
+            plan, states = read_journal(args.journal)
+        except (OSError, JournalError) as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        if plan.get('job') != 'clone':
+            print(f'{args.journal} is not a clone journal', file=sys.stderr)
+            sys.exit(1)
+        for key in ('src_pid', 'pod_prefix', 'clone_datastore', 'tiered',
+                    'seed_prefix'):
+            setattr(args, key, plan[key])
+    elif not (args.src_pid and args.num_clones and args.pod_prefix):
+        parser.error('--src_pid, --num_clones and --pod_prefix are required')
+    journal = Journal(args.journal) if args.journal and not args.n else None
     Debug = args.debug
     Dryrun = args.n
     Quiet = args.q
 
-    async with NetlabClient() as api:
+    async with api_trace.open_client() as api:
+        api = retry.wrap(api, args)
         datacenter_id = \
             await api.vm_datacenter_find(vdc_name=os.environ['NETLAB_VDC'])
         vh_ids = list(map(lambda x: x['vh_id'],
                           await api.vm_host_list(vdc_id=datacenter_id)))
 
         # Check for valid source pid
-        src_pod_cat = (await api.pod_get(pod_id=args.src_pid,
-                                         properties='pod_cat'))['pod_cat']
-        if src_pod_cat != PodCategory.MASTER_VM:
+        src_pod = await api.pod_get(pod_id=args.src_pid,
+                                    properties=['pod_cat', 'remote_pc'])
+        if src_pod['pod_cat'] != PodCategory.MASTER_VM:
             print('Sorry. We will not copy from a non-Master pod.')
             sys.exit()
 
-        # find currently allocated pods
-        pod_ids = list(map(lambda x: x["pod_id"], await api.pod_list()))
-        pid_hwm = max(pod_ids)
-
-        # get sorted list of available pids
-        # (assign unused low pod numbers first)
-        unused_low_pods = list(set(range(1, pid_hwm)) - set(pod_ids))
-        pids_to_assign = unused_low_pods[:num_clones] \
-            + list(range(pid_hwm+1, pid_hwm+1+num_clones-len(unused_low_pods)))
-
-        # identify available hosts for VMs
-        num_hosts = len(vh_ids)
-
-        # Divvy up pods (or at least args to create them) to VM hosts
-        # in round robin fashion.
-        #
-        # The theory is that students will grab them in order and this will
-        # do a static load balancing based on expected human behavior
-
-        if Debug:
-            print(f'{vh_ids}, {len(vh_ids)}')
-            print(f'pids to assign:{pids_to_assign}')
-
-        pid_assignment_dict = {vh_ids[i]:
-                               pids_to_assign[i:
-                                              len(pids_to_assign):
-                                              len(vh_ids)]
-                               for i in range(0, len(vh_ids))}
-
-        if Debug:
-            print(f'{args.src_pid} {args.pod_prefix}'
-                  f'{vh_ids} {pid_assignment_dict} {num_hosts}')
-
-        await do_clone(api,
-                       args.src_pid,
-                       pid_assignment_dict,
-                       args.pod_prefix,
-                       args.clone_datastore)
+        stale_seeds = []
+        if args.resume:
+            if journal:
+                journal.open()
+            pid_assignment_dict, seed_pids, ready_seeds, stale_seeds = \
+                await resume_clones(api, plan, states,
+                                    len(src_pod['remote_pc'] or []), journal)
+        else:
+            pid_assignment_dict, seed_pids = \
+                await plan_clones(api, args, datacenter_id, vh_ids, src_pod)
+            ready_seeds = ()
+            if journal:
+                try:
+                    journal.open({'job': 'clone',
+                                  'src_pid': args.src_pid,
+                                  'pod_prefix': args.pod_prefix,
+                                  'clone_datastore': args.clone_datastore,
+                                  'tiered': args.tiered,
+                                  'seed_prefix': args.seed_prefix,
+                                  'assignment': pid_assignment_dict,
+                                  'seed_pids': seed_pids})
+                except JournalError as err:
+                    print(err, file=sys.stderr)
+                    sys.exit(1)
+
+        sched = await do_clone(api,
+                               args.src_pid,
+                               pid_assignment_dict,
+                               args.pod_prefix,
+                               args.clone_datastore,
+                               steal=not args.no_steal,
+                               straggler_factor=args.straggler_factor,
+                               max_per_host=args.max_per_host,
+                               max_inflight=args.max_inflight,
+                               max_per_datastore=args.max_per_datastore,
+                               seed_pids=seed_pids,
+                               seed_prefix=args.seed_prefix,
+                               keep_seeds=args.tiered == 'keep',
+                               journal=journal,
+                               ready_seeds=ready_seeds)
+        if stale_seeds and args.tiered == 'remove':
+            await remove_seeds(api, stale_seeds, journal)
+        if journal:
+            journal.close()
 
     if Dryrun:
         print('No action taken (dry run).')
+    else:
+        snapshot.invalidate()
     Summary.sort()
     separator = '\n  '
+    print(f'Limits: max_per_host={args.max_per_host}'
+          f' max_inflight={args.max_inflight or "none"}'
+          f' max_per_datastore={args.max_per_datastore or "none"}')
     print(f'Pod Summary:{separator}{separator.join(Summary)}')
+    for pod_id, from_vh, to_vh in sched.steals:
+        print(f'  pod {pod_id} moved from vh_id {from_vh} to vh_id {to_vh}')
+    for vh_id, pod_id in sched.stragglers:
+        print(f'  straggler: pod {pod_id} on vh_id {vh_id}')
+    print(api.report())
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,13 +1,17 @@
 #! /usr/bin/env python3
 
 import argparse
+import asyncio
+import sys
 
 DEFAULT_COM_ID = 1
 
-from netlab.client import Client
 from netlab.enums import DateFormat, TimeFormat
 
-def main():
+import api_trace
+import accounts
+
+async def main():
 
     si = None
 
@@ -23,6 +27,13 @@ def main():
     parser.add_argument('--passwd',
                         required=True,
                         help='Initial password for account')
+    parser.add_argument('--class_spec',
+                        help='cls_id or (partial) name of class for the accounts '
+                        '(asked for interactively if omitted)')
+    parser.add_argument('--max_inflight',
+                        type=int,
+                        default=8,
+                        help='accounts that may be created at once')
     parser.add_argument('-n',
                         action='store_const',
                         const=True,
@@ -32,36 +43,48 @@ def main():
 
 
 
-    # Get list of all VMs.
-    api = Client()
+    async with api_trace.open_client() as api:
+
+        # List class CLIs
 
-    # List class CLIs
+        class_list = await api.class_list(properties=['cls_name','cls_id','com_id'])
 
-    class_list = api.class_list(properties=['cls_name','cls_id'])
-    print(class_list)
+        if args.class_spec:
+            class_entry = accounts.find_class(args.class_spec, class_list)
+            if class_entry is None:
+                print(f'Class "{args.class_spec}" not found or not unique',
+                      file=sys.stderr)
+                sys.exit(1)
+        else:
+            print(class_list)
 
-    print('\n length of class_list:' + str(len(class_list)))
+            print('\n length of class_list:' + str(len(class_list)))
 
-    for cls_entry in range(len(class_list)):
-        print(str(cls_entry) + ': ' + class_list[cls_entry]['cls_name'] + '\n')
-    class_num = int(input('Enter class number for this account:'))
-        
-    if args.CSE235:
-        suffixes = list(chr(x + ord('A')) + str(y) for x in range(0,14) for y in range(1,10))
-    else:
-        suffixes = list(map(str, range(1,int(args.num_accts))))
+            for cls_entry in range(len(class_list)):
+                print(str(cls_entry) + ': ' + class_list[cls_entry]['cls_name'] + '\n')
+            class_num = int(input('Enter class number for this account:'))
+            class_entry = class_list[class_num]
 
-    for suffix in suffixes:
-        acct_name = args.acct_prefix + suffix
-        if not args.n:
-            api.user_account_add(com_id = class_list[class_num]['com_id'],
-                                 acc_user_id = acct_name,
-                                 acc_password = args.passwd,
-                                 acc_pw_change = False,
-                                 cls_id = class_list[class_num]['cls_id'],
-                                 acc_full_name = acct_name)
+        if args.CSE235:
+            suffixes = list(chr(x + ord('A')) + str(y) for x in range(0,14) for y in range(1,10))
         else:
-            print(acct_name)
-            
+            suffixes = list(map(str, range(1,int(args.num_accts))))
+        acct_names = [args.acct_prefix + suffix for suffix in suffixes]
+
+        if args.n:
+            for acct_name in acct_names:
+                print(acct_name)
+            return
+
+        # Skip accounts that already exist so the run can be repeated
+        existing = [x['acc_user_id'] for x in await api.user_account_list()]
+        results = await accounts.add_accounts(api,
+                                              acct_names,
+                                              class_entry,
+                                              args.passwd,
+                                              existing,
+                                              args.max_inflight)
+        accounts.print_results('Account Summary', results)
+
 if __name__ == "__main__":
-   main()
+   asyncio.run(main())
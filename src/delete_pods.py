@@ -4,6 +4,11 @@ delete_pods.py
 
 usage: delete_pods.py [-h] [-n] [-offline_only] [-force] [-q]
                       [-r {none,local,datacenter,disk}]
+                      [--max_lookup MAX_LOOKUP] [--max_offline MAX_OFFLINE]
+                      [--max_remove MAX_REMOVE] [--max_per_host MAX_PER_HOST]
+                      [--datacenter DATACENTER] [--exclude EXPR] [-fresh]
+                      [--retries RETRIES] [-adaptive]
+                      [--journal JOURNAL] [-resume]
                       ...
 
 Delete NDG Netlab Pods
@@ -18,6 +23,41 @@ options:
   -force
   -q
   -r {none,local,datacenter,disk}, --removal_type {none,local,datacenter,disk}
+  --max_lookup MAX_LOOKUP
+                        pod lookups that may run at once (default 8)
+  --max_offline MAX_OFFLINE
+                        pods that may be offlined at once (default 8)
+  --max_remove MAX_REMOVE
+                        pods that may be removed at once overall
+                        (default no cap)
+  --max_per_host MAX_PER_HOST
+                        pods that may be removed at once per vm_host
+                        (default 1)
+  --datacenter DATACENTER
+                        datacenter whose inventory maps pods to hosts
+                        (from environment var NETLAB_VDC if not specified)
+  --exclude EXPR        regular expression for names of pods to leave out
+                        (repeatable)
+  -fresh                list from the server, not a saved snapshot
+                        (dry runs use a snapshot up to five minutes old)
+  --retries RETRIES     times to retry a call that failed transiently
+                        (default 3)
+  -adaptive             tune calls in flight to server latency and errors
+  --journal JOURNAL     record the pods and each removal's progress in
+                        this file
+  -resume               finish the job recorded in --journal
+
+Each pod is looked up, offlined and removed as soon as there is room in
+the next stage, so removals start while other pods are still being
+offlined.  Pods are mapped to hosts from a single inventory listing of
+the datacenter; only pods missing from it are looked up individually.
+A dry run (-n) only looks the pods up.
+
+With --journal, the pods to delete and each pod's start and result are
+appended to the journal file and synced to disk as the run goes.  If
+the run dies, -resume with the same --journal finishes that job (no
+podexprs are needed): pods recorded as done are skipped, pods no longer
+in inventory are recorded as done, and the rest are deleted again.
 
 MIT License
 
@@ -47,39 +87,183 @@ import argparse
 import sys
 import os
 import subprocess
-import re
 
 import asyncio
-from netlab.async_client import NetlabClient
 
 from netlab.enums import RemoveVMS
 from netlab.enums import PodState
 
+import api_trace
+import pod_index
+import retry
+from journal import Journal, JournalError, read_journal
+import selection
+import snapshot
+
+Quiet = False
 Summary = 'Pod Summary:'
 
 
 ##
-# delete_pods: Deletes pods in a list sequentially
+# retire_pod: Moves one pod through lookup -> offline -> remove
 #
-#  pod_list: pods to delete
+# Each stage holds its own semaphore from limits, and removal also holds
+# a per-host semaphore, so a pod moves on as soon as there is room in the
+# next stage rather than waiting for every other pod to be offlined.
+#
+#  pod_id: pod to delete
 #  removal_type: RemoveVMS enum value
+#  pod_hosts: pod to vh_id index (pods not in it are looked up one by one)
+#  limits: dict of semaphores with keys 'lookup', 'offline', 'remove'
+#          (the value for 'remove' may be None) and 'host', a function
+#          from vh_id to that host's semaphore
+#  dryrun: look up the pod but do not offline or remove it
+#  journal: optional Journal recording the pod's start and result
+#
+#  Returns the vh_id of the pod's host (None if it has no VMs).
 #
-async def delete_pods(api, pod_list, removal_type):
+async def retire_pod(api,
+                     pod_id,
+                     removal_type,
+                     pod_hosts,
+                     limits,
+                     dryrun,
+                     journal=None):
     global Quiet
     global Summary
 
-    for this_pod_id in pod_list:
-        if not Quiet:
-            print(f'deleting: {this_pod_id}')
-        try:
-            await api.pod_remove_task(pod_id=this_pod_id,
-                                      remove_vms=removal_type)
-            Summary = Summary + f'\n' + f'  {this_pod_id}: OK'
-            print(f'{this_pod_id}: OK')
-        except Exception as err:
-            Summary = Summary + f'  {this_pod_id}: {sys.exc_info()[0]}' + '\n'
-            print(f'Exception: {err}')
-            print(f'{this_pod_id}:{sys.exc_info()[0]}')
+    vh_id = pod_hosts.get(pod_id)
+    try:
+        if vh_id is None:
+            async with limits['lookup']:
+                props = await api.pod_get(pod_id=pod_id,
+                                          properties='remote_pc')
+            remote_pcs = props['remote_pc'] or []
+            vh_id = remote_pcs[0]['vh_id'] if remote_pcs else None
+        if dryrun:
+            return vh_id
+
+        if journal:
+            journal.start(pod_id)
+        async with limits['offline']:
+            await api.pod_state_change(pod_id=pod_id,
+                                       state=PodState.OFFLINE)
+
+        async with limits['host'](vh_id):
+            if limits['remove']:
+                await limits['remove'].acquire()
+            try:
+                if not Quiet:
+                    print(f'deleting: {pod_id}')
+                await api.pod_remove_task(pod_id=pod_id,
+                                          remove_vms=removal_type)
+            finally:
+                if limits['remove']:
+                    limits['remove'].release()
+        Summary = Summary + '\n' + f'  {pod_id}: OK'
+        print(f'{pod_id}: OK')
+        if journal:
+            journal.finish(pod_id, True)
+        return vh_id
+    except Exception as err:
+        Summary = Summary + '\n' + f'  {pod_id}: {sys.exc_info()[0]}'
+        print(f'Pod {pod_id}: Exception - [{err}]')
+        if journal:
+            journal.finish(pod_id, False, str(err))
+        return vh_id
+
+
+##
+# delete_pods: Deletes pods through a pipeline of bounded stages
+#
+#  pod_ids: pods to delete
+#  removal_type: RemoveVMS enum value
+#  pod_hosts: pod to vh_id index from pod_index.get_pod_hosts (optional)
+#  max_lookup: pod lookups that may run at once
+#  max_offline: state changes to OFFLINE that may run at once
+#  max_remove: removals that may run at once overall (None: no cap)
+#  max_per_host: removals that may run at once on one vm_host
+#  dryrun: only report which host each pod would be removed from
+#  journal: optional Journal recording each pod's start and result
+#  host_limits: optional dict from vh_id to a semaphore shared with
+#               other jobs on the hosts; semaphores missing from it are
+#               added with max_per_host places
+#
+#  Returns a dict from vh_id to the list of pods on that vm_host.
+#
+async def delete_pods(api,
+                      pod_ids,
+                      removal_type,
+                      pod_hosts=None,
+                      max_lookup=8,
+                      max_offline=8,
+                      max_remove=None,
+                      max_per_host=1,
+                      dryrun=False,
+                      journal=None,
+                      host_limits=None):
+    if host_limits is None:
+        host_limits = {}
+
+    def host_limit(vh_id):
+        if vh_id not in host_limits:
+            host_limits[vh_id] = asyncio.Semaphore(max_per_host)
+        return host_limits[vh_id]
+
+    limits = {'lookup': asyncio.Semaphore(max_lookup),
+              'offline': asyncio.Semaphore(max_offline),
+              'remove': asyncio.Semaphore(max_remove) if max_remove else None,
+              'host': host_limit}
+    vh_ids = await asyncio.gather(
+        *[retire_pod(api, pod_id, removal_type, pod_hosts or {},
+                     limits, dryrun, journal)
+          for pod_id in pod_ids])
+
+    if not dryrun:
+        pod_index.invalidate()
+        snapshot.invalidate()
+    return pod_index.group_by_host(pod_ids, dict(zip(pod_ids, vh_ids)))
+
+
+##
+# resume_deletes: The pods of a journaled delete job still to delete
+#
+#  plan: the job's journaled plan
+#  states: dict from pod id to its last journaled event
+#  live_pods: dict from the id of each pod that exists now to its name
+#  journal: Journal to record pods found already gone in (None in a
+#           dry run)
+#
+#  A pod id that now belongs to a pod of another name was reused after
+#  the journaled pod went; that pod is reported and left alone.
+#
+#  Returns (pod_ids, pod_names) of the pods still to delete.
+#
+def resume_deletes(plan, states, live_pods, journal):
+    pod_ids = []
+    pod_names = []
+    finished = 0
+    conflicts = 0
+    for pod_id, pod_name in zip(plan['pod_ids'], plan['pod_names']):
+        if states.get(pod_id) == 'done':
+            finished += 1
+        elif pod_id not in live_pods:
+            finished += 1
+            if journal:
+                journal.finish(pod_id, True, 'already gone')
+        elif live_pods[pod_id] != pod_name:
+            print(f'Pod id {pod_id} now belongs to {live_pods[pod_id]};'
+                  f' not deleting it')
+            conflicts += 1
+            if journal:
+                journal.finish(pod_id, True,
+                               f'already gone; id now {live_pods[pod_id]}')
+        else:
+            pod_ids.append(pod_id)
+            pod_names.append(pod_name)
+    print(f'Resuming: {finished} pods deleted, {len(pod_ids)} to delete,'
+          f' {conflicts} ids taken by other pods')
+    return pod_ids, pod_names
 
 
 async def main():
@@ -106,41 +290,97 @@ async def main():
                         action="store",
                         choices=tuple(t.name.lower() for t in RemoveVMS),
                         default=RemoveVMS.NONE.name.lower())
+    parser.add_argument('--max_lookup',
+                        type=int,
+                        default=8,
+                        help='pod lookups that may run at once')
+    parser.add_argument('--max_offline',
+                        type=int,
+                        default=8,
+                        help='pods that may be offlined at once')
+    parser.add_argument('--max_remove',
+                        type=int,
+                        help='pods that may be removed at once overall')
+    parser.add_argument('--max_per_host',
+                        type=int,
+                        default=1,
+                        help='pods that may be removed at once per vm_host')
+    parser.add_argument('--datacenter',
+                        help='datacenter whose inventory maps pods to hosts '
+                        '(from environment var NETLAB_VDC if not specified)',
+                        default=os.environ.get('NETLAB_VDC'))
+    parser.add_argument('--exclude',
+                        action='append',
+                        metavar='EXPR',
+                        help='regular expression for names of pods to leave '
+                        'out (repeatable)')
+    parser.add_argument('-fresh',
+                        action='store_const',
+                        const=True,
+                        help='list from the server, not a saved snapshot '
+                        '(dry runs only)')
+    retry.add_arguments(parser)
+    parser.add_argument('--journal',
+                        help="record the pods and each removal's progress "
+                        'in this file')
+    parser.add_argument('-resume',
+                        action='store_const',
+                        const=True,
+                        help='finish the job recorded in --journal')
     parser.add_argument('podexprs',
                         help='regular expressions for names of pods to remove',
                         nargs=argparse.REMAINDER)
     args = parser.parse_args()
+    if args.resume:
+        if not args.journal:
+            parser.error('-resume needs --journal')
+        try:
+            plan, states = read_journal(args.journal)
+        except (OSError, JournalError) as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        if plan.get('job') != 'delete':
+            print(f'{args.journal} is not a delete journal', file=sys.stderr)
+            sys.exit(1)
+        args.removal_type = plan['removal_type']
     removal_type = RemoveVMS[args.removal_type.upper()]
     Quiet = args.q
+    journal = Journal(args.journal) if args.journal and not args.n else None
 
     # Check if any arguments are provided
-    if not args.podexprs:
+    if not args.podexprs and not args.resume:
         print('No pods specified', file=sys.stderr)
         sys.exit(1)
 
-    async with NetlabClient() as api:
-        all_pods = await api.pod_list()
-
-        # Filter out offline pods if cmd-line argument provided
-        if args.offline_only:
-            all_pods = list(filter(lambda x:
-                                   x['pod_current_state'].name == 'OFFLINE',
-                                   all_pods))
-
-        # Get ids and names of pods to be deleted
-        pod_indices = []
-        for expr in args.podexprs:
-            prog = re.compile(expr)
-            this_index = \
-                list(filter(lambda x: x is not None,
-                            list(map(lambda x, y:
-                                     y if prog.match(x['pod_name'])
-                                     else None,
-                                     all_pods,
-                                     range(len(all_pods))))))
-            pod_indices += this_index
-        pod_names = [all_pods[x]['pod_name'] for x in pod_indices]
-        pod_ids = [all_pods[x]['pod_id'] for x in pod_indices]
+    async with api_trace.open_client() as api:
+        api = retry.wrap(api, args)
+        # A dry run may use a saved snapshot; real removals list afresh
+        all_pods = await snapshot.pod_list(api, fresh=args.fresh or not args.n)
+
+        if args.resume:
+            if journal:
+                journal.open()
+            pod_ids, pod_names = \
+                resume_deletes(plan,
+                               states,
+                               {x['pod_id']: x['pod_name']
+                                for x in all_pods},
+                               journal)
+        else:
+            # Filter out offline pods if cmd-line argument provided
+            if args.offline_only:
+                all_pods = list(
+                    filter(lambda x:
+                           x['pod_current_state'].name == 'OFFLINE',
+                           all_pods))
+
+            # Get ids and names of pods to be deleted
+            pods = selection.select(all_pods,
+                                    'pod_name',
+                                    args.podexprs,
+                                    args.exclude)
+            pod_names = [x['pod_name'] for x in pods]
+            pod_ids = [x['pod_id'] for x in pods]
 
         # Verify pods to delete
         if not args.force:
@@ -151,38 +391,44 @@ async def main():
         yes_no = input("Do you want to remove all these pods (y/n)? ")
         if yes_no[0].lower() != 'y':
             sys.exit(2)
-
-        # Offline the pods to be deleted
-        pod_dict = {}
-        for pod_id in pod_ids:
+        if journal and not args.resume:
             try:
-                props = await api.pod_get(pod_id=pod_id,
-                                          properties='remote_pc')
-                state_result = \
-                    await api.pod_state_change(pod_id=pod_id,
-                                               state=PodState.OFFLINE)
-                vh_id = props['remote_pc'][0]['vh_id']
-                try:
-                    pod_dict[vh_id].append(pod_id)
-                except Exception:
-                    pod_dict[vh_id] = [pod_id]
-            except Exception as err:
-                print(f'Pod {pod_id}: Exception - [{err}] [{state_result}]')
+                journal.open({'job': 'delete',
+                              'pod_ids': pod_ids,
+                              'pod_names': pod_names,
+                              'removal_type': args.removal_type})
+            except JournalError as err:
+                print(err, file=sys.stderr)
+                sys.exit(1)
+
+        # Map pods to hosts with one inventory listing rather than
+        # a pod_get per pod
+        pod_hosts = {}
+        if args.datacenter:
+            pod_hosts = await pod_index.get_pod_hosts(
+                api, args.datacenter, fresh=args.fresh or not args.n)
+
+        # Look up, offline and remove the pods, each pod moving on to
+        # the next stage as soon as there is room for it
+        pod_dict = await delete_pods(api,
+                                     pod_ids,
+                                     removal_type,
+                                     pod_hosts=pod_hosts,
+                                     max_lookup=args.max_lookup,
+                                     max_offline=args.max_offline,
+                                     max_remove=args.max_remove,
+                                     max_per_host=args.max_per_host,
+                                     dryrun=args.n,
+                                     journal=journal)
+        if journal:
+            journal.close()
 
         if args.n:
             print(f'Would be removing:{pod_dict}')
             return
 
-        # Delete pods in parallel tasks, one task per vm_host
-        tasks = []
-        for vh_id in pod_dict.keys():
-            print(f'appending {pod_dict[vh_id]}')
-            tasks.append(asyncio.create_task(delete_pods(api,
-                                                         pod_dict[vh_id],
-                                                         removal_type)))
-        await asyncio.gather(*tasks, return_exceptions=True)
-
     print(Summary)
+    print(api.report())
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,6 +1,7 @@
 #! /usr/bin/env python3
 '''
-usage: delete_unused_vms.py [-h] [--datacenter DATACENTER] [-n]
+usage: delete_unused_vms.py [-h] [--exclude EXPR] [--datacenter DATACENTER]
+                            [-n] [-fresh] [--retries RETRIES] [-adaptive]
                             -r {none,local,datacenter,disk} ...
 
 Delete vms in Netlab inventory not associate with pods
@@ -10,10 +11,17 @@ positional arguments:
 
 options:
   -h, --help            show this help message and exit
+  --exclude EXPR        regular expression for names of vms to leave out
+                        (repeatable)
   --datacenter DATACENTER
                         datacenter to remove vms from
                        (from environment var NETLAB_VDC if not specified)
   -n                    dry run
+  -fresh                list from the server, not a saved snapshot
+                        (dry runs use a snapshot up to five minutes old)
+  --retries RETRIES     times to retry a call that failed transiently
+                        (default 3)
+  -adaptive             tune calls in flight to server latency and errors
   -r {none,local,datacenter,disk}, --removal_type 
         {none,local,datacenter,disk}
 '''
@@ -25,13 +33,16 @@ import inspect
 import os
 
 import datetime
-import re
 
 import asyncio
-from netlab.async_client import NetlabClient
 from netlab.enums import RemoveVMS
 from netlab.enums import PodCategory
 
+import api_trace
+import retry
+import selection
+import snapshot
+
 Summary = 'VM Summary:'
 
 
@@ -50,7 +61,8 @@ async def do_delete_vms(api, vm_ids, vm_names, removal_type):
                 result = await api.vm_inventory_remove_datacenter_task(
                     vm_id=vm_ids[index])
             elif removal_type == 'local':
-                result = api.vm_inventory_remove_local(vm_id=vm_ids[index])
+                result = await api.vm_inventory_remove_local(
+                    vm_id=vm_ids[index])
             print(f'{vm_names[index]}: {result}')
             Summary = Summary + '\n' + f'  {vm_names[index]}: {result}'
         except Exception as err:
@@ -70,6 +82,11 @@ async def main():
         'vmexprs',
         help='regular expressions describing names of vms to remove',
         nargs=argparse.REMAINDER)
+    parser.add_argument('--exclude',
+                        action='append',
+                        metavar='EXPR',
+                        help='regular expression for names of vms to leave '
+                        'out (repeatable)')
     parser.add_argument('--datacenter',
                         required=False,
                         help='datacenter to remove vms from '
@@ -79,6 +96,11 @@ async def main():
                         action='store_const',
                         const=True,
                         help='dry run')
+    parser.add_argument('-fresh',
+                        action='store_const',
+                        const=True,
+                        help='list from the server, not a saved snapshot (dry runs only)')
+    retry.add_arguments(parser)
     parser.add_argument("-r",
                         "--removal_type",
                         required=True,
@@ -93,19 +115,20 @@ async def main():
         print('Nothing to do because removal_type is "none"')
         exit(1)
 
-    async with NetlabClient() as api:
-        datacenter_id = await api.vm_datacenter_find(vdc_name=args.datacenter)
-        all_vms = await api.vm_inventory_list(vdc_id=datacenter_id)
+    async with api_trace.open_client() as api:
+        api = retry.wrap(api, args)
+        # A dry run may use a saved snapshot; real removals list afresh
+        all_vms = await snapshot.vm_inventory_list(api,
+                                                   args.datacenter,
+                                                   fresh=args.fresh
+                                                   or not args.n)
         unused_vms = list(filter(lambda x: x['pc_pod_id'] == 0, all_vms))
 
         # Filter to match argument vm name regular expressions
-        relevant_unused_vms = []
-        for expr in args.vmexprs:
-            prog = re.compile(expr)
-            these_vms = list(filter(lambda x:
-                                    prog.match(x['vm_name']),
-                                    unused_vms))
-            relevant_unused_vms += these_vms
+        relevant_unused_vms = selection.select(unused_vms,
+                                               'vm_name',
+                                               args.vmexprs,
+                                               args.exclude)
 
         if not relevant_unused_vms:
             print(f'No unused VMs found in {args.datacenter}')
@@ -150,8 +173,10 @@ async def main():
             except Exception as err:
                 printf(f'Failed task append: {err}')
         await asyncio.gather(*tasks, return_exceptions=True)
+        snapshot.invalidate('vms')
 
         print(Summary)
+        print(api.report())
 
 if __name__ == "__main__":
     asyncio.run(main())
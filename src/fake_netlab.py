@@ -0,0 +1,372 @@
+'''
+fake_netlab.py
+
+In-process stand-in for the Netlab-VE+ API.
+
+FakeNetlabClient keeps hosts, pods, VMs and reservations in memory and
+answers the API calls the scripts in this directory make, so the
+workflows can be exercised and timed without touching vCenter.  Every
+call sleeps for a configurable latency (with optional jitter) and may
+fail at a configurable rate.  Calls that do work on a vm host (cloning,
+removing, changing pod state, removing VMs) also hold one of that host's
+task slots for their duration and are slowed by the host's slowdown
+factor, so per-host contention and uneven hosts can be modelled.  The
+busy time of each host is recorded for utilisation reports.
+
+FakeSyncClient offers the same calls without await, for code written
+against netlab.sync_client.SyncClient.
+
+    async with FakeNetlabClient(hosts=4) as api:
+        api.add_pod(1, 'master', vh_id=1, vms=2,
+                    pod_cat=PodCategory.MASTER_VM)
+        ...
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import asyncio
+import collections
+import contextlib
+import copy
+import datetime
+import random
+import time
+
+from netlab.enums import PodCategory
+from netlab.enums import PodState
+from netlab.enums import RemoveVMS
+
+# Nominal seconds each call takes before time_scale is applied
+DEFAULT_LATENCY = {
+    'vm_datacenter_find': 0.2,
+    'vm_host_list': 0.5,
+    'vm_inventory_list': 2.0,
+    'pod_list': 1.0,
+    'pod_get': 0.2,
+    'pod_clone_task': 60.0,
+    'pod_remove_task': 20.0,
+    'pod_state_change': 10.0,
+    'vm_inventory_remove_disk_task': 5.0,
+    'vm_inventory_remove_datacenter_task': 2.0,
+    'vm_inventory_remove_local': 0.5,
+    'reservation_make': 0.5,
+    'reservation_cancel': 0.3,
+    'reservation_list': 1.0,
+}
+
+
+class FakeNetlabError(RuntimeError):
+    pass
+
+
+##
+# FakeNetlabClient: async in-memory Netlab-VE+ API
+#
+# hosts: number of vm hosts (vh_ids 1..hosts)
+# datacenter: name vm_datacenter_find accepts
+# latency: dict from call name to nominal seconds (overrides
+#          DEFAULT_LATENCY)
+# time_scale: factor applied to every latency (e.g. 0.001 to run a
+#             minute-long clone in 60ms)
+# jitter: latencies vary uniformly by up to this fraction either way
+# failure_rate: chance that any one call fails as if its connection
+#               dropped (ConnectionResetError) before taking effect
+# host_slowdown: dict from vh_id to factor by which work on it is slower
+# host_slots: host calls each vm host runs at once; more wait their turn
+# seed: seed for jitter and failures, for repeatable runs
+#
+class FakeNetlabClient:
+
+    def __init__(self,
+                 hosts=4,
+                 datacenter='fake',
+                 latency=None,
+                 time_scale=1.0,
+                 jitter=0.0,
+                 failure_rate=0.0,
+                 host_slowdown=None,
+                 host_slots=2,
+                 seed=None):
+        self.datacenter = datacenter
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.time_scale = time_scale
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.host_slowdown = host_slowdown or {}
+        self.host_slots = host_slots
+        self.random = random.Random(seed)
+
+        self.hosts = {vh_id: {'vh_id': vh_id, 'vh_name': f'vh{vh_id}'}
+                      for vh_id in range(1, hosts + 1)}
+        self.pods = {}
+        self.vms = {}
+        self.reservations = {}
+        self.next_vm_id = 1
+        self.next_res_id = 1
+
+        self.host_limits = {}
+        self.calls = collections.Counter()
+        self.failures = collections.Counter()
+        self.host_busy = collections.Counter()
+        self.host_calls = collections.Counter()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    ##
+    # add_pod: Put a pod of type pt_id, with vms VMs on host vh_id, into
+    # inventory
+    #
+    def add_pod(self,
+                pod_id,
+                pod_name,
+                vh_id,
+                vms=1,
+                pod_cat=PodCategory.NORMAL,
+                state=PodState.OFFLINE,
+                pt_id=1):
+        self.pods[pod_id] = {'pod_id': pod_id,
+                             'pod_name': pod_name,
+                             'pod_cat': pod_cat,
+                             'pod_current_state': state,
+                             'pt_id': pt_id}
+        for number in range(vms):
+            self.add_vm(f'{pod_name}_vm{number+1}', vh_id, pod_id)
+
+    ##
+    # add_vm: Put a VM into inventory (pod_id 0: not in any pod)
+    #
+    def add_vm(self, vm_name, vh_id, pod_id=0):
+        vm_id = self.next_vm_id
+        self.next_vm_id += 1
+        self.vms[vm_id] = {'vm_id': vm_id,
+                           'vm_name': vm_name,
+                           'vh_id': vh_id,
+                           'pc_pod_id': pod_id}
+        return vm_id
+
+    def pod_vms(self, pod_id):
+        return [vm for vm in self.vms.values() if vm['pc_pod_id'] == pod_id]
+
+    def pod_host(self, pod_id):
+        vms = self.pod_vms(pod_id)
+        return vms[0]['vh_id'] if vms else None
+
+    ##
+    # utilisation: Fraction of each host's task slots kept busy over
+    # wall seconds
+    #
+    def utilisation(self, wall):
+        return {vh_id: self.host_busy[vh_id] / (wall * self.host_slots)
+                if wall > 0 else 0.0
+                for vh_id in self.hosts}
+
+    def reset_stats(self):
+        self.calls.clear()
+        self.failures.clear()
+        self.host_busy.clear()
+        self.host_calls.clear()
+
+    def host_limit(self, vh_id):
+        if vh_id not in self.host_limits:
+            self.host_limits[vh_id] = asyncio.Semaphore(self.host_slots)
+        return self.host_limits[vh_id]
+
+    ##
+    # call: Sleep for a call's latency, holding a slot on vh_id if given,
+    # and fail at failure_rate
+    #
+    @contextlib.asynccontextmanager
+    async def call(self, name, vh_id=None):
+        self.calls[name] += 1
+        delay = self.latency.get(name, 0.0) * self.time_scale
+        if self.jitter:
+            delay *= 1 + self.random.uniform(-self.jitter, self.jitter)
+        failed = self.random.random() < self.failure_rate
+
+        if vh_id is None:
+            await asyncio.sleep(delay)
+        else:
+            delay *= self.host_slowdown.get(vh_id, 1.0)
+            async with self.host_limit(vh_id):
+                start = time.monotonic()
+                await asyncio.sleep(delay)
+                self.host_busy[vh_id] += time.monotonic() - start
+                self.host_calls[vh_id] += 1
+        if failed:
+            self.failures[name] += 1
+            raise ConnectionResetError(f'{name}: connection reset'
+                                       ' (injected failure)')
+        yield
+
+    def get_pod(self, pod_id):
+        pod_id = int(pod_id)
+        if pod_id not in self.pods:
+            raise FakeNetlabError(f'pod {pod_id} does not exist')
+        return self.pods[pod_id]
+
+    async def vm_datacenter_find(self, vdc_name):
+        async with self.call('vm_datacenter_find'):
+            if vdc_name != self.datacenter:
+                raise FakeNetlabError(f'no datacenter "{vdc_name}"')
+            return 1
+
+    async def vm_host_list(self, vdc_id):
+        async with self.call('vm_host_list'):
+            return copy.deepcopy(list(self.hosts.values()))
+
+    async def vm_inventory_list(self, vdc_id):
+        async with self.call('vm_inventory_list'):
+            return copy.deepcopy(list(self.vms.values()))
+
+    async def pod_list(self, properties=None):
+        async with self.call('pod_list'):
+            return copy.deepcopy(list(self.pods.values()))
+
+    async def pod_get(self, pod_id, properties=None):
+        async with self.call('pod_get'):
+            pod = dict(self.get_pod(pod_id))
+            pod['remote_pc'] = [{'pc_id': vm['vm_id'], 'vh_id': vm['vh_id']}
+                                for vm in self.pod_vms(pod['pod_id'])]
+            return pod
+
+    async def pod_clone_task(self,
+                             source_pod_id,
+                             clone_pod_id,
+                             clone_pod_name,
+                             pc_clone_specs,
+                             severity_level=None):
+        source = self.get_pod(source_pod_id)
+        vh_id = pc_clone_specs.get('clone_vh_id') \
+            or self.pod_host(source['pod_id'])
+        async with self.call('pod_clone_task', vh_id):
+            if clone_pod_id in self.pods:
+                raise FakeNetlabError(f'pod {clone_pod_id} already exists')
+            pod_cat = PodCategory.MASTER_VM \
+                if pc_clone_specs.get('clone_role') == 'MASTER' \
+                else PodCategory.NORMAL
+            self.add_pod(clone_pod_id, clone_pod_name, vh_id,
+                         vms=len(self.pod_vms(source['pod_id'])),
+                         pod_cat=pod_cat,
+                         pt_id=source['pt_id'])
+            return {'status': 'OK', 'pod_id': clone_pod_id}
+
+    async def pod_remove_task(self, pod_id, remove_vms=RemoveVMS.NONE):
+        pod = self.get_pod(pod_id)
+        async with self.call('pod_remove_task', self.pod_host(pod['pod_id'])):
+            for vm in self.pod_vms(pod['pod_id']):
+                if remove_vms == RemoveVMS.NONE:
+                    vm['pc_pod_id'] = 0
+                else:
+                    del self.vms[vm['vm_id']]
+            del self.pods[pod['pod_id']]
+            return {'status': 'OK', 'pod_id': pod['pod_id']}
+
+    async def pod_state_change(self, pod_id, state):
+        pod = self.get_pod(pod_id)
+        async with self.call('pod_state_change',
+                             self.pod_host(pod['pod_id'])):
+            pod['pod_current_state'] = state
+            return {'status': 'OK'}
+
+    async def remove_vm(self, name, vm_id):
+        if vm_id not in self.vms:
+            raise FakeNetlabError(f'vm {vm_id} does not exist')
+        async with self.call(name, self.vms[vm_id]['vh_id']):
+            del self.vms[vm_id]
+            return {'status': 'OK'}
+
+    async def vm_inventory_remove_disk_task(self, vm_id):
+        return await self.remove_vm('vm_inventory_remove_disk_task', vm_id)
+
+    async def vm_inventory_remove_datacenter_task(self, vm_id):
+        return await self.remove_vm('vm_inventory_remove_datacenter_task',
+                                    vm_id)
+
+    async def vm_inventory_remove_local(self, vm_id):
+        return await self.remove_vm('vm_inventory_remove_local', vm_id)
+
+    async def reservation_make(self,
+                               pod_id,
+                               end_time,
+                               start_time=None,
+                               **details):
+        async with self.call('reservation_make'):
+            self.get_pod(pod_id)
+            start_time = start_time or datetime.datetime.now()
+            for res in self.reservations.values():
+                if res['pod_id'] == pod_id and res['res_start'] < end_time \
+                        and start_time < res['res_end']:
+                    raise FakeNetlabError(f'pod {pod_id} is reserved by'
+                                          f' reservation {res["res_id"]}')
+            res_id = self.next_res_id
+            self.next_res_id += 1
+            self.reservations[res_id] = dict(details,
+                                             res_id=res_id,
+                                             pod_id=pod_id,
+                                             res_start=start_time,
+                                             res_end=end_time)
+            return {'res_id': res_id}
+
+    async def reservation_cancel(self, res_id):
+        async with self.call('reservation_cancel'):
+            if self.reservations.pop(int(res_id), None) is None:
+                raise FakeNetlabError(f'no reservation {res_id}')
+            return {'status': 'OK'}
+
+    async def reservation_list(self, properties=None):
+        async with self.call('reservation_list'):
+            return [{key: res[key] for key in properties or res}
+                    for res in self.reservations.values()]
+
+
+##
+# FakeSyncClient: FakeNetlabClient calls without await
+#
+# api: FakeNetlabClient to wrap (one is made from kwargs if None)
+#
+class FakeSyncClient:
+
+    def __init__(self, api=None, **kwargs):
+        self.api = api or FakeNetlabClient(**kwargs)
+        self.loop = asyncio.new_event_loop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.loop.close()
+        return False
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self.loop.run_until_complete(attr(*args, **kwargs))
+        return call
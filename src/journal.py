@@ -0,0 +1,139 @@
+'''
+journal.py
+
+Append-only journal of a bulk job, for resuming it after a crash.
+
+A journal is a JSON Lines file.  Its first line is the job's plan (which
+pods, where, from what); each later line records one pod's progress:
+"start" when work on it begins, then "done", "failed" or "removed".
+Every line is flushed and synced to disk before the work it describes
+goes ahead, so after an SSH drop, Ctrl-C or API outage the journal shows
+what finished, what failed and what was in flight.  A line torn by a
+crash mid-write is ignored when the journal is read.
+
+    journal = Journal(path)
+    journal.open({'job': 'clone', ...})
+    journal.start(pod_id)
+    journal.finish(pod_id, ok)
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import datetime
+import json
+import os
+
+
+class JournalError(Exception):
+    pass
+
+
+##
+# read_journal: The plan and the latest state of each pod in a journal
+#
+# path: journal file
+#
+# Returns (plan, states) where states maps pod id to the last event
+# recorded for it ('start', 'done', 'failed' or 'removed').
+#
+def read_journal(path):
+    plan = None
+    states = {}
+    with open(path) as lines:
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry['event'] == 'plan':
+                plan = entry['plan']
+            else:
+                states[entry['pod_id']] = entry['event']
+    if plan is None:
+        raise JournalError(f'{path} has no plan to resume')
+    return plan, states
+
+
+##
+# Journal: writer for a job's journal
+#
+# path: journal file
+#
+class Journal:
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    ##
+    # open: Open the journal for appending
+    #
+    # plan: plan of a new job (JSON-serializable dict) to start the
+    #       journal with, or None to continue an existing journal
+    #
+    def open(self, plan=None):
+        if plan is not None and os.path.exists(self.path) \
+                and os.path.getsize(self.path):
+            raise JournalError(f'{self.path} already holds a job;'
+                               ' resume it or choose another journal')
+        torn = False
+        if plan is None and os.path.exists(self.path) \
+                and os.path.getsize(self.path):
+            with open(self.path, 'rb') as old:
+                old.seek(-1, os.SEEK_END)
+                torn = old.read(1) != b'\n'
+        self.file = open(self.path, 'a')
+        if torn:
+            # End a line torn by a crash so the next entry starts afresh
+            self.file.write('\n')
+        if plan is not None:
+            self.write('plan', plan=plan)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def write(self, event, **fields):
+        fields['event'] = event
+        fields['time'] = datetime.datetime.now().isoformat()
+        self.file.write(json.dumps(fields, default=str) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def start(self, pod_id):
+        self.write('start', pod_id=pod_id)
+
+    ##
+    # finish: Record how work on a pod ended
+    #
+    # pod_id: the pod
+    # ok: whether the work succeeded
+    # detail: optional note (e.g. the error, or how it was reconciled)
+    #
+    def finish(self, pod_id, ok, detail=None):
+        self.write('done' if ok else 'failed', pod_id=pod_id, detail=detail)
+
+    def removed(self, pod_id):
+        self.write('removed', pod_id=pod_id)
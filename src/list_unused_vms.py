@@ -2,7 +2,8 @@
 '''
 list_unused_vms.py
 
-usage: list_unused_vms.py [-h] [--datacenter DATACENTER] ...
+usage: list_unused_vms.py [-h] [--datacenter DATACENTER] [--exclude EXPR]
+                          [-fresh] ...
 
 List unused VMs in the netlab inventory
 
@@ -15,6 +16,12 @@ options:
   --datacenter DATACENTER
                         datacenter to remove vms from
                         (from environment var NETLAB_VDC if not specified)
+  --exclude EXPR        regular expression for names of vms to leave out
+                        (repeatable)
+  -fresh                list from the server, not a saved snapshot
+
+The VM inventory is read from a snapshot saved by an earlier run (see
+snapshot.py) when one is less than five minutes old.
 '''
 
 import argparse
@@ -23,13 +30,15 @@ import sys
 import os
 
 import datetime
-import re
 
 import asyncio
-from netlab.async_client import NetlabClient
 from netlab.enums import RemoveVMS
 from netlab.enums import PodCategory
 
+import api_trace
+import selection
+import snapshot
+
 
 async def main():
     parser = argparse.ArgumentParser(
@@ -39,6 +48,15 @@ async def main():
                         help='datacenter to remove vms from '
                         '(from environment var NETLAB_VDC if not specified)',
                         default=os.environ['NETLAB_VDC'])
+    parser.add_argument('--exclude',
+                        action='append',
+                        metavar='EXPR',
+                        help='regular expression for names of vms to leave '
+                        'out (repeatable)')
+    parser.add_argument('-fresh',
+                        action='store_const',
+                        const=True,
+                        help='list from the server, not a saved snapshot')
     parser.add_argument('vmexprs',
                         help='regular expressions for names of vms'
                         ' to remove (all if not specified)',
@@ -47,19 +65,17 @@ async def main():
     if not args.vmexprs:
         args.vmexprs = ['.*']
 
-    async with NetlabClient() as api:
-        datacenter_id = await api.vm_datacenter_find(vdc_name=args.datacenter)
-        all_vms = await api.vm_inventory_list(vdc_id=datacenter_id)
+    async with api_trace.open_client() as api:
+        all_vms = await snapshot.vm_inventory_list(api,
+                                                   args.datacenter,
+                                                   fresh=args.fresh)
         unused_vms = list(filter(lambda x: x['pc_pod_id'] == 0, all_vms))
 
         # Filter to match argument vm name regular expressions
-        relevant_unused_vms = []
-        for expr in args.vmexprs:
-            prog = re.compile(expr)
-            these_vms = list(filter(lambda x:
-                                    prog.match(x['vm_name']),
-                                    unused_vms))
-            relevant_unused_vms += these_vms
+        relevant_unused_vms = selection.select(unused_vms,
+                                               'vm_name',
+                                               args.vmexprs,
+                                               args.exclude)
 
         for vm in relevant_unused_vms:
             print(f'  {vm["vm_name"]}')
@@ -0,0 +1,299 @@
+'''
+metrics.py
+
+Per-call latency and throughput metrics for Netlab-VE+ API calls.
+
+MetricsClient wraps a client and records, for every call, the method,
+its latency, whether it succeeded and the vm host it worked on.  Hosts
+are learned from the traffic itself: clone calls name their target
+host, and inventory listings and pod lookups map pod and VM ids to the
+hosts they live on.
+
+When the client is closed, p50/p95/p99 latencies per method and per
+host, and each host's throughput, are written to
+
+    $NETLAB_METRICS_DIR/<script>.json
+    $NETLAB_METRICS_DIR/<script>.prom   (Prometheus textfile format)
+
+($NETLAB_METRICS_DIR defaults to the metrics directory beside the
+inventory snapshots) and a one-line summary naming the slowest method
+and host is printed.  api_trace.open_client() adds the wrapper, so every
+script exports its metrics.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import snapshot
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def metrics_dir():
+    return os.environ.get('NETLAB_METRICS_DIR',
+                          os.path.join(snapshot.CACHE_DIR, 'metrics'))
+
+
+def script_name():
+    return os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'netlab'
+
+
+##
+# percentile: Nearest-rank percentile of sorted values (q from 0 to 1)
+#
+def percentile(values, q):
+    if not values:
+        return None
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+##
+# Metrics: latency and outcome of every API call
+#
+class Metrics:
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.end = None
+        self.calls = []
+        self.pod_hosts = {}
+        self.vm_hosts = {}
+
+    def wall(self):
+        return (self.end or time.monotonic()) - self.start
+
+    ##
+    # host_of: The vm host a call works on (None if it is not tied to one)
+    #
+    def host_of(self, kwargs):
+        specs = kwargs.get('pc_clone_specs') or {}
+        if specs.get('clone_vh_id'):
+            return specs['clone_vh_id']
+        if 'vh_id' in kwargs:
+            return kwargs['vh_id']
+        if 'vm_id' in kwargs:
+            return self.vm_hosts.get(kwargs['vm_id'])
+        if 'pod_id' in kwargs:
+            return self.pod_hosts.get(kwargs['pod_id'])
+        return None
+
+    ##
+    # learn: Note which hosts pods and VMs live on from a call's result
+    #
+    def learn(self, method, kwargs, result):
+        if method == 'vm_inventory_list':
+            for vm in result:
+                self.vm_hosts[vm['vm_id']] = vm['vh_id']
+                if vm.get('pc_pod_id'):
+                    self.pod_hosts.setdefault(vm['pc_pod_id'], vm['vh_id'])
+        elif method == 'pod_get' and isinstance(result, dict) \
+                and result.get('remote_pc'):
+            self.pod_hosts[kwargs['pod_id']] = result['remote_pc'][0]['vh_id']
+        elif method == 'pod_clone_task':
+            vh_id = (kwargs.get('pc_clone_specs') or {}).get('clone_vh_id')
+            if vh_id:
+                self.pod_hosts[kwargs['clone_pod_id']] = vh_id
+
+    def record(self, method, host, latency, ok):
+        self.calls.append({'method': method,
+                           'host': host,
+                           'latency': latency,
+                           'ok': ok})
+
+    ##
+    # stats: Count, errors and latency quantiles of some calls
+    #
+    def stats(self, calls):
+        latencies = sorted(call['latency'] for call in calls)
+        stats = {'count': len(calls),
+                 'errors': sum(1 for call in calls if not call['ok']),
+                 'sum': sum(latencies),
+                 'max': latencies[-1] if latencies else None}
+        for q in QUANTILES:
+            stats[f'p{round(q * 100)}'] = percentile(latencies, q)
+        return stats
+
+    ##
+    # summary: Stats per method and per host for the whole run
+    #
+    def summary(self):
+        wall = self.wall()
+        by_method = {}
+        by_host = {}
+        for call in self.calls:
+            by_method.setdefault(call['method'], []).append(call)
+            if call['host'] is not None:
+                by_host.setdefault(call['host'], []).append(call)
+        hosts = {}
+        for host, calls in by_host.items():
+            hosts[host] = self.stats(calls)
+            ok = hosts[host]['count'] - hosts[host]['errors']
+            hosts[host]['throughput'] = ok / wall if wall else 0.0
+        return {'script': script_name(),
+                'wall': wall,
+                'calls': self.stats(self.calls),
+                'methods': {method: self.stats(calls)
+                            for method, calls in by_method.items()},
+                'hosts': hosts}
+
+    def write_json(self, path, summary):
+        write_atomic(path, json.dumps(summary, indent=2, default=str))
+
+    ##
+    # write_prometheus: Write a summary in Prometheus textfile format
+    #
+    def write_prometheus(self, path, summary):
+        script = summary['script']
+        lines = ['# HELP netlab_api_call_seconds Netlab API call latency',
+                 '# TYPE netlab_api_call_seconds summary']
+        for method, stats in summary['methods'].items():
+            labels = f'script="{script}",method="{method}"'
+            for q in QUANTILES:
+                lines.append(f'netlab_api_call_seconds{{{labels},'
+                             f'quantile="{q}"}}'
+                             f' {stats[f"p{round(q * 100)}"]}')
+            lines.append(f'netlab_api_call_seconds_sum{{{labels}}}'
+                         f' {stats["sum"]}')
+            lines.append(f'netlab_api_call_seconds_count{{{labels}}}'
+                         f' {stats["count"]}')
+        lines += ['# HELP netlab_api_call_errors_total Failed Netlab API '
+                  'calls',
+                  '# TYPE netlab_api_call_errors_total counter']
+        for method, stats in summary['methods'].items():
+            lines.append(f'netlab_api_call_errors_total{{script="{script}",'
+                         f'method="{method}"}} {stats["errors"]}')
+        lines += ['# HELP netlab_host_call_seconds Latency of calls '
+                  'working on a vm host',
+                  '# TYPE netlab_host_call_seconds summary']
+        for host, stats in summary['hosts'].items():
+            labels = f'script="{script}",vh_id="{host}"'
+            for q in QUANTILES:
+                lines.append(f'netlab_host_call_seconds{{{labels},'
+                             f'quantile="{q}"}}'
+                             f' {stats[f"p{round(q * 100)}"]}')
+            lines.append(f'netlab_host_call_seconds_sum{{{labels}}}'
+                         f' {stats["sum"]}')
+            lines.append(f'netlab_host_call_seconds_count{{{labels}}}'
+                         f' {stats["count"]}')
+        lines += ['# HELP netlab_host_throughput Successful calls per '
+                  'second on a vm host',
+                  '# TYPE netlab_host_throughput gauge']
+        for host, stats in summary['hosts'].items():
+            lines.append(f'netlab_host_throughput{{script="{script}",'
+                         f'vh_id="{host}"}} {stats["throughput"]}')
+        lines += ['# HELP netlab_run_seconds Wall time of the script run',
+                  '# TYPE netlab_run_seconds gauge',
+                  f'netlab_run_seconds{{script="{script}"}}'
+                  f' {summary["wall"]}']
+        write_atomic(path, '\n'.join(lines) + '\n')
+
+    ##
+    # export: Write JSON and Prometheus files and print a one-line summary
+    #
+    def export(self):
+        self.end = time.monotonic()
+        if not self.calls:
+            return
+        summary = self.summary()
+        base = os.path.join(metrics_dir(), summary['script'])
+        try:
+            self.write_json(base + '.json', summary)
+            self.write_prometheus(base + '.prom', summary)
+        except OSError as err:
+            print(f'Could not write metrics to {base}.*: {err}',
+                  file=sys.stderr)
+            base = None
+
+        totals = summary['calls']
+        text = (f'API calls: {totals["count"]} ({totals["errors"]} failed)'
+                f' in {summary["wall"]:.1f}s')
+        slowest = max(summary['methods'].items(),
+                      key=lambda item: item[1]['p95'])
+        text += f'; slowest p95 {slowest[0]} {slowest[1]["p95"]:.2f}s'
+        if summary['hosts']:
+            host, stats = max(summary['hosts'].items(),
+                              key=lambda item: item[1]['p95'])
+            text += f', slowest host vh_id {host} p95 {stats["p95"]:.2f}s'
+        if base:
+            text += f'; metrics in {base}.json/.prom'
+        print(text, file=sys.stderr)
+
+
+def write_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(handle, 'w') as out:
+        out.write(text)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+##
+# MetricsClient: Client wrapper that records every call in a Metrics
+#
+# api: client to wrap (entered and exited along with this one)
+# metrics: Metrics to record in (a new one if None)
+#
+class MetricsClient:
+
+    def __init__(self, api, metrics=None):
+        self.api = api
+        self.metrics = metrics or Metrics()
+
+    async def __aenter__(self):
+        await self.api.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self.api.__aexit__(*exc_info)
+        finally:
+            self.metrics.export()
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            start = time.monotonic()
+            ok = False
+            try:
+                result = await attr(*args, **kwargs)
+                ok = True
+                self.metrics.learn(name, kwargs, result)
+                return result
+            finally:
+                self.metrics.record(name,
+                                    self.metrics.host_of(kwargs),
+                                    time.monotonic() - start,
+                                    ok)
+        return call
@@ -0,0 +1,262 @@
+'''
+placement.py
+
+Capacity-aware placement of new pods across the VM hosts of a
+Netlab-VE+ datacenter.
+
+Rather than slicing the new pod ids across hosts with a fixed stride,
+the current load of every host is measured from the datacenter VM
+inventory (VMs resident on the host, expressed in pods of the size
+being placed) and each new pod is given to the host with the lowest
+projected load relative to its capacity weight.  Existing pods can
+likewise be ordered so that those handed out first (e.g. to teams
+working at the same time) are spread evenly over their hosts.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import heapq
+
+
+##
+# get_host_loads: Measure how busy each vm host in a datacenter is
+#
+# api: netlab client connection
+# datacenter_id: id of the datacenter whose hosts are measured
+#
+# Returns a dict from vh_id to a dict with keys
+#   vms:  number of VMs in inventory resident on the host
+#   pods: number of distinct pods with VMs on the host
+#
+async def get_host_loads(api, datacenter_id):
+    hosts = await api.vm_host_list(vdc_id=datacenter_id)
+    return host_loads_from_inventory(
+        hosts, await api.vm_inventory_list(vdc_id=datacenter_id))
+
+
+##
+# host_loads_from_inventory: get_host_loads for listings already made
+#
+# hosts: result of vm_host_list
+# vms: result of vm_inventory_list for the same datacenter
+#
+def host_loads_from_inventory(hosts, vms):
+    loads = {host['vh_id']: {'vms': 0, 'pods': 0} for host in hosts}
+    pods_seen = {vh_id: set() for vh_id in loads}
+
+    for vm in vms:
+        vh_id = vm['vh_id']
+        if vh_id not in loads:
+            continue
+        loads[vh_id]['vms'] += 1
+        if vm['pc_pod_id']:
+            pods_seen[vh_id].add(vm['pc_pod_id'])
+
+    for vh_id in loads:
+        loads[vh_id]['pods'] = len(pods_seen[vh_id])
+    return loads
+
+
+##
+# parse_host_weights: Convert VH_ID=WEIGHT strings to a dict
+#
+# specs: list of strings (or None) of the form 'vh_id=weight'
+#
+def parse_host_weights(specs):
+    weights = {}
+    for spec in specs or []:
+        vh_id, sep, weight = spec.partition('=')
+        if not sep:
+            raise ValueError(f'host weight "{spec}" is not VH_ID=WEIGHT')
+        weights[int(vh_id)] = float(weight)
+        if weights[int(vh_id)] <= 0:
+            raise ValueError(f'host weight "{spec}" must be positive')
+    return weights
+
+
+##
+# round_robin_assignment: Deal pod ids out to hosts with a fixed stride
+#
+# pod_ids: ids of pods to be placed
+# vh_ids: ids of vm hosts to place them on
+#
+# Raises ValueError if there are pods to place but no hosts.
+#
+def round_robin_assignment(pod_ids, vh_ids):
+    if pod_ids and not vh_ids:
+        raise ValueError('no vm hosts to place pods on')
+    return {vh_ids[i]: pod_ids[i:len(pod_ids):len(vh_ids)]
+            for i in range(0, len(vh_ids))}
+
+
+##
+# weighted_assignment: Place pod ids on the least loaded hosts
+#
+# pod_ids: ids of pods to be placed (in the order students will use them)
+# host_loads: dict from vh_id to load dict as returned by get_host_loads
+# vms_per_pod: number of VMs in each pod being placed
+# weights: optional dict from vh_id to relative capacity (default 1.0)
+#
+# Each pod goes, in turn, to the host whose load after receiving it,
+# divided by the host's weight, is smallest.  Hosts that are already
+# crowded therefore receive fewer (possibly no) new pods.  Ties are
+# broken by vh_id so equally loaded hosts are dealt to in rotation.
+#
+# Returns a dict from vh_id to the list of pod ids placed on it.  Raises
+# ValueError if there are pods to place but no hosts.
+#
+def weighted_assignment(pod_ids, host_loads, vms_per_pod=1, weights=None):
+    if pod_ids and not host_loads:
+        raise ValueError('no vm hosts to place pods on')
+    weights = weights or {}
+    vms_per_pod = max(vms_per_pod, 1)
+    assignment = {vh_id: [] for vh_id in host_loads}
+
+    heap = []
+    for vh_id, load in host_loads.items():
+        weight = weights.get(vh_id, 1.0)
+        pod_load = load['vms'] / vms_per_pod
+        heapq.heappush(heap, ((pod_load + 1) / weight, vh_id, pod_load))
+
+    for pod_id in pod_ids:
+        _, vh_id, pod_load = heapq.heappop(heap)
+        assignment[vh_id].append(pod_id)
+        pod_load += 1
+        weight = weights.get(vh_id, 1.0)
+        heapq.heappush(heap, ((pod_load + 1) / weight, vh_id, pod_load))
+
+    return assignment
+
+
+##
+# balanced_order: Order existing pods so that any leading run of them
+# is spread evenly over their hosts
+#
+# pod_ids: candidate pod ids, in order of preference
+# pod_hosts: pod to vh_id index (see pod_index.get_pod_hosts)
+# weights: optional dict from vh_id to relative capacity (default 1.0)
+#
+# Pods are taken in turn from the host whose share so far, divided by its
+# weight, is smallest, so giving the first N pods to N concurrent users
+# loads each host in proportion to its capacity.
+#
+def balanced_order(pod_ids, pod_hosts, weights=None):
+    weights = weights or {}
+    by_host = {}
+    for pod_id in pod_ids:
+        by_host.setdefault(pod_hosts.get(pod_id), []).append(pod_id)
+
+    heap = [(1 / weights.get(vh_id, 1.0), order, 0)
+            for order, vh_id in enumerate(by_host)]
+    heapq.heapify(heap)
+    hosts = list(by_host)
+    ordered = []
+    while heap:
+        _, order, taken = heapq.heappop(heap)
+        vh_id = hosts[order]
+        ordered.append(by_host[vh_id][taken])
+        taken += 1
+        if taken < len(by_host[vh_id]):
+            heapq.heappush(heap,
+                           ((taken + 1) / weights.get(vh_id, 1.0),
+                            order, taken))
+    return ordered
+
+
+##
+# drain_moves: New hosts for pods leaving drained hosts
+#
+# host_loads: dict from vh_id to load dict as returned by get_host_loads
+# pod_ids: ids of pods to move off the drained hosts
+# pod_vms: dict from pod id to its number of VMs
+# drained: ids of hosts that receive no pods
+# weights: optional dict from vh_id to relative capacity (default 1.0)
+#
+# Largest pods are placed first, each on the host whose load after
+# receiving it, divided by the host's weight, is smallest.
+#
+# Returns a dict from pod id to the vh_id it should move to.
+#
+def drain_moves(host_loads, pod_ids, pod_vms, drained, weights=None):
+    weights = weights or {}
+    vms = {vh_id: load['vms'] for vh_id, load in host_loads.items()
+           if vh_id not in drained}
+    targets = {}
+    if not vms:
+        return targets
+    for pod_id in sorted(pod_ids, key=lambda pod_id: -pod_vms.get(pod_id, 1)):
+        size = pod_vms.get(pod_id, 1)
+        vh_id = min(vms, key=lambda vh_id: ((vms[vh_id] + size)
+                                           / weights.get(vh_id, 1.0),
+                                           vh_id))
+        vms[vh_id] += size
+        targets[pod_id] = vh_id
+    return targets
+
+
+##
+# rebalance_moves: Moves that even out the load of hosts
+#
+# host_loads: dict from vh_id to load dict as returned by get_host_loads
+# movable: dict from vh_id to the ids of pods on it that may be moved
+#          (see pod_index.group_by_host)
+# pod_vms: dict from pod id to its number of VMs
+# weights: optional dict from vh_id to relative capacity (default 1.0)
+# limit: most moves to make (None: no limit)
+#
+# The most loaded host (relative to its weight) with a movable pod gives
+# its smallest pod to the least loaded host, as long as that host would
+# still be less loaded than the giver was.  No pod is moved twice.
+#
+# Returns a list of (pod_id, from_vh_id, to_vh_id).
+#
+def rebalance_moves(host_loads, movable, pod_vms, weights=None, limit=None):
+    weights = weights or {}
+    vms = {vh_id: load['vms'] for vh_id, load in host_loads.items()}
+
+    def size(pod_id):
+        return pod_vms.get(pod_id, 1)
+
+    def level(vh_id, extra=0):
+        return (vms[vh_id] + extra) / weights.get(vh_id, 1.0)
+
+    movable = {vh_id: sorted(pod_ids, key=size)
+               for vh_id, pod_ids in movable.items() if vh_id in vms}
+
+    moves = []
+    while vms and (limit is None or len(moves) < limit):
+        givers = [vh_id for vh_id in movable if movable[vh_id]]
+        if not givers:
+            break
+        giver = max(givers, key=lambda vh_id: (level(vh_id), vh_id))
+        pod_id = movable[giver][0]
+        taker = min(vms, key=lambda vh_id: (level(vh_id, size(pod_id)),
+                                            vh_id))
+        if taker == giver or level(taker, size(pod_id)) >= level(giver):
+            break
+        movable[giver].pop(0)
+        vms[giver] -= size(pod_id)
+        vms[taker] += size(pod_id)
+        moves.append((pod_id, giver, taker))
+    return moves
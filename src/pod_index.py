@@ -0,0 +1,106 @@
+'''
+pod_index.py
+
+Bulk pod to vm host index for Netlab-VE+ pods.
+
+Instead of asking for each pod's remote PCs with one pod_get per pod,
+the index is built from a single vm_inventory_list call per datacenter:
+every VM in inventory carries both the id of the pod it belongs to
+(pc_pod_id) and the id of the host it lives on (vh_id).  The index is
+cached for the rest of the run, and helpers group or order pods by host
+for any script that needs it.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import itertools
+
+import snapshot
+
+# datacenter name -> {pod_id: vh_id}, filled once per run
+_pod_hosts = {}
+
+
+##
+# get_pod_hosts: Map every pod with VMs in a datacenter to its vm host
+#
+# api: netlab client connection
+# datacenter: name of the datacenter (e.g. os.environ['NETLAB_VDC'])
+# fresh: build from a new inventory listing rather than a saved snapshot
+#
+# A pod whose VMs are spread over several hosts is mapped to the host of
+# its first VM in inventory.  The result is cached for the run; call
+# invalidate() after changing what is in inventory.
+#
+async def get_pod_hosts(api, datacenter, fresh=True):
+    if datacenter not in _pod_hosts:
+        pod_hosts = {}
+        for vm in await snapshot.vm_inventory_list(api, datacenter, fresh):
+            if vm['pc_pod_id']:
+                pod_hosts.setdefault(vm['pc_pod_id'], vm['vh_id'])
+        _pod_hosts[datacenter] = pod_hosts
+    return _pod_hosts[datacenter]
+
+
+##
+# invalidate: Forget cached indexes
+#
+# datacenter: name of datacenter to forget (all if None)
+#
+def invalidate(datacenter=None):
+    if datacenter is None:
+        _pod_hosts.clear()
+    else:
+        _pod_hosts.pop(datacenter, None)
+
+
+##
+# group_by_host: Group pod ids by the vm host they live on
+#
+# pod_ids: ids of pods to group
+# pod_hosts: index from get_pod_hosts
+#
+# Returns a dict from vh_id to list of pod ids, in pod_ids order.
+# Pods not in the index are grouped under None.
+#
+def group_by_host(pod_ids, pod_hosts):
+    groups = {}
+    for pod_id in pod_ids:
+        groups.setdefault(pod_hosts.get(pod_id), []).append(pod_id)
+    return groups
+
+
+##
+# interleave_by_host: Order pod ids so consecutive pods are on
+# different hosts wherever possible
+#
+# pod_ids: ids of pods to order
+# pod_hosts: index from get_pod_hosts
+#
+def interleave_by_host(pod_ids, pod_hosts):
+    groups = group_by_host(pod_ids, pod_hosts)
+    return [pod_id
+            for batch in itertools.zip_longest(*groups.values())
+            for pod_id in batch
+            if pod_id is not None]
@@ -0,0 +1,456 @@
+#! /usr/bin/env python3
+'''
+pod_pool.py
+
+usage: pod_pool.py [-h] [--datacenter DATACENTER]
+                   [-r {none,local,datacenter,disk}]
+                   [--max_per_host MAX_PER_HOST] [--retries RETRIES]
+                   [-adaptive] [-fresh] [-y] [-q]
+                   {plan,apply} pool_file
+
+Bring pod pools to the state described in a pool file
+
+positional arguments:
+  {plan,apply}          show the operations needed, or show and run them
+  pool_file             YAML (.yaml/.yml) or JSON file describing the pools
+
+options:
+  -h, --help            show this help message and exit
+  --datacenter DATACENTER
+                        datacenter whose hosts the pools are spread over
+                        (from environment var NETLAB_VDC if not specified)
+  -r {none,local,datacenter,disk}, --removal_type {none,local,datacenter,disk}
+                        how surplus pods' VMs are removed (default disk)
+  --max_per_host MAX_PER_HOST
+                        clones or removals each host may run at once
+                        (default 1)
+  --retries RETRIES     times to retry a call that failed transiently
+                        (default 3)
+  -adaptive             tune calls in flight to server latency and errors
+  -fresh                plan from the server, not a saved snapshot
+                        (apply always lists afresh)
+  -y                    apply without asking for confirmation
+  -q                    quiet (no per-pod messages)
+
+A pool file lists the pools to keep, e.g.
+
+  pools:
+    - name: CSE235
+      prefix: CSE235-       # pods are named prefix + pod id
+      source: 1234          # master pod clones are made from
+      count: 40             # pods the pool should have
+      state: online         # optional: online or offline
+      datastore: ds1        # optional datastore for new clones
+      host_weights:         # optional relative capacity of hosts
+        3: 2.0
+
+A pod belongs to a pool when its name starts with the pool's prefix
+and it is not a master pod.
+The pools are compared with one listing of pods and VM inventory, and
+only the difference is acted on: missing pods are cloned onto the least
+loaded hosts (as clone_pod.py places them), surplus pods are deleted
+from the most crowded hosts first (as delete_pods.py deletes them), and
+pods not in the requested state are changed (as set_pod_state.py does).
+Clones and deletions for all pools run concurrently, sharing the
+--max_per_host places on each host, followed by the state changes.
+Pods with a reservation still to come are never deleted.  "plan" only
+prints the operations; "apply" prints them, asks for confirmation and
+runs them.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+
+from netlab.enums import PodCategory
+from netlab.enums import PodState
+from netlab.enums import RemoveVMS
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+import api_trace
+import clone_pod
+import delete_pods
+import placement
+from reservations import ReservationIndex, list_reservations
+import retry
+import set_pod_state
+import snapshot
+
+
+##
+# read_pools: Read and check a pool file
+#
+# path: YAML (.yaml/.yml) or JSON pool file
+#
+# Returns a list of pool dicts with keys name, prefix, source, count,
+# state (PodState or None), datastore and host_weights.  Raises
+# ValueError if the file does not describe valid pools.
+#
+def read_pools(path):
+    with open(path) as pool_file:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError('reading a YAML pool file needs PyYAML'
+                                 ' (pip install pyyaml); or use a JSON'
+                                 ' pool file')
+            spec = yaml.safe_load(pool_file) or {}
+        else:
+            spec = json.load(pool_file)
+
+    pools = []
+    for entry in spec.get('pools') or []:
+        missing = {'name', 'prefix', 'source', 'count'} - set(entry)
+        if missing:
+            raise ValueError(f'pool {entry} lacks'
+                             f' {", ".join(sorted(missing))}')
+        state = entry.get('state')
+        if state is not None \
+                and str(state).upper() not in PodState.__members__:
+            raise ValueError(f'pool {entry["name"]}: unknown state "{state}"')
+        weights = entry.get('host_weights') or {}
+        pools.append({'name': str(entry['name']),
+                      'prefix': str(entry['prefix']),
+                      'source': int(entry['source']),
+                      'count': int(entry['count']),
+                      'state': state and PodState[str(state).upper()],
+                      'datastore': entry.get('datastore') or '',
+                      'host_weights': placement.parse_host_weights(
+                          f'{vh_id}={weight}'
+                          for vh_id, weight in weights.items())})
+        if pools[-1]['count'] < 0:
+            raise ValueError(f'pool {entry["name"]}: count is negative')
+
+    prefixes = sorted(pool['prefix'] for pool in pools)
+    for first, second in zip(prefixes, prefixes[1:]):
+        if second.startswith(first):
+            raise ValueError(f'pool prefixes "{first}" and "{second}"'
+                             ' would share pods')
+    return pools
+
+
+##
+# is_member: Whether a pod belongs to a pool
+#
+# pod: pod dict from pod_list
+# prefix: the pool's name prefix
+# source: id of the pool's master pod
+#
+# Master pods (such as seeds kept by clone_pod.py --tiered, named
+# prefix + 'seed') are never members, so they are never deleted.
+#
+def is_member(pod, prefix, source):
+    return pod['pod_name'].startswith(prefix) \
+        and pod['pod_id'] != source \
+        and pod.get('pod_cat') != PodCategory.MASTER_VM
+
+
+##
+# plan_pool: Work out the operations that bring one pool to its spec
+#
+# pool: pool dict from read_pools
+# all_pods: result of pod_list
+# pod_hosts: pod to vh_id index built from the VM inventory
+# host_loads: host loads (see placement.get_host_loads); updated with
+#             the clones planned here so later pools see them
+# taken_ids: pod ids in use or already planned; new ids are added
+# vms_per_pod: number of VMs in the pool's source pod
+# reserved: ids of pods that must not be deleted (e.g. reserved ones)
+#
+# Returns a dict with keys
+#   pool:   the pool
+#   have:   number of pods now in the pool
+#   clone:  dict from vh_id to the new pod ids to clone onto it
+#   delete: list of (pod_id, pod_name) of surplus pods
+#   state:  list of (pod_id, pod_name) of pods to change state
+#   error:  why the pool cannot be brought to spec (None if it can)
+#
+def plan_pool(pool,
+              all_pods,
+              pod_hosts,
+              host_loads,
+              taken_ids,
+              vms_per_pod,
+              reserved=()):
+    members = [pod for pod in all_pods
+               if is_member(pod, pool['prefix'], pool['source'])]
+    names = {pod['pod_id']: pod['pod_name'] for pod in members}
+    plan = {'pool': pool, 'have': len(members), 'clone': {},
+            'delete': [], 'state': [], 'error': None}
+
+    # Keep reserved pods, then those that spread most evenly over the
+    # hosts
+    ordered = placement.balanced_order([pod['pod_id'] for pod in members],
+                                       pod_hosts,
+                                       pool['host_weights'])
+    ordered.sort(key=lambda pod_id: pod_id not in reserved)
+    count = max(pool['count'],
+                sum(1 for pod_id in ordered if pod_id in reserved))
+    keep = ordered[:count]
+    plan['delete'] = [(pod_id, names[pod_id]) for pod_id in ordered[count:]]
+
+    missing = pool['count'] - len(keep)
+    if missing > 0:
+        source = [pod for pod in all_pods if pod['pod_id'] == pool['source']]
+        if not source:
+            plan['error'] = f'source pod {pool["source"]} does not exist'
+        elif source[0].get('pod_cat', PodCategory.MASTER_VM) \
+                != PodCategory.MASTER_VM:
+            plan['error'] = f'source pod {pool["source"]} is not a master pod'
+        elif not host_loads:
+            plan['error'] = 'no vm hosts to place pods on'
+        else:
+            new_ids = clone_pod.allocate_pids(taken_ids, missing)
+            taken_ids.extend(new_ids)
+            plan['clone'] = {
+                vh_id: pod_ids
+                for vh_id, pod_ids in placement.weighted_assignment(
+                    new_ids, host_loads, vms_per_pod,
+                    pool['host_weights']).items()
+                if pod_ids}
+            for vh_id, pod_ids in plan['clone'].items():
+                host_loads[vh_id]['vms'] += len(pod_ids) * vms_per_pod
+
+    state = pool['state']
+    if state:
+        states = {pod['pod_id']: pod.get('pod_current_state')
+                  for pod in members}
+        plan['state'] = [(pod_id, names[pod_id]) for pod_id in keep
+                         if getattr(states[pod_id], 'name', None)
+                         != state.name]
+        if state != PodState.OFFLINE:
+            plan['state'] += [(pod_id, f'{pool["prefix"]}{pod_id}')
+                              for pod_ids in plan['clone'].values()
+                              for pod_id in pod_ids]
+    return plan
+
+
+##
+# list_inventory: List the pods, VMs and hosts pools are planned against
+#
+# api: netlab client connection
+# datacenter: datacenter whose hosts the pools are spread over
+# fresh: list from the server rather than a saved snapshot
+#
+# Returns (all_pods, vms, hosts).
+#
+async def list_inventory(api, datacenter, fresh):
+    all_pods = await snapshot.pod_list(api, fresh)
+    vms = await snapshot.vm_inventory_list(api, datacenter, fresh)
+    datacenter_id = await api.vm_datacenter_find(vdc_name=datacenter)
+    hosts = await api.vm_host_list(vdc_id=datacenter_id)
+    return all_pods, vms, hosts
+
+
+##
+# plan_pools: Plan every pool against one listing of pods and VMs
+#
+# pools: pool dicts from read_pools
+# all_pods, vms, hosts: listings from list_inventory
+# reserved: ids of pods that must not be deleted
+#
+# Returns (plans, pod_hosts).
+#
+def plan_pools(pools, all_pods, vms, hosts, reserved=()):
+    host_loads = placement.host_loads_from_inventory(hosts, vms)
+    pod_hosts = {}
+    vm_counts = {}
+    for vm in vms:
+        if vm['pc_pod_id']:
+            pod_hosts.setdefault(vm['pc_pod_id'], vm['vh_id'])
+            vm_counts[vm['pc_pod_id']] = vm_counts.get(vm['pc_pod_id'], 0) + 1
+
+    taken_ids = [pod['pod_id'] for pod in all_pods]
+    plans = [plan_pool(pool, all_pods, pod_hosts, host_loads, taken_ids,
+                       vm_counts.get(pool['source'], 1), reserved)
+             for pool in pools]
+    return plans, pod_hosts
+
+
+def print_plans(plans):
+    for plan in plans:
+        pool = plan['pool']
+        clones = sum(len(pod_ids) for pod_ids in plan['clone'].values())
+        print(f'{pool["name"]}: {plan["have"]} of {pool["count"]} pods,'
+              f' clone {clones}, delete {len(plan["delete"])},'
+              f' change state {len(plan["state"])}')
+        if plan['error']:
+            print(f'  cannot clone: {plan["error"]}')
+        for vh_id, pod_ids in plan['clone'].items():
+            print(f'  clone {pool["source"]} -> '
+                  + ', '.join(f'{pool["prefix"]}{pod_id}'
+                              for pod_id in pod_ids)
+                  + f' on vh_id {vh_id}')
+        for _, pod_name in plan['delete']:
+            print(f'  delete {pod_name}')
+        for _, pod_name in plan['state']:
+            print(f'  set {pod_name} {pool["state"].name.lower()}')
+
+
+##
+# apply_plans: Run the operations of planned pools concurrently
+#
+# api: netlab client connection
+# plans: plans from plan_pools
+# pod_hosts: pod to vh_id index from plan_pools
+# removal_type: RemoveVMS value for deleted pods
+# max_per_host: clones or removals each host may run at once, counted
+#               over all pools together
+#
+# Clones and deletions for all pools run at once; state changes follow
+# when they are done, so new clones can be brought online too.
+#
+async def apply_plans(api, plans, pod_hosts, removal_type, max_per_host):
+    host_limits = {}
+    jobs = []
+    for plan in plans:
+        pool = plan['pool']
+        if plan['clone']:
+            jobs.append(clone_pod.do_clone(api,
+                                           pool['source'],
+                                           plan['clone'],
+                                           pool['prefix'],
+                                           pool['datastore'],
+                                           max_per_host=max_per_host,
+                                           host_limits=host_limits))
+            for vh_id, pod_ids in plan['clone'].items():
+                pod_hosts.update(dict.fromkeys(pod_ids, vh_id))
+        if plan['delete']:
+            jobs.append(delete_pods.delete_pods(
+                api,
+                [pod_id for pod_id, _ in plan['delete']],
+                removal_type,
+                pod_hosts=pod_hosts,
+                max_per_host=max_per_host,
+                host_limits=host_limits))
+    await asyncio.gather(*jobs)
+
+    await asyncio.gather(
+        *[set_pod_state.change_pod_states(
+            api,
+            [pod_id for pod_id, _ in plan['state']],
+            [pod_name for _, pod_name in plan['state']],
+            plan['pool']['state'],
+            pod_hosts)
+          for plan in plans if plan['state']])
+    snapshot.invalidate()
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description='Bring pod pools to the state described in a pool file')
+    parser.add_argument('action',
+                        choices=('plan', 'apply'),
+                        help='show the operations needed, or show and '
+                        'run them')
+    parser.add_argument('pool_file',
+                        help='YAML (.yaml/.yml) or JSON file describing '
+                        'the pools')
+    parser.add_argument('--datacenter',
+                        help='datacenter whose hosts the pools are spread '
+                        'over (from environment var NETLAB_VDC if not '
+                        'specified)',
+                        default=os.environ.get('NETLAB_VDC'))
+    parser.add_argument('-r',
+                        '--removal_type',
+                        choices=tuple(t.name.lower() for t in RemoveVMS),
+                        default=RemoveVMS.DISK.name.lower(),
+                        help="how surplus pods' VMs are removed")
+    parser.add_argument('--max_per_host',
+                        type=int,
+                        default=1,
+                        help='clones or removals each host may run at once')
+    retry.add_arguments(parser)
+    parser.add_argument('-fresh',
+                        action='store_const',
+                        const=True,
+                        help='plan from the server, not a saved snapshot')
+    parser.add_argument('-y',
+                        action='store_const',
+                        const=True,
+                        help='apply without asking for confirmation')
+    parser.add_argument('-q',
+                        action='store_const',
+                        const=True,
+                        help='quiet (no per-pod messages)')
+    args = parser.parse_args()
+    if not args.datacenter:
+        print('No datacenter given (--datacenter or NETLAB_VDC)',
+              file=sys.stderr)
+        sys.exit(1)
+    try:
+        pools = read_pools(args.pool_file)
+    except (OSError, ValueError) as err:
+        print(f'Bad pool file {args.pool_file}: {err}', file=sys.stderr)
+        sys.exit(1)
+    clone_pod.Quiet = args.q
+    delete_pods.Quiet = args.q
+    set_pod_state.Quiet = args.q
+
+    async with api_trace.open_client() as api:
+        api = retry.wrap(api, args)
+
+        # A plan may use a saved snapshot; apply lists afresh.  Pods
+        # with a reservation still to come are kept.
+        all_pods, vms, hosts = await list_inventory(
+            api, args.datacenter, fresh=args.fresh or args.action == 'apply')
+        index = ReservationIndex(await list_reservations(api))
+        now = datetime.now()
+        reserved = {pod['pod_id'] for pod in all_pods
+                    if not index.is_free(pod['pod_id'], now, datetime.max)}
+        plans, pod_hosts = plan_pools(pools, all_pods, vms, hosts, reserved)
+        print_plans(plans)
+        if args.action == 'plan':
+            return
+        if not any(plan['clone'] or plan['delete'] or plan['state']
+                   for plan in plans):
+            print('Pools already match the pool file')
+            return
+        if not args.y:
+            yes_no = input('Do you want to apply this plan (y/n)? ')
+            if yes_no[0].lower() != 'y':
+                sys.exit(2)
+
+        await apply_plans(api, plans, pod_hosts,
+                          RemoveVMS[args.removal_type.upper()],
+                          args.max_per_host)
+
+        # Check the result against a new listing
+        plans, _ = plan_pools(pools, *await list_inventory(
+            api, args.datacenter, fresh=True), reserved)
+        print('After apply:')
+        print_plans(plans)
+        print(api.report())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
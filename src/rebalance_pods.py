@@ -0,0 +1,402 @@
+#! /usr/bin/env python3
+'''
+rebalance_pods.py
+
+usage: rebalance_pods.py [-h] [--datacenter DATACENTER]
+                         [--host_weight VH_ID=WEIGHT]
+                         [--max_moves MAX_MOVES] [--max_down MAX_DOWN]
+                         [--batch_size BATCH_SIZE] [--guard GUARD]
+                         [--src_pid PT_ID=POD_ID]
+                         [--clone_datastore CLONE_DATASTORE]
+                         [-r {none,local,datacenter,disk}]
+                         [--online_timeout ONLINE_TIMEOUT]
+                         [--retries RETRIES] [-adaptive]
+                         [--journal JOURNAL] [-fresh] [-n] [-y] [-q]
+                         {drain,rebalance} [vh_id ...]
+
+Move NDG Netlab pods between vm hosts
+
+positional arguments:
+  {drain,rebalance}     move every pod off the given hosts, or even out
+                        the load of all hosts
+  vh_id                 hosts to drain
+
+options:
+  -h, --help            show this help message and exit
+  --datacenter DATACENTER
+                        datacenter whose hosts pods are moved between
+                        (from environment var NETLAB_VDC if not specified)
+  --host_weight VH_ID=WEIGHT
+                        relative capacity of a host (repeatable, default 1)
+  --max_moves MAX_MOVES
+                        most pods a rebalance moves (default no limit)
+  --max_down MAX_DOWN   online pods that may be out of service at once
+                        (default 4)
+  --batch_size BATCH_SIZE
+                        pods each vm_host receives at once (default 1)
+  --guard GUARD         minutes before a reservation starts in which its
+                        pod is left in place (default 60)
+  --src_pid PT_ID=POD_ID
+                        master pod to clone pods of a pod type from
+                        (repeatable)
+  --clone_datastore CLONE_DATASTORE
+                        datastore for the moved pods
+  -r {none,local,datacenter,disk}, --removal_type {none,local,datacenter,disk}
+                        how moved pods' old VMs are removed (default disk)
+  --online_timeout ONLINE_TIMEOUT
+                        seconds a moved pod may take to come back online
+                        (default 600)
+  --retries RETRIES     times to retry a call that failed transiently
+                        (default 3)
+  -adaptive             tune calls in flight to server latency and errors
+  --journal JOURNAL     record the moves and each move's progress in this
+                        file (finish an interrupted run with
+                        refresh_pods.py -resume --journal JOURNAL)
+  -fresh                list from the server, not a saved snapshot
+                        (dry runs use a snapshot up to five minutes old)
+  -n                    dry run
+  -y                    move without asking for confirmation
+  -q                    quiet (no clone messages)
+
+Host loads are measured, as clone_pod.py measures them, from one VM
+inventory listing of the datacenter.  "drain" moves every pod off the
+given hosts onto the least loaded other hosts, largest pods first.
+"rebalance" repeatedly moves the smallest movable pod from the most
+loaded host to the least loaded one while that narrows the gap, up to
+--max_moves pods.  Loads are relative to any --host_weight given.
+
+A pod is moved as refresh_pods.py refreshes it: it is offlined, removed
+and cloned again, with the same pod id and name, from the master pod of
+its pod type onto its new host, then brought back online if it was
+online.  Reservations therefore stay valid, but anything saved in the
+pod is lost.  The master pod of a pod type is the one --src_pid names
+for it, or else its only pod of the master category.  A type can have
+several: the seeds clone_pod.py --tiered keep leaves behind are master
+copies too, and one may be stale or on a datastore that is going away,
+so which to clone from is left to --src_pid rather than guessed.
+Master pods, pods whose pod type has no master pod to clone from, and
+pods reserved now or within --guard minutes are not moved.
+Moves run concurrently across hosts, --batch_size at a time per
+receiving host, with at most --max_down online pods out of service.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+from netlab.enums import PodCategory
+from netlab.enums import RemoveVMS
+
+import api_trace
+import clone_pod
+from journal import Journal, JournalError
+import placement
+import pod_index
+import pod_pool
+import refresh_pods
+import retry
+from reservations import ReservationIndex, list_reservations
+
+
+##
+# parse_sources: Parse --src_pid "PT_ID=POD_ID" specs
+#
+# Returns a dict from pt_id to pod id; raises ValueError on a bad spec.
+#
+def parse_sources(specs):
+    sources = {}
+    for spec in specs or []:
+        pt_id, sep, pod_id = spec.partition('=')
+        if not sep:
+            raise ValueError(f'source "{spec}" is not PT_ID=POD_ID')
+        sources[int(pt_id)] = int(pod_id)
+    return sources
+
+
+##
+# movable_pods: The pods that may be moved, and why others may not
+#
+# all_pods: result of pod_list
+# pod_hosts: pod to vh_id index built from the VM inventory
+# index: ReservationIndex of current and upcoming reservations
+# start, end: window in which a reserved pod is left in place
+# sources: dict from pt_id to the master pod to clone that type from,
+#          for types with no single master pod
+#
+# Returns (masters, unmovable): a dict from the id of each movable pod
+# to the master pod it is cloned from, and a dict from the id of each
+# other pod on a host to the reason it stays.
+#
+def movable_pods(all_pods, pod_hosts, index, start, end, sources=None):
+    masters = {}
+    for pod in all_pods:
+        if pod.get('pod_cat') == PodCategory.MASTER_VM:
+            masters.setdefault(pod.get('pt_id'), []).append(pod['pod_id'])
+    for pt_id, pod_id in (sources or {}).items():
+        masters[pt_id] = [pod_id]
+
+    movable = {}
+    unmovable = {}
+    for pod in all_pods:
+        pod_id = pod['pod_id']
+        if pod_id not in pod_hosts:
+            continue
+        if pod.get('pod_cat') == PodCategory.MASTER_VM \
+                or pod_id in (sources or {}).values():
+            unmovable[pod_id] = 'master pod'
+        elif not masters.get(pod.get('pt_id')):
+            unmovable[pod_id] = f'no master for pod type {pod.get("pt_id")}'
+        elif len(masters[pod['pt_id']]) > 1:
+            unmovable[pod_id] = f'pod type {pod["pt_id"]} has masters' \
+                f' {", ".join(map(str, masters[pod["pt_id"]]))};' \
+                f' choose one with --src_pid {pod["pt_id"]}=POD_ID'
+        elif not index.is_free(pod_id, start, end):
+            unmovable[pod_id] = 'reserved'
+        else:
+            movable[pod_id] = masters[pod['pt_id']][0]
+    return movable, unmovable
+
+
+##
+# print_moves: Show each host's load before and after, and the moves
+#
+def print_moves(moves, host_loads, pod_vms, names):
+    after = {vh_id: load['vms'] for vh_id, load in host_loads.items()}
+    for pod_id, giver, taker in moves:
+        after[giver] -= pod_vms.get(pod_id, 1)
+        after[taker] += pod_vms.get(pod_id, 1)
+    print('Host VMs now -> after:')
+    for vh_id in sorted(host_loads):
+        print(f'  vh_id {vh_id}: {host_loads[vh_id]["vms"]} -> '
+              f'{after[vh_id]}')
+    print(f'{len(moves)} pods to move:')
+    for pod_id, giver, taker in moves:
+        print(f'  {names[pod_id]}: vh_id {giver} -> vh_id {taker}')
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description='Move NDG Netlab pods between vm hosts')
+    parser.add_argument('action',
+                        choices=('drain', 'rebalance'),
+                        help='move every pod off the given hosts, or even '
+                        'out the load of all hosts')
+    parser.add_argument('vh_ids',
+                        type=int,
+                        nargs='*',
+                        metavar='vh_id',
+                        help='hosts to drain')
+    parser.add_argument('--datacenter',
+                        help='datacenter whose hosts pods are moved between '
+                        '(from environment var NETLAB_VDC if not specified)',
+                        default=os.environ.get('NETLAB_VDC'))
+    parser.add_argument('--host_weight',
+                        action='append',
+                        metavar='VH_ID=WEIGHT',
+                        help='relative capacity of a host (repeatable)')
+    parser.add_argument('--max_moves',
+                        type=int,
+                        help='most pods a rebalance moves')
+    parser.add_argument('--max_down',
+                        type=int,
+                        default=4,
+                        help='online pods that may be out of service at '
+                        'once')
+    parser.add_argument('--batch_size',
+                        type=int,
+                        default=1,
+                        help='pods each vm_host receives at once')
+    parser.add_argument('--guard',
+                        type=float,
+                        default=60,
+                        help='minutes before a reservation starts in which '
+                        'its pod is left in place')
+    parser.add_argument('--src_pid',
+                        action='append',
+                        metavar='PT_ID=POD_ID',
+                        help='master pod to clone pods of a pod type from '
+                        '(repeatable)')
+    parser.add_argument('--clone_datastore',
+                        default='',
+                        help='datastore for the moved pods')
+    parser.add_argument('-r',
+                        '--removal_type',
+                        choices=tuple(t.name.lower() for t in RemoveVMS),
+                        default=RemoveVMS.DISK.name.lower(),
+                        help="how moved pods' old VMs are removed")
+    parser.add_argument('--online_timeout',
+                        type=float,
+                        default=600,
+                        help='seconds a moved pod may take to come back '
+                        'online')
+    retry.add_arguments(parser)
+    parser.add_argument('--journal',
+                        help="record the moves and each move's progress "
+                        'in this file')
+    parser.add_argument('-fresh',
+                        action='store_const',
+                        const=True,
+                        help='list from the server, not a saved snapshot')
+    parser.add_argument('-n',
+                        action='store_const',
+                        const=True,
+                        help='dry run')
+    parser.add_argument('-y',
+                        action='store_const',
+                        const=True,
+                        help='move without asking for confirmation')
+    parser.add_argument('-q',
+                        action='store_const',
+                        const=True,
+                        help='quiet (no clone messages)')
+    args = parser.parse_args()
+    if args.action == 'drain' and not args.vh_ids:
+        parser.error('drain needs the vh_id of at least one host')
+    if args.action == 'rebalance' and args.vh_ids:
+        parser.error('rebalance takes no vh_id')
+    if args.max_down < 1:
+        parser.error('--max_down must be at least 1')
+    if not args.datacenter:
+        parser.error('No datacenter given (--datacenter or NETLAB_VDC)')
+    try:
+        weights = placement.parse_host_weights(args.host_weight)
+        sources = parse_sources(args.src_pid)
+    except ValueError as err:
+        parser.error(str(err))
+    clone_pod.Quiet = args.q
+    refresh_pods.Quiet = args.q
+    journal = Journal(args.journal) if args.journal and not args.n else None
+
+    async with api_trace.open_client() as api:
+        api = retry.wrap(api, args)
+        # A dry run may use a saved snapshot; real moves list afresh
+        all_pods, vms, hosts = await pod_pool.list_inventory(
+            api, args.datacenter, fresh=args.fresh or not args.n)
+        host_loads = placement.host_loads_from_inventory(hosts, vms)
+        unknown = set(args.vh_ids) - set(host_loads)
+        if unknown:
+            print(f'No vh_id {", ".join(map(str, sorted(unknown)))} in'
+                  f' datacenter {args.datacenter}', file=sys.stderr)
+            sys.exit(1)
+        pod_hosts = {}
+        pod_vms = {}
+        for vm in vms:
+            if vm['pc_pod_id']:
+                pod_hosts.setdefault(vm['pc_pod_id'], vm['vh_id'])
+                pod_vms[vm['pc_pod_id']] = pod_vms.get(vm['pc_pod_id'], 0) + 1
+        names = {pod['pod_id']: pod['pod_name'] for pod in all_pods}
+        missing = set(sources.values()) - set(names)
+        if missing:
+            print(f'Source pod {", ".join(map(str, sorted(missing)))}'
+                  ' does not exist', file=sys.stderr)
+            sys.exit(1)
+
+        # Leave reservations in progress or about to start alone
+        index = ReservationIndex(await list_reservations(api))
+        now = datetime.now()
+        masters, unmovable = movable_pods(all_pods, pod_hosts, index, now,
+                                          now + timedelta(minutes=args.guard),
+                                          sources)
+
+        if args.action == 'drain':
+            drained = [pod_id for pod_id in masters
+                       if pod_hosts[pod_id] in args.vh_ids]
+            targets = placement.drain_moves(host_loads, drained, pod_vms,
+                                            args.vh_ids, weights)
+            moves = [(pod_id, pod_hosts[pod_id], vh_id)
+                     for pod_id, vh_id in targets.items()]
+            for pod_id, reason in sorted(unmovable.items()):
+                if pod_hosts[pod_id] in args.vh_ids:
+                    print(f'{names[pod_id]} stays on vh_id'
+                          f' {pod_hosts[pod_id]}: {reason}')
+        else:
+            moves = placement.rebalance_moves(
+                host_loads,
+                pod_index.group_by_host(list(masters), pod_hosts),
+                pod_vms,
+                weights,
+                args.max_moves)
+        print_moves(moves, host_loads, pod_vms, names)
+        if not moves or args.n:
+            return
+        if not args.y:
+            yes_no = input('Do you want to move these pods (y/n)? ')
+            if yes_no[0].lower() != 'y':
+                sys.exit(2)
+
+        # Each move is a refresh onto the new host
+        states = {pod['pod_id']: pod.get('pod_current_state')
+                  for pod in all_pods}
+        pods = []
+        for pod_id, _, vh_id in moves:
+            up = getattr(states[pod_id], 'name', None) == 'ONLINE'
+            pods.append({'pod_id': pod_id,
+                         'pod_name': names[pod_id],
+                         'vh_id': vh_id,
+                         'online': up,
+                         'up': up,
+                         'src_pid': masters[pod_id]})
+        up = sum(1 for pod in pods if pod['up'])
+        min_online = max(0, up - args.max_down)
+        if journal:
+            try:
+                journal.open({'job': 'refresh',
+                              'src_pid': None,
+                              'datastore': args.clone_datastore,
+                              'removal_type': args.removal_type,
+                              'min_online': min_online,
+                              'batch_size': args.batch_size,
+                              'pods': pods})
+            except JournalError as err:
+                print(err, file=sys.stderr)
+                sys.exit(1)
+
+        moved, failed, skipped = await refresh_pods.refresh_pods(
+            api,
+            pods,
+            None,
+            args.clone_datastore,
+            RemoveVMS[args.removal_type.upper()],
+            max(up - min_online, 1),
+            args.batch_size,
+            args.online_timeout,
+            journal)
+        if journal:
+            journal.close()
+
+        print(f'{len(moved)} moved, {len(failed)} failed,'
+              f' {len(skipped)} not started')
+        if skipped:
+            print('Not started after a failure: ' + ', '.join(skipped))
+        print(api.report())
+        if failed or skipped:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
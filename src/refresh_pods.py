@@ -0,0 +1,560 @@
+#! /usr/bin/env python3
+'''
+refresh_pods.py
+
+usage: refresh_pods.py [-h] [--src_pid SRC_PID]
+                       [--clone_datastore CLONE_DATASTORE]
+                       [--min_online MIN_ONLINE] [--batch_size BATCH_SIZE]
+                       [--guard GUARD]
+                       [-r {none,local,datacenter,disk}]
+                       [--online_timeout ONLINE_TIMEOUT]
+                       [--datacenter DATACENTER] [--exclude EXPR]
+                       [--retries RETRIES] [-adaptive]
+                       [--journal JOURNAL] [-resume] [-fresh] [-n] [-y] [-q]
+                       ...
+
+Reset NDG Netlab pods to their master pod, a few at a time
+
+positional arguments:
+  podexprs              regular expressions for names of pods to refresh
+
+options:
+  -h, --help            show this help message and exit
+  --src_pid SRC_PID     master pod the pods are cloned from again
+  --clone_datastore CLONE_DATASTORE
+                        datastore for the new clones
+  --min_online MIN_ONLINE
+                        pods that must stay online throughout (default 0)
+  --batch_size BATCH_SIZE
+                        pods each vm_host refreshes at once (default 1)
+  --guard GUARD         minutes before a reservation starts in which its
+                        pod is left alone (default 60)
+  -r {none,local,datacenter,disk}, --removal_type {none,local,datacenter,disk}
+                        how the old pods' VMs are removed (default disk)
+  --online_timeout ONLINE_TIMEOUT
+                        seconds a refreshed pod may take to come back
+                        online (default 600)
+  --datacenter DATACENTER
+                        datacenter whose inventory maps pods to hosts
+                        (from environment var NETLAB_VDC if not specified)
+  --exclude EXPR        regular expression for names of pods to leave out
+                        (repeatable)
+  --retries RETRIES     times to retry a call that failed transiently
+                        (default 3)
+  -adaptive             tune calls in flight to server latency and errors
+  --journal JOURNAL     record the pods and each refresh's progress in
+                        this file
+  -resume               finish the job recorded in --journal
+  -fresh                list from the server, not a saved snapshot
+                        (dry runs use a snapshot up to five minutes old)
+  -n                    dry run
+  -y                    refresh without asking for confirmation
+  -q                    quiet (no clone messages)
+
+Each pod is offlined, removed and cloned again from --src_pid with the
+same pod id and name, on the vm_host it was on, so reservations and
+host balance are unchanged.  Pods that were online are brought back
+online.
+
+Every vm_host works through its pods in batches of --batch_size, all
+hosts at once, so one host's removals overlap another's clones.  A pod
+that is online may only be taken down while more than --min_online of
+the selected pods are online; it holds its place in that budget until
+it is online again.  Pods already offline (or, when resuming, already
+down) are refreshed first, as they cost no serving capacity.  After a
+failed refresh no further pods are started, so a broken master pod
+does not take every pod down.  Pods reserved now or within --guard
+minutes are skipped (and listed), so no one's lab is reset under them.
+
+With --journal, the pods and each refresh's start and result are
+appended to the journal file as the run goes.  If the run dies, -resume
+with the same --journal finishes the job with the same settings (no
+podexprs are needed): pods recorded as done are skipped, pods that no
+longer exist are only cloned, pods whose id now belongs to a pod of
+another name are reported and left alone, and the rest are refreshed.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+from netlab.enums import PodState
+from netlab.enums import RemoveVMS
+
+import api_trace
+import clone_pod
+from journal import Journal, JournalError, read_journal
+import pod_index
+from reservations import ReservationIndex, list_reservations
+import retry
+import selection
+import set_pod_state
+import snapshot
+
+Quiet = False
+Summary = 'Refresh Summary:'
+
+
+##
+# Capacity: count of online pods that may be taken out of service
+#
+# free: pods that may be out of service at once to begin with
+#
+# A pod brought back online frees a place; once stopped, pods waiting
+# for a place give up rather than wait for pods that will not return.
+#
+class Capacity:
+
+    def __init__(self, free):
+        self.free = free
+        self.stopped = False
+        self.cond = None
+
+    def condition(self):
+        if self.cond is None:
+            self.cond = asyncio.Condition()
+        return self.cond
+
+    ##
+    # take: Wait for a place; returns False if stopped first
+    #
+    async def take(self):
+        async with self.condition():
+            await self.cond.wait_for(lambda: self.free > 0 or self.stopped)
+            if self.stopped:
+                return False
+            self.free -= 1
+            return True
+
+    async def give(self):
+        async with self.condition():
+            self.free += 1
+            self.cond.notify()
+
+    async def stop(self):
+        async with self.condition():
+            self.stopped = True
+            self.cond.notify_all()
+
+
+##
+# refresh_one_pod: Remove a pod and clone it again under the same id
+#
+# api: netlab client connection
+# pod: dict with keys pod_id, pod_name, vh_id (host to clone it onto),
+#      online (whether the pod should be online afterwards), up
+#      (whether it is online now) and optionally src_pid (its own
+#      master pod)
+# src_pid: id of the master pod to clone from
+# datastore: Either '' or name of datastore on which to store the vms
+# removal_type: RemoveVMS enum value
+# capacity: Capacity a pod that is up takes a place in while it is out
+#           of service
+# online_timeout: seconds the pod may take to come back online
+# journal: optional Journal recording the pod's start and result
+# exists: False if the pod is already gone (it is only cloned)
+#
+# Returns True if the pod was refreshed, False if refreshing it failed
+# and None if it was not started because capacity stopped.
+#
+async def refresh_one_pod(api,
+                          pod,
+                          src_pid,
+                          datastore,
+                          removal_type,
+                          capacity,
+                          online_timeout,
+                          journal=None,
+                          exists=True):
+    global Summary
+
+    pod_id = pod['pod_id']
+    pod_name = pod['pod_name']
+    src_pid = pod.get('src_pid', src_pid)
+    if pod['up'] and not await capacity.take():
+        return None
+    try:
+        if journal:
+            journal.start(pod_id)
+        if exists:
+            await api.pod_state_change(pod_id=pod_id,
+                                       state=PodState.OFFLINE)
+            await api.pod_remove_task(pod_id=pod_id,
+                                      remove_vms=removal_type)
+        if not await clone_pod.clone_one_pod(api,
+                                             src_pid,
+                                             pod['vh_id'],
+                                             pod_id,
+                                             '',
+                                             datastore,
+                                             pod_name=pod_name):
+            raise RuntimeError(f'could not clone {src_pid} as {pod_name}')
+        if pod['online']:
+            await api.pod_state_change(pod_id=pod_id,
+                                       state=PodState.ONLINE)
+            if await set_pod_state.wait_for_state(api,
+                                                  [pod_id],
+                                                  PodState.ONLINE,
+                                                  online_timeout):
+                raise RuntimeError(f'not online after {online_timeout}s')
+    except Exception as err:
+        Summary = Summary + '\n' + f'  {pod_name}: {err}'
+        print(f'Pod {pod_name}: Exception - [{err}]')
+        if journal:
+            journal.finish(pod_id, False, str(err))
+        await capacity.stop()
+        return False
+    if pod['online']:
+        await capacity.give()
+    Summary = Summary + '\n' + f'  {pod_name}: OK'
+    print(f'{pod_name}: refreshed')
+    if journal:
+        journal.finish(pod_id, True)
+    return True
+
+
+##
+# host_batches: Split each host's pods into batches
+#
+# pods: pod dicts as for refresh_one_pod
+# batch_size: pods each host refreshes at once
+#
+# Pods that are not up come first on each host, since refreshing them
+# costs no serving capacity.
+#
+# Returns a dict from vh_id to that host's list of batches.
+#
+def host_batches(pods, batch_size):
+    by_host = {}
+    for pod in sorted(pods, key=lambda pod: pod['up']):
+        by_host.setdefault(pod['vh_id'], []).append(pod)
+    return {vh_id: [host_pods[i:i + batch_size]
+                    for i in range(0, len(host_pods), batch_size)]
+            for vh_id, host_pods in by_host.items()}
+
+
+##
+# refresh_pods: Refresh pods host by host, batch by batch
+#
+# api: netlab client connection
+# pods: pod dicts as for refresh_one_pod
+# src_pid: id of the master pod to clone from
+# datastore: Either '' or name of datastore on which to store the vms
+# removal_type: RemoveVMS enum value
+# budget: pods that are up which may be out of service at once, before
+#         any pod that is down is brought back online
+# batch_size: pods each host refreshes at once
+# online_timeout: seconds a pod may take to come back online
+# journal: optional Journal recording each pod's start and result
+# gone: ids of pods that no longer exist (they are only cloned)
+#
+# Returns (refreshed, failed, skipped) lists of pod names.
+#
+async def refresh_pods(api,
+                       pods,
+                       src_pid,
+                       datastore,
+                       removal_type,
+                       budget,
+                       batch_size=1,
+                       online_timeout=600,
+                       journal=None,
+                       gone=()):
+    capacity = Capacity(budget)
+    refreshed = []
+    failed = []
+    skipped = []
+
+    async def refresh_host(batches):
+        for batch in batches:
+            if failed:
+                skipped.extend(pod['pod_name'] for pod in batch)
+                continue
+            results = await asyncio.gather(
+                *[refresh_one_pod(api, pod, src_pid, datastore,
+                                  removal_type, capacity, online_timeout,
+                                  journal, pod['pod_id'] not in gone)
+                  for pod in batch])
+            for pod, ok in zip(batch, results):
+                if ok is None:
+                    skipped.append(pod['pod_name'])
+                else:
+                    (refreshed if ok else failed).append(pod['pod_name'])
+
+    await asyncio.gather(*[refresh_host(batches)
+                           for batches in host_batches(pods,
+                                                       batch_size).values()])
+    pod_index.invalidate()
+    snapshot.invalidate()
+    return refreshed, failed, skipped
+
+
+async def main():
+    global Quiet
+
+    parser = argparse.ArgumentParser(
+        description='Reset NDG Netlab pods to their master pod, '
+        'a few at a time')
+    parser.add_argument('--src_pid',
+                        type=int,
+                        help='master pod the pods are cloned from again')
+    parser.add_argument('--clone_datastore',
+                        default='',
+                        help='datastore for the new clones')
+    parser.add_argument('--min_online',
+                        type=int,
+                        default=0,
+                        help='pods that must stay online throughout')
+    parser.add_argument('--batch_size',
+                        type=int,
+                        default=1,
+                        help='pods each vm_host refreshes at once')
+    parser.add_argument('--guard',
+                        type=float,
+                        default=60,
+                        help='minutes before a reservation starts in which '
+                        'its pod is left alone')
+    parser.add_argument('-r',
+                        '--removal_type',
+                        choices=tuple(t.name.lower() for t in RemoveVMS),
+                        default=RemoveVMS.DISK.name.lower(),
+                        help="how the old pods' VMs are removed")
+    parser.add_argument('--online_timeout',
+                        type=float,
+                        default=600,
+                        help='seconds a refreshed pod may take to come '
+                        'back online')
+    parser.add_argument('--datacenter',
+                        help='datacenter whose inventory maps pods to hosts '
+                        '(from environment var NETLAB_VDC if not specified)',
+                        default=os.environ.get('NETLAB_VDC'))
+    parser.add_argument('--exclude',
+                        action='append',
+                        metavar='EXPR',
+                        help='regular expression for names of pods to leave '
+                        'out (repeatable)')
+    retry.add_arguments(parser)
+    parser.add_argument('--journal',
+                        help="record the pods and each refresh's progress "
+                        'in this file')
+    parser.add_argument('-resume',
+                        action='store_const',
+                        const=True,
+                        help='finish the job recorded in --journal')
+    parser.add_argument('-fresh',
+                        action='store_const',
+                        const=True,
+                        help='list from the server, not a saved snapshot')
+    parser.add_argument('-n',
+                        action='store_const',
+                        const=True,
+                        help='dry run')
+    parser.add_argument('-y',
+                        action='store_const',
+                        const=True,
+                        help='refresh without asking for confirmation')
+    parser.add_argument('-q',
+                        action='store_const',
+                        const=True,
+                        help='quiet (no clone messages)')
+    parser.add_argument('podexprs',
+                        help='regular expressions for names of pods to '
+                        'refresh',
+                        nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    if args.resume:
+        if not args.journal:
+            parser.error('-resume needs --journal')
+        try:
+            plan, states = read_journal(args.journal)
+        except (OSError, JournalError) as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        if plan.get('job') != 'refresh':
+            print(f'{args.journal} is not a refresh journal', file=sys.stderr)
+            sys.exit(1)
+        args.src_pid = plan['src_pid']
+        args.clone_datastore = plan['datastore']
+        args.removal_type = plan['removal_type']
+        args.min_online = plan['min_online']
+        args.batch_size = plan['batch_size']
+    elif not args.podexprs or args.src_pid is None:
+        parser.error('podexprs and --src_pid are needed unless -resume')
+    if not args.datacenter:
+        parser.error('No datacenter given (--datacenter or NETLAB_VDC)')
+    Quiet = args.q
+    clone_pod.Quiet = args.q
+    journal = Journal(args.journal) if args.journal and not args.n else None
+
+    async with api_trace.open_client() as api:
+        api = retry.wrap(api, args)
+        # A dry run may use a saved snapshot; real refreshes list afresh
+        fresh = args.fresh or not args.n
+        all_pods = await snapshot.pod_list(api, fresh)
+        pod_hosts = await pod_index.get_pod_hosts(api, args.datacenter,
+                                                  fresh)
+        live = {pod['pod_id']: pod for pod in all_pods}
+
+        taken = []
+        if args.resume:
+            # An id freed by a removal may since have gone to a new pod,
+            # which must not be wiped in its place
+            pending = [pod for pod in plan['pods']
+                       if states.get(pod['pod_id']) != 'done']
+            for pod in pending:
+                pod_id = pod['pod_id']
+                if pod_id in live \
+                        and live[pod_id]['pod_name'] != pod['pod_name']:
+                    print(f'Pod id {pod_id} now belongs to'
+                          f' {live[pod_id]["pod_name"]}; not refreshing'
+                          f' {pod["pod_name"]}')
+                    taken.append(pod)
+            # Pods part way through keep their planned host and state;
+            # only those online now cost capacity to refresh
+            pods = [dict(pod,
+                         up=pod['pod_id'] in live and getattr(
+                             live[pod['pod_id']]['pod_current_state'],
+                             'name', None) == 'ONLINE')
+                    for pod in pending if pod not in taken]
+        else:
+            selected = selection.select(
+                [pod for pod in all_pods if pod['pod_id'] != args.src_pid],
+                'pod_name',
+                args.podexprs,
+                args.exclude)
+            pods = []
+            for pod in selected:
+                if pod['pod_id'] not in pod_hosts:
+                    print(f'{pod["pod_name"]} has no VMs on any host;'
+                          ' skipping it', file=sys.stderr)
+                    continue
+                up = pod['pod_current_state'].name == 'ONLINE'
+                pods.append({'pod_id': pod['pod_id'],
+                             'pod_name': pod['pod_name'],
+                             'vh_id': pod_hosts[pod['pod_id']],
+                             'online': up,
+                             'up': up})
+
+        # Leave reservations in progress or about to start alone; a
+        # resumed pod already started must be finished regardless
+        index = ReservationIndex(await list_reservations(api))
+        now = datetime.now()
+        end = now + timedelta(minutes=args.guard)
+        reserved = [pod for pod in pods
+                    if not (args.resume and states.get(pod['pod_id']))
+                    and not index.is_free(pod['pod_id'], now, end)]
+        if reserved:
+            print('Skipping reserved pods: '
+                  + ', '.join(pod['pod_name'] for pod in reserved))
+            pods = [pod for pod in pods if pod not in reserved]
+        if not pods:
+            print('No pods to refresh')
+            return
+        # Pods of a journaled move (see rebalance_pods.py) name their own
+        # master pods
+        sources = sorted({pod.get('src_pid', args.src_pid) for pod in pods})
+        for src_pid in sources:
+            if src_pid not in live:
+                print(f'Source pod {src_pid} does not exist',
+                      file=sys.stderr)
+                sys.exit(1)
+
+        # Pods down part way through a resumed job add to the budget
+        # as they come back online
+        up = sum(1 for pod in pods if pod['up'])
+        returning = sum(1 for pod in pods if pod['online'] and not pod['up'])
+        budget = up - args.min_online
+        if up and budget + returning <= 0:
+            print(f'Only {up + returning} of the pods can be online; none'
+                  f' can be taken down while {args.min_online} must stay'
+                  ' online', file=sys.stderr)
+            sys.exit(1)
+        batches = host_batches(pods, args.batch_size)
+        print(f'Refreshing {len(pods)} pods from pod'
+              f' {", ".join(str(src_pid) for src_pid in sources)},'
+              f' {max(budget, 0)} online pods out of service at most'
+              + (f' ({returning} more as pods come back online)'
+                 if returning else '') + ':')
+        for vh_id, host_pods in batches.items():
+            print(f'  vh_id {vh_id}: '
+                  + ' | '.join(', '.join(pod['pod_name'] for pod in batch)
+                               for batch in host_pods))
+        print('Removal type is ' + args.removal_type)
+        if args.n:
+            return
+        if not args.y:
+            yes_no = input('Do you want to refresh all these pods (y/n)? ')
+            if yes_no[0].lower() != 'y':
+                sys.exit(2)
+        if journal:
+            try:
+                if args.resume:
+                    journal.open()
+                else:
+                    journal.open({'job': 'refresh',
+                                  'src_pid': args.src_pid,
+                                  'datastore': args.clone_datastore,
+                                  'removal_type': args.removal_type,
+                                  'min_online': args.min_online,
+                                  'batch_size': args.batch_size,
+                                  'pods': pods})
+            except JournalError as err:
+                print(err, file=sys.stderr)
+                sys.exit(1)
+            for pod in taken:
+                journal.finish(pod['pod_id'], True,
+                               'already gone; id now '
+                               + live[pod['pod_id']]['pod_name'])
+
+        refreshed, failed, skipped = await refresh_pods(
+            api,
+            pods,
+            args.src_pid,
+            args.clone_datastore,
+            RemoveVMS[args.removal_type.upper()],
+            budget,
+            args.batch_size,
+            args.online_timeout,
+            journal,
+            gone={pod['pod_id'] for pod in pods
+                  if pod['pod_id'] not in live})
+        if journal:
+            journal.close()
+
+        print(Summary)
+        print(f'{len(refreshed)} refreshed, {len(failed)} failed,'
+              f' {len(skipped)} not started')
+        if skipped:
+            print('Not started after a failure: ' + ', '.join(skipped))
+        print(api.report())
+        if failed or skipped:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,202 @@
+'''
+reservations.py
+
+Index of existing Netlab-VE+ reservations by pod.
+
+Existing reservations are listed once and kept, per pod, as intervals
+sorted by start time, so a script can tell which pods are free for a
+time window before it tries to reserve anything, and can suggest the
+earliest window in which enough pods are free.
+
+Every listing is checked for the fields named in RESERVATION_PROPERTIES:
+list_reservations names a field the server did not return rather than
+let a KeyError surface later, and reads times the server gives as text.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import bisect
+import datetime
+
+RESERVATION_PROPERTIES = ['res_id', 'pod_id', 'res_start', 'res_end']
+
+# Fields holding times, which may come back as text
+RESERVATION_TIMES = ('res_start', 'res_end')
+
+
+##
+# parse_time: Parse "[MM/DD/YYYY ]HH:MM" (date defaults to today)
+#
+# ISO times ("YYYY-MM-DD HH:MM") are accepted too, and a datetime is
+# returned as it is, so values YAML has already read as datetimes can be
+# passed straight through.
+#
+def parse_time(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    text = str(value).strip()
+    if '-' in text:
+        return datetime.datetime.fromisoformat(text)
+    if '/' in text:
+        return datetime.datetime.strptime(text, '%m/%d/%Y %H:%M')
+    return datetime.datetime.combine(
+        datetime.date.today(),
+        datetime.datetime.strptime(text, '%H:%M').time())
+
+
+##
+# reservation_time: A reservation time as a local, naive datetime
+#
+# value: datetime or text ("YYYY-MM-DD[ T]HH:MM[:SS][+HH:MM]" or as
+#        parse_time reads)
+#
+def reservation_time(value):
+    value = parse_time(value)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+##
+# list_reservations: Get every current and upcoming reservation
+#
+# api: netlab client connection
+#
+# Times given as text are parsed.  Raises ValueError if a reservation
+# lacks one of RESERVATION_PROPERTIES or has a time that cannot be read.
+#
+async def list_reservations(api):
+    reservations = \
+        await api.reservation_list(properties=RESERVATION_PROPERTIES)
+    for res in reservations:
+        missing = [key for key in RESERVATION_PROPERTIES if key not in res]
+        if missing:
+            raise ValueError(f'reservation_list gave no'
+                             f' {", ".join(missing)} in {res}')
+        for key in RESERVATION_TIMES:
+            res[key] = reservation_time(res[key])
+    return reservations
+
+
+##
+# ReservationIndex: reserved intervals of each pod
+#
+# reservations: list of reservation dicts (see list_reservations)
+#
+class ReservationIndex:
+
+    def __init__(self, reservations):
+        self.intervals = {}
+        self.max_ends = {}
+        self.ends = set()
+        for res in reservations:
+            self.intervals.setdefault(res['pod_id'], []).append(
+                (res['res_start'], res['res_end']))
+            self.ends.add(res['res_end'])
+        for pod_id in self.intervals:
+            self.intervals[pod_id].sort()
+            self.update(pod_id)
+
+    ##
+    # update: Recompute the running maximum of end times for pod_id
+    #
+    def update(self, pod_id):
+        max_ends = []
+        for _, end in self.intervals[pod_id]:
+            max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+        self.max_ends[pod_id] = max_ends
+
+    ##
+    # add: Record a new reservation of pod_id from start to end
+    #
+    def add(self, pod_id, start, end):
+        bisect.insort(self.intervals.setdefault(pod_id, []), (start, end))
+        self.ends.add(end)
+        self.update(pod_id)
+
+    ##
+    # is_free: Whether pod_id has no reservation overlapping [start, end)
+    #
+    def is_free(self, pod_id, start, end):
+        intervals = self.intervals.get(pod_id)
+        if not intervals:
+            return True
+        # reservations starting before end; any still running at start?
+        before = bisect.bisect_left(intervals, (end,))
+        return before == 0 or self.max_ends[pod_id][before - 1] <= start
+
+    ##
+    # free_pods: The pods (in the given order) free for [start, end)
+    #
+    def free_pods(self, pod_ids, start, end):
+        return [pod_id for pod_id in pod_ids
+                if self.is_free(pod_id, start, end)]
+
+    ##
+    # peak_demand: Most reservations of the given pods running at once
+    # during [start, end)
+    #
+    def peak_demand(self, pod_ids, start, end):
+        events = []
+        for pod_id in pod_ids:
+            for res_start, res_end in self.intervals.get(pod_id, ()):
+                if res_start < end and start < res_end:
+                    events.append((max(res_start, start), 1))
+                    events.append((res_end, -1))
+        # An end sorts before a start at the same moment, so back-to-back
+        # reservations of one pod count once
+        peak = running = 0
+        for _, change in sorted(events):
+            running += change
+            peak = max(peak, running)
+        return peak
+
+    ##
+    # best_window: Earliest window of the given length with enough pods
+    #
+    # pod_ids: candidate pods
+    # count: pods needed
+    # start: earliest acceptable start
+    # duration: timedelta length of the window
+    # latest: optional latest acceptable start
+    #
+    # Windows can only open when a reservation ends, so the candidate
+    # starts are start itself and every reservation end after it.
+    #
+    # Returns (window_start, free_pod_ids) for the earliest window with
+    # count free pods, or for the window with the most free pods if none
+    # has enough.
+    #
+    def best_window(self, pod_ids, count, start, duration, latest=None):
+        best = (start, [])
+        for when in sorted({start} | {end for end in self.ends
+                                      if end > start}):
+            if latest is not None and when > latest:
+                break
+            free = self.free_pods(pod_ids, when, when + duration)
+            if len(free) >= count:
+                return when, free
+            if len(free) > len(best[1]):
+                best = (when, free)
+        return best
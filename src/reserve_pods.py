@@ -7,26 +7,65 @@ usage: reserve_pods.py [-h] [-n]
           --end "[MM/DD/YYYY ]HH:MM"
           --class_spec <partial (class name>|<cls_id>)
           --ex_name <exercise_name>
-          
+          [--max_inflight MAX_INFLIGHT]
+          [--datacenter DATACENTER] [--host_weight VH_ID=WEIGHT]
+
+       reserve_pods.py [-h] [-n] --schedule <schedule file>
+          [--max_inflight MAX_INFLIGHT]
+          [--datacenter DATACENTER] [--host_weight VH_ID=WEIGHT]
+
 
 Identifies pods based on class specification and exercise name.
 Attempts to reserve one for each team in the class
 during time period specified.
 
+Existing reservations are loaded once and pods already reserved during
+the requested period are skipped up front.  If too few pods are free,
+the earliest window of the same length with enough free pods is
+reported instead.
+
+Free pods are then ordered so that the teams' pods, which will all run
+at the same time, are spread evenly over the datacenter's hosts (in
+proportion to any --host_weight given) rather than taken in pod_list()
+order.
+
+Reservations for all teams are made concurrently.  When a reservation
+fails, the team is moved to the next spare pod, so one failure does not
+shift the pods given to later teams.  A summary of every team's
+reservation is printed at the end.
+
+With --schedule, a whole term's reservations are made in one run.  The
+schedule is a CSV file with columns class_spec, ex_name, start and end
+(one row per window), or a YAML file (needs PyYAML) holding a list of
+entries with class_spec, ex_name and either start and end or a list of
+windows, each with start and end.  Classes, exercises, pods and existing
+reservations are fetched once, every reservation is planned together
+(so entries in the same window never get the same pod), and the plan is
+then carried out concurrently.
+
 Flags
           -h : print help message
           -n : dry run (don't make the reservations)
-Arguments         
+Arguments
        start : start (date and) time (assumed to be now if omitted)
          end : end (date and) time
   class_spec : either a cls_id (number)
                or a string that uniquely matches a class name
      ex_name : string that uniquely matches an exercise in the class
-      
+    schedule : CSV or YAML file of reservations to make (see above)
+max_inflight : reservations that may be made at once (default 8)
+  datacenter : datacenter whose hosts teams are spread over
+               (from environment var NETLAB_VDC if not specified)
+ host_weight : VH_ID=WEIGHT relative capacity of a host (repeatable)
+
 """
 
 import argparse
+import asyncio
+import collections
+import csv
 import enum
+import os
 import sys
 import random
 
@@ -34,136 +73,473 @@ import datetime
 from datetime import timedelta, datetime
 import re
 
-from netlab.sync_client import SyncClient
 from netlab.enums import ReservationType
 
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+import accounts
+import api_trace
+import placement
+import pod_index
+from reservations import ReservationIndex, list_reservations, parse_time
+
 TEAMS=list(map(chr,range(ord('A'),ord('Z')+1)))
 WILSON_ACC_ID = 100162
-def main():
+
+
+##
+# reserve_teams: Reserve a pod for each team, concurrently
+#
+# api: netlab client connection
+# teams: team letters to reserve for
+# pod_pids: candidate pod ids, in order of preference; the first
+#           len(teams) are given to the teams and the rest are spares
+# reservation: dict of the other reservation_make arguments
+#              (type, cls_id, ex_id, end_time, acc_id, maybe start_time)
+# max_inflight: reservations that may be made at once
+# limit: optional semaphore shared with other reserve_teams calls
+#        (used instead of max_inflight)
+#
+# Teams are reserved in rounds.  After a round with failures the
+# reservations are listed once: a team whose pod has since been reserved
+# by someone else is retried on the next spare pod in the next round,
+# until it succeeds or the spares run out.  Any other failure (a bad
+# class or exercise, a lost connection, ...) would fail on every pod
+# alike, so that team is not retried.
+#
+# Returns (reserved, failures) where reserved maps each team to
+# (pod_id, result), with pod_id None and the error as result if the team
+# got no pod, and failures lists (team, pod_id, error) for every attempt
+# that failed because the pod was taken.
+#
+async def reserve_teams(api,
+                        teams,
+                        pod_pids,
+                        reservation,
+                        max_inflight=8,
+                        limit=None):
+    limit = limit or asyncio.Semaphore(max_inflight)
+    spares = collections.deque(pod_pids[len(teams):])
+    failures = []
+    reserved = {}
+
+    async def reserve_team(team, pod_id):
+        async with limit:
+            return await api.reservation_make(team=team,
+                                              pod_id=pod_id,
+                                              **reservation)
+
+    pending = list(zip(teams, pod_pids))
+    while pending:
+        results = await asyncio.gather(
+            *[reserve_team(team, pod_id) for team, pod_id in pending],
+            return_exceptions=True)
+        errors = []
+        for (team, pod_id), result in zip(pending, results):
+            if isinstance(result, BaseException):
+                errors.append((team, pod_id, result))
+            else:
+                reserved[team] = (pod_id, result)
+        pending = []
+        if not errors:
+            break
+
+        try:
+            index = ReservationIndex(await list_reservations(api))
+        except Exception as err:
+            print(f'Could not list reservations: {err}', file=sys.stderr)
+            index = None
+        start = reservation.get('start_time') or datetime.now()
+        for team, pod_id, err in errors:
+            if index is None \
+                    or index.is_free(pod_id, start, reservation['end_time']):
+                reserved[team] = (None, err)
+                continue
+            failures.append((team, pod_id, err))
+            if spares:
+                pending.append((team, spares.popleft()))
+            else:
+                reserved[team] = (None, err)
+    return reserved, failures
+
+
+##
+# print_summary: Print the outcome of reserve_teams
+#
+# reserved, failures: as returned by reserve_teams
+# pod_names: dict from pod id to pod name
+#
+# Returns the number of teams left without a pod.
+#
+def print_summary(reserved, failures, pod_names):
+    print('Reservation Summary:')
+    unreserved = 0
+    for team in sorted(reserved):
+        pod_id, result = reserved[team]
+        if pod_id is None:
+            print(f'  team {team}: NOT RESERVED ({result})')
+            unreserved += 1
+        else:
+            print(f'  team {team}: {pod_names[pod_id]} {result}')
+    for team, pod_id, err in failures:
+        print(f'  problem reserving pod {pod_names[pod_id]}'
+              f' for team {team} -- pod skipped ({err})')
+    return unreserved
+
+
+##
+# find_cls_id: cls_id of the class a class_spec names (None if not unique)
+#
+# class_spec: cls_id (number) or string that uniquely matches a class name
+# class_list: result of class_list(properties=['cls_name', 'cls_id'])
+#
+def find_cls_id(class_spec, class_list):
+    class_entry = accounts.find_class(class_spec, class_list)
+    return class_entry['cls_id'] if class_entry else None
+
+
+##
+# find_exercise: The exercise ex_name uniquely matches (None if not unique)
+#
+# exlist: result of lab_exercise_list(properties=['ex_id','ex_name','ex_pt_id'])
+#
+def find_exercise(ex_name, exlist):
+    exes = [x for x in exlist if ex_name in x['ex_name']]
+    return exes[0] if len(exes) == 1 else None
+
+
+##
+# schedule_time: A start or end time from a schedule file, as a string
+# for parse_time or a datetime
+#
+# YAML 1.1 reads HH:MM as a base-60 integer (10:30 is 630) and a full
+# date and time as a datetime; both are turned back into times here.
+#
+def schedule_time(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f'{value // 60:02d}:{value % 60:02d}'
+    return str(value)
+
+
+##
+# read_schedule: Read reservations to make from a CSV or YAML file
+#
+# Returns a list of dicts with keys class_spec, ex_name, start and end,
+# one per reservation window (times still as strings or datetimes).
+#
+def read_schedule(path):
+    if path.endswith(('.yaml', '.yml')):
+        if yaml is None:
+            sys.exit('Reading a YAML schedule needs PyYAML '
+                     '(pip install pyyaml); or use a CSV schedule')
+        with open(path) as schedule_file:
+            entries = yaml.safe_load(schedule_file) or []
+    else:
+        with open(path, newline='') as schedule_file:
+            entries = list(csv.DictReader(schedule_file))
+
+    windows = []
+    for entry in entries:
+        for window in entry.get('windows') or [entry]:
+            windows.append({'class_spec': str(entry['class_spec']),
+                            'ex_name': str(entry['ex_name']),
+                            'start': schedule_time(window['start']),
+                            'end': schedule_time(window['end'])})
+    return windows
+
+
+##
+# plan_schedule: Decide which pods every scheduled reservation gets
+#
+# entries: list from read_schedule
+# class_list, exlist, all_pods: reference data fetched once
+# rosters: dict from cls_id to class_roster_list result
+# res_index: ReservationIndex of existing reservations (updated with the
+#            planned reservations so later entries avoid them)
+# pod_hosts: pod to vh_id index ({} to keep pod_list order)
+# weights: host weights for placement.balanced_order
+#
+# Returns (plans, problems): plans is a list of dicts with keys entry,
+# cls_id, ex_id, start, end, teams and pod_pids (the pods for the teams
+# followed by spares); problems lists messages for entries not planned.
+#
+def plan_schedule(entries, class_list, exlist, all_pods, rosters,
+                  res_index, pod_hosts, weights):
+    plans = []
+    problems = []
+    for entry in entries:
+        label = f'{entry["class_spec"]}/{entry["ex_name"]}' \
+            f' {entry["start"]}-{entry["end"]}'
+        cls_id = find_cls_id(entry['class_spec'], class_list)
+        exercise = find_exercise(entry['ex_name'], exlist)
+        if cls_id is None or exercise is None:
+            problems.append(f'{label}: class or exercise not found/unique')
+            continue
+        try:
+            start = parse_time(entry['start'])
+            end = parse_time(entry['end'])
+        except ValueError as err:
+            problems.append(f'{label}: bad time ({err})')
+            continue
+        teams = TEAMS[:len({x['ros_team'] for x in rosters[cls_id]})]
+        candidates = [x['pod_id'] for x in all_pods
+                      if x['pt_id'] == exercise['ex_pt_id']]
+        free_pids = res_index.free_pods(candidates, start, end)
+        if len(free_pids) < len(teams):
+            when, window_pids = res_index.best_window(candidates,
+                                                      len(teams),
+                                                      start,
+                                                      end - start)
+            problems.append(f'{label}: only {len(free_pids)} pods free for'
+                            f' {len(teams)} teams; best window starts'
+                            f' {when} with {len(window_pids)} pods free')
+            continue
+        free_pids = placement.balanced_order(free_pids, pod_hosts, weights)
+        for pod_id in free_pids[:len(teams)]:
+            res_index.add(pod_id, start, end)
+        plans.append({'entry': label,
+                      'cls_id': cls_id,
+                      'ex_id': exercise['ex_id'],
+                      'start': start,
+                      'end': end,
+                      'teams': teams,
+                      'pod_pids': free_pids[:len(teams)],
+                      'candidates': free_pids})
+
+    # Spares are pods still free once every entry has its pods
+    for plan in plans:
+        plan['pod_pids'] += res_index.free_pods(plan['candidates'],
+                                                plan['start'],
+                                                plan['end'])
+        del plan['candidates']
+    return plans, problems
+
+
+##
+# reserve_schedule: Plan and make every reservation in a schedule file
+#
+# api: netlab client connection
+# args: parsed command line arguments
+#
+async def reserve_schedule(api, args):
+    entries = read_schedule(args.schedule)
+
+    # Fetch reference data once for the whole schedule
+    class_list, exlist, all_pods, existing = await asyncio.gather(
+        api.class_list(properties=['cls_name', 'cls_id']),
+        api.lab_exercise_list(properties=['ex_id', 'ex_name', 'ex_pt_id']),
+        api.pod_list(),
+        list_reservations(api))
+    cls_ids = {find_cls_id(x['class_spec'], class_list) for x in entries}
+    cls_ids.discard(None)
+    cls_ids = list(cls_ids)
+    rosters = dict(zip(cls_ids, await asyncio.gather(
+        *[api.class_roster_list(cls_id=cls_id) for cls_id in cls_ids])))
+    pod_hosts = {}
+    if args.datacenter:
+        pod_hosts = await pod_index.get_pod_hosts(api, args.datacenter)
+
+    plans, problems = plan_schedule(entries,
+                                    class_list,
+                                    exlist,
+                                    all_pods,
+                                    rosters,
+                                    ReservationIndex(existing),
+                                    pod_hosts,
+                                    placement.parse_host_weights(
+                                        args.host_weight))
+
+    names = {x['pod_id']: x['pod_name'] for x in all_pods}
+    print('Reservation plan:')
+    for plan in plans:
+        print(f'  {plan["entry"]}:')
+        for team, pod_id in zip(plan['teams'], plan['pod_pids']):
+            print(f'    team {team}: {names[pod_id]}')
+    for problem in problems:
+        print(f'  NOT PLANNED {problem}')
+
+    yes_no = input(f'Do you want to make these {len(plans)} reservation'
+                   ' sets (y/n)? ')
+    if args.n:
+        print('Dry run--no pods reserved')
+        exit(0)
+    if yes_no[0].lower() != 'y':
+        return
+
+    limit = asyncio.Semaphore(args.max_inflight)
+    results = await asyncio.gather(
+        *[reserve_teams(api,
+                        plan['teams'],
+                        plan['pod_pids'],
+                        {'type': ReservationType.TEAM,
+                         'cls_id': plan['cls_id'],
+                         'ex_id': plan['ex_id'],
+                         'start_time': plan['start'],
+                         'end_time': plan['end'],
+                         'acc_id': WILSON_ACC_ID},
+                        limit=limit)
+          for plan in plans])
+    unreserved = 0
+    for plan, (reserved, failures) in zip(plans, results):
+        print(plan['entry'])
+        unreserved += print_summary(reserved, failures, names)
+    if unreserved:
+        sys.exit(1)
+
+
+async def main():
     parser = argparse.ArgumentParser(description='Reserve NDG pods for teams in a class')
     parser.add_argument('-n',
                         action='store_true',
                         help="dry run--do exerything but reserve the pods.")
     parser.add_argument('--start', help='start time in form "[MM/DD/YYYY] HH:MM"')
-    parser.add_argument('--end', help='end time', required=True)
-    parser.add_argument('--class_spec', help='cls_id or (partial) name of class to schedule for', required=True)
-    parser.add_argument('--ex_name', help='exercise name', required=True)
+    parser.add_argument('--end', help='end time')
+    parser.add_argument('--class_spec', help='cls_id or (partial) name of class to schedule for')
+    parser.add_argument('--ex_name', help='exercise name')
+    parser.add_argument('--schedule',
+                        help='CSV or YAML file of classes, exercises and '
+                        'windows to reserve in one run')
+    parser.add_argument('--max_inflight', type=int, default=8,
+                        help='reservations that may be made at once')
+    parser.add_argument('--datacenter',
+                        default=os.environ.get('NETLAB_VDC'),
+                        help='datacenter used to spread teams over hosts '
+                        '(from environment var NETLAB_VDC if not specified)')
+    parser.add_argument('--host_weight', action='append',
+                        metavar='VH_ID=WEIGHT',
+                        help='relative capacity of a host (repeatable)')
     #parser.add_argument('--ex_id', help='exercise id', required=True)
 
     args = parser.parse_args()
-    api = SyncClient()
+    if not args.schedule and not (args.end and args.class_spec and args.ex_name):
+        parser.error('--end, --class_spec and --ex_name are required '
+                     'without --schedule')
+    async with api_trace.open_client() as api:
+        if args.schedule:
+            await reserve_schedule(api, args)
+            return
 
-    # 1. Try to match class name and bail if impossible with
-    # message listing classes and their cls_ids
+        # 1. Try to match class name and bail if impossible with
+        # message listing classes and their cls_ids
 
-    this_cls_id = None
-    if args.class_spec.isnumeric():
-        this_cls_id = int(args.class_spec)
+        this_cls_id = None
+        if args.class_spec.isnumeric():
+            this_cls_id = int(args.class_spec)
 
-        # verify class exists by attempting a class_get
-        api.class_get(cls_id=this_cls_id)
-    else:
-        class_list = api.class_list(properties=['cls_name', 'cls_id'])
-        matches = [match for match in class_list if args.class_spec in match["cls_name"]]
-        print(matches)
-        if len(matches) == 1:
-            this_cls_id = matches[0]["cls_id"]
-    assert this_cls_id !=  None, f'Class "{args.class_spec}" not found'
-    
-
-    # 2. Get this_ex_id from args.ex_name and grab this_pt_id from exercise
-
-    exlist = api.lab_exercise_list(properties=['ex_id','ex_name','ex_pt_id'])
-    exes = list(filter(lambda x:True if args.ex_name in x['ex_name'] else False, exlist))
-    assert len(exes) == 1, 'Too many matching Lab Names: {exes}'
-    this_ex_id = exes[0]['ex_id']
-    this_pt_id = exes[0]['ex_pt_id']
-    print(f'this_pt_id is {this_pt_id}');
-
-    # 3. Get pod start and end times
-    
-    current_time = datetime.now()
-    tt = datetime.timetuple(current_time)
-    if args.start != None:
-        if "/" in args.start:
-            start = datetime.strptime(args.start, '%m/%d/%Y %H:%M')
+            # verify class exists by attempting a class_get
+            await api.class_get(cls_id=this_cls_id)
         else:
-            start = datetime.strptime(str(tt.tm_mon) + '/' + str(tt.tm_mday) + '/' + str(tt.tm_year) + ' ' + args.start,'%m/%d/%Y %H:%M')
-    else:
-        start = datetime.now()
+            class_list = await api.class_list(properties=['cls_name', 'cls_id'])
+            matches = [match for match in class_list if args.class_spec in match["cls_name"]]
+            print(matches)
+            if len(matches) == 1:
+                this_cls_id = matches[0]["cls_id"]
+        assert this_cls_id !=  None, f'Class "{args.class_spec}" not found'
 
 
-    if args.end and '/' in args.end:
-        end = datetime.strptime(args.end,'%m/%d/%Y %H:%M')
-    else:
-        end = datetime.strptime(str(tt.tm_mon) + '/' + str(tt.tm_mday) + '/' + str(tt.tm_year) + ' ' + args.end,'%m/%d/%Y %H:%M')
+        # 2. Get this_ex_id from args.ex_name and grab this_pt_id from exercise
 
-    # 4. Get team info from class roster
-    class_team_list = api.class_roster_list(cls_id=this_cls_id)
-    class_team_list = list(map(lambda x: x["ros_team"], class_team_list))
-    all_teams = {}
-    for x in class_team_list:
-        all_teams[x] = 1
-    class_team_list = list(all_teams.keys())
-    class_team_list.sort()
-       
-    # 5. Get list of VMs with pod type this_pt_id
-    all_pods = api.pod_list()
-    pods  = list(filter(lambda x: this_pt_id == x['pt_id'], all_pods))
+        exlist = await api.lab_exercise_list(properties=['ex_id','ex_name','ex_pt_id'])
+        exes = list(filter(lambda x:True if args.ex_name in x['ex_name'] else False, exlist))
+        assert len(exes) == 1, 'Too many matching Lab Names: {exes}'
+        this_ex_id = exes[0]['ex_id']
+        this_pt_id = exes[0]['ex_pt_id']
+        print(f'this_pt_id is {this_pt_id}');
 
-    print(f'pods: {pods}')
+        # 3. Get pod start and end times
 
-    pod_names = [x['pod_name'] for x in pods]
-    pod_pids = [x['pod_id'] for x in pods]
+        if args.start != None:
+            start = parse_time(args.start)
+        else:
+            start = datetime.now()
+        end = parse_time(args.end)
 
-    print('Pods to reserve from ' + str(start) + ' to ' + str(end) + ':')
+        # 4. Get team info from class roster
+        class_team_list = await api.class_roster_list(cls_id=this_cls_id)
+        class_team_list = list(map(lambda x: x["ros_team"], class_team_list))
+        all_teams = {}
+        for x in class_team_list:
+            all_teams[x] = 1
+        class_team_list = list(all_teams.keys())
+        class_team_list.sort()
 
-    # 7. Verify intent to make this reservation
-    for name in pod_names:
-        print('  '+name)
+        # 5. Get list of VMs with pod type this_pt_id
+        all_pods = await api.pod_list()
+        pods  = list(filter(lambda x: this_pt_id == x['pt_id'], all_pods))
 
-    yes_no = input('Do you want to reserve these pods from ' + str(start) + ' to ' + str(end) + ' (y/n)? ')
+        print(f'pods: {pods}')
 
-    if args.n:
-        print('Dry run--no pods reserved')
-        exit(0)
-        
-    if yes_no[0].lower() == 'y':
-        # 8. Reserve Pods
-        assert len(pod_pids) >= len(class_team_list), "Not enough pods!"
-
-        pod_index = 0
-        team_index = 0
-        while team_index < len(class_team_list):
-            if args.start == None:
-                #print ('Doing none case')
-                #print(f'reserving {pod_pids[pod_index]} for {team}')
-                result = api.reservation_make(type=ReservationType.TEAM,
-                                              cls_id=this_cls_id,
-                                              team=TEAMS[team_index],
-                                              ex_id=this_ex_id,
-                                              pod_id=pod_pids[pod_index],
-                                              end_time=end,
-                                              acc_id=WILSON_ACC_ID)
+        pod_names = [x['pod_name'] for x in pods]
+        pod_pids = [x['pod_id'] for x in pods]
+        names = dict(zip(pod_pids, pod_names))
+
+        # 6. Keep only pods with no reservation overlapping start..end
+        res_index = ReservationIndex(await list_reservations(api))
+        free_pids = res_index.free_pods(pod_pids, start, end)
+        for pod_id in pod_pids:
+            if pod_id not in free_pids:
+                print(f'  {names[pod_id]} already reserved -- pod skipped')
+        if len(free_pids) < len(class_team_list):
+            when, window_pids = res_index.best_window(pod_pids,
+                                                      len(class_team_list),
+                                                      start,
+                                                      end - start)
+            print(f'Only {len(free_pids)} pods free for'
+                  f' {len(class_team_list)} teams from {start} to {end}.')
+            print(f'Best available window starts {when}'
+                  f' with {len(window_pids)} pods free.')
+            exit(1)
+
+        # 6a. Spread the teams (whose pods will run at the same time)
+        # evenly over hosts, in proportion to any host weights
+        if args.datacenter:
+            pod_hosts = await pod_index.get_pod_hosts(api, args.datacenter)
+            free_pids = placement.balanced_order(
+                free_pids,
+                pod_hosts,
+                placement.parse_host_weights(args.host_weight))
+            for pod_id in free_pids:
+                names[pod_id] = \
+                    f'{names[pod_id]} (vh_id {pod_hosts.get(pod_id)})'
+        pod_pids = free_pids
+        pod_names = [names[pod_id] for pod_id in pod_pids]
+
+        print('Pods to reserve from ' + str(start) + ' to ' + str(end) + ':')
+
+        # 7. Verify intent to make this reservation
+        for name in pod_names:
+            print('  '+name)
+
+        yes_no = input('Do you want to reserve these pods from ' + str(start) + ' to ' + str(end) + ' (y/n)? ')
+
+        if args.n:
+            print('Dry run--no pods reserved')
+            exit(0)
+
+        if yes_no[0].lower() == 'y':
+            # 8. Reserve Pods
+            assert len(pod_pids) >= len(class_team_list), "Not enough pods!"
+
+            reservation = {'type': ReservationType.TEAM,
+                           'cls_id': this_cls_id,
+                           'ex_id': this_ex_id,
+                           'end_time': end,
+                           'acc_id': WILSON_ACC_ID}
+            if args.start != None:
+                reservation['start_time'] = start
+            reserved, failures = \
+                await reserve_teams(api,
+                                    TEAMS[:len(class_team_list)],
+                                    pod_pids,
+                                    reservation,
+                                    args.max_inflight)
+            if print_summary(reserved, failures, names):
+                sys.exit(1)
 
-            else:
-                try:
-                    #print(f'reserving {pod_pids[pod_index]} for {team}')
-                    result = api.reservation_make(type=ReservationType.TEAM,
-                                                  cls_id=this_cls_id,
-                                                  team=TEAMS[team_index],
-                                                  ex_id=this_ex_id,
-                                                  pod_id=pod_pids[pod_index],
-                                                  end_time=end,
-                                                  start_time=start,
-                                                  acc_id=WILSON_ACC_ID) 
-                except BaseException as err:
-                    print('Problem reserving pod ' + str(pod_names[pod_index]) + ' -- pod skipped')
-                    print(format(err))
-                    pod_index += 1
-                    continue
-            pod_index += 1
-            team_index += 1
-            
 if __name__ == "__main__":
-   main()
+   asyncio.run(main())
@@ -1,13 +1,17 @@
 #! /usr/bin/env python3
 
 import argparse
-import re
+import asyncio
+import sys
 DEFAULT_COM_ID = 1
 
-from netlab.client import Client
 from netlab.enums import DateFormat, TimeFormat
 
-def main():
+import api_trace
+import accounts
+import selection
+
+async def main():
 
     si = None
 
@@ -15,6 +19,18 @@ def main():
     parser.add_argument('--passwd',
                         required=True,
                         help='Initial password for account')
+    parser.add_argument('--exclude',
+                        action='append',
+                        metavar='EXPR',
+                        help='regular expression for accounts to leave out (repeatable)')
+    parser.add_argument('--max_inflight',
+                        type=int,
+                        default=8,
+                        help='passwords that may be reset at once')
+    parser.add_argument('-y',
+                        action='store_const',
+                        const=True,
+                        help='reset without asking for confirmation')
     parser.add_argument('acctexprs',
                         help='regular expressions describing accounts to change',
                         nargs=argparse.REMAINDER)
@@ -27,30 +43,27 @@ def main():
         sys.exit(1)
 
     # Identify the pod names matching the regular expressions
-    api = Client()
-
-    all_accts = api.user_account_list()
-    print(all_accts)
-    acct_indices = []
-    for expr in args.acctexprs:
-        prog = re.compile(expr)
-        this_index = list(filter(lambda x: x != None,
-                                 list(map(lambda x, y: y if prog.match(x['acc_user_id']) else None,
-                                          all_accts,
-                                          range(len(all_accts))))))
-        acct_indices += this_index
-
-    print('Resetting passwords for these accounts:')
-    print('\n'.join(list(map(lambda x: x['acc_user_id'], (all_accts[i] for i in acct_indices)))))
-
-    yes_no = input("Do you want to reset the password for all these accounts (y/n)? ")
-    if yes_no[0].lower() != 'y':
-        sys.exit(2)
-
-    for acct_id in list(map(lambda x: x['acc_id'], (all_accts[i] for i in acct_indices))):
-        api.user_account_password_set(acc_id = acct_id,
-                             new_password = args.passwd,
-                             force_reset = False)
-            
+    async with api_trace.open_client() as api:
+
+        all_accts = await api.user_account_list()
+        print(all_accts)
+        accts = selection.select(all_accts, 'acc_user_id', args.acctexprs, args.exclude)
+
+        print('Resetting passwords for these accounts:')
+        print('\n'.join(list(map(lambda x: x['acc_user_id'], accts))))
+
+        if not args.y:
+            yes_no = input("Do you want to reset the password for all these accounts (y/n)? ")
+            if yes_no[0].lower() != 'y':
+                sys.exit(2)
+
+        results = await accounts.set_passwords(api,
+                                               [x['acc_id'] for x in accts],
+                                               args.passwd,
+                                               args.max_inflight)
+        accounts.print_results('Password Summary',
+                               results,
+                               {x['acc_id']: x['acc_user_id'] for x in accts})
+
 if __name__ == "__main__":
-   main()
+   asyncio.run(main())
@@ -0,0 +1,287 @@
+'''
+retry.py
+
+Retries with backoff and adaptive concurrency for Netlab API calls.
+
+Errors are classified by type as transient (timeouts and dropped or
+refused connections) or fatal (anything else, e.g. a pod that does not
+exist).  Transient failures are retried after a jittered exponential
+backoff; fatal ones are raised at once.  Only calls in RETRYABLE, which
+read the inventory or set a state, are ever retried: a call that creates
+or removes something (a clone, a removal, a reservation) may have taken
+effect on the server before its reply was lost, and running it again
+could clone or remove twice.
+
+An AdaptiveLimit caps how many calls are in flight and tunes the cap
+AIMD-style: each call that completes quickly raises it a little
+(additively, about one per cap's worth of calls), while a transient
+failure or a call much slower than the fastest of its kind halves it,
+at most once per slow-call period.  Scripts can then start with a
+generous cap and back off automatically when the server struggles.
+
+RetryingClient applies both to the calls of a client (the limit to every
+call, retries to those in RETRYABLE).  Scripts give themselves the
+--retries and -adaptive options and wrap their client with:
+
+    retry.add_arguments(parser)
+    ...
+    api = retry.wrap(api, args)
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import asyncio
+import collections
+import random
+import time
+
+# Calls that may safely be made again: inventory reads and state changes
+RETRYABLE = frozenset(('class_get',
+                       'class_list',
+                       'class_roster_list',
+                       'lab_exercise_list',
+                       'pod_get',
+                       'pod_list',
+                       'pod_state_change',
+                       'reservation_list',
+                       'user_account_list',
+                       'utilisation',
+                       'vm_datacenter_find',
+                       'vm_host_list',
+                       'vm_inventory_list'))
+
+# Errors that mean the call may well succeed if made again
+TRANSIENT_ERRORS = (asyncio.TimeoutError, ConnectionError)
+
+
+##
+# is_transient: Whether a failed call is worth retrying
+#
+# err: the exception the call raised
+#
+def is_transient(err):
+    return isinstance(err, TRANSIENT_ERRORS)
+
+
+##
+# backoff: Seconds to wait before retry number attempt (0 first)
+#
+# Full jitter: uniform between 0 and base * 2**attempt, capped.
+#
+def backoff(attempt, base=1.0, cap=30.0):
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+##
+# AdaptiveLimit: AIMD cap on the number of calls in flight
+#
+# initial: starting cap
+# minimum: the cap never drops below this
+# maximum: the cap never rises above this
+# decrease: factor applied to the cap on overload
+# tolerance: a call slower than this multiple of the fastest call of
+#            its kind seen counts as overload
+#
+class AdaptiveLimit:
+
+    def __init__(self,
+                 initial=4,
+                 minimum=1,
+                 maximum=64,
+                 decrease=0.5,
+                 tolerance=3.0):
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.fastest = {}
+        self.last_decrease = 0.0
+        self.decreases = 0
+        self.peak = self.limit
+        self.condition = None
+
+    async def __aenter__(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            while self.in_flight >= int(self.limit):
+                await self.condition.wait()
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+        return False
+
+    ##
+    # record: Adjust the cap after a call
+    #
+    # latency: seconds the call took
+    # overloaded: whether it failed in a way that suggests overload
+    # kind: what sort of call it was (e.g. method name); latencies are
+    #       only compared between calls of the same kind
+    #
+    def record(self, latency, overloaded=False, kind=None):
+        if not overloaded:
+            fastest = min(latency, self.fastest.get(kind, latency))
+            self.fastest[kind] = fastest
+            overloaded = latency > self.tolerance * fastest
+        now = time.monotonic()
+        if overloaded:
+            # one cut per slow-call period, not one per slow call
+            if now - self.last_decrease > latency:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self.last_decrease = now
+                self.decreases += 1
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.peak = max(self.peak, self.limit)
+
+
+##
+# call_with_retry: Make a call, retrying transient failures
+#
+# call: coroutine function to call
+# args, kwargs: its arguments
+# retries: retries after the first attempt
+# limit: optional AdaptiveLimit to hold while the call is in flight
+# classify: function from exception to whether it is transient
+# on_retry: optional callback(err, attempt, delay) before each retry
+# kind: what sort of call it is, for the limit's latency comparisons
+#
+async def call_with_retry(call,
+                          *args,
+                          retries=3,
+                          limit=None,
+                          classify=is_transient,
+                          on_retry=None,
+                          kind=None,
+                          **kwargs):
+    attempt = 0
+    while True:
+        try:
+            if limit:
+                async with limit:
+                    start = time.monotonic()
+                    result = await call(*args, **kwargs)
+            else:
+                start = time.monotonic()
+                result = await call(*args, **kwargs)
+        except Exception as err:
+            transient = classify(err)
+            if limit:
+                limit.record(time.monotonic() - start, transient, kind)
+            if not transient or attempt >= retries:
+                raise
+            delay = backoff(attempt)
+            if on_retry:
+                on_retry(err, attempt, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        if limit:
+            limit.record(time.monotonic() - start, kind=kind)
+        return result
+
+
+##
+# RetryingClient: Client wrapper that retries calls that may be repeated
+#
+# api: client to wrap
+# retries: retries after the first attempt of each call in RETRYABLE
+# limit: optional AdaptiveLimit shared by all calls
+#
+class RetryingClient:
+
+    def __init__(self, api, retries=3, limit=None):
+        self.api = api
+        self.retries = retries
+        self.limit = limit
+        self.retried = collections.Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def count(err, attempt, delay):
+            self.retried[name] += 1
+
+        async def call(*args, **kwargs):
+            return await call_with_retry(attr,
+                                         *args,
+                                         retries=self.retries
+                                         if name in RETRYABLE else 0,
+                                         limit=self.limit,
+                                         on_retry=count,
+                                         kind=name,
+                                         **kwargs)
+        return call
+
+    ##
+    # report: One line describing retries and the concurrency cap
+    #
+    def report(self):
+        text = f'Retried calls: {sum(self.retried.values())}'
+        if self.retried:
+            text += f' {dict(self.retried)}'
+        if self.limit:
+            text += (f'; concurrency cap peaked at {int(self.limit.peak)},'
+                     f' cut {self.limit.decreases} times,'
+                     f' ended at {int(self.limit.limit)}')
+        return text
+
+
+##
+# add_arguments: Give a script the --retries and -adaptive options
+#
+# parser: the script's argparse.ArgumentParser
+#
+def add_arguments(parser):
+    parser.add_argument('--retries',
+                        type=int,
+                        default=3,
+                        help='times to retry a call that failed transiently')
+    parser.add_argument('-adaptive',
+                        action='store_const',
+                        const=True,
+                        help='tune calls in flight to server latency '
+                        'and errors')
+
+
+##
+# wrap: Wrap a client as the --retries and -adaptive options ask
+#
+# api: client to wrap
+# args: parsed arguments of a parser given add_arguments
+#
+# Returns a RetryingClient.
+#
+def wrap(api, args):
+    limit = AdaptiveLimit() if args.adaptive else None
+    return RetryingClient(api, args.retries, limit)
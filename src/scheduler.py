@@ -0,0 +1,220 @@
+'''
+scheduler.py
+
+Work-stealing scheduler for per-host Netlab task queues.
+
+Work is first dealt out to per-host queues (see placement.py).  Each host
+works through its own queue from the front; a host whose queue runs dry
+takes pending work from the back of the longest remaining queue, so a
+slow host no longer determines how long the whole run takes.  Hosts
+given no work at all take no part: placement left them out on purpose
+(they may be full), so they must not steal work either.
+
+Each host may run several items at once (slots_per_host), and the total
+in flight can be capped globally (max_inflight) and per group of hosts
+sharing a resource such as a datastore (max_per_group).
+
+While work runs, the scheduler watches for stragglers: items that have
+been in flight far longer than the median time of the items completed
+so far (failed items are left out, as a quick failure says nothing of
+how long the work takes).  Stragglers are reported, and while a host is
+running one, its other slots finish its own queue but steal no work
+from the others: a host already slow should not take on more.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import asyncio
+import collections
+import statistics
+import time
+
+
+##
+# WorkStealingScheduler: runs per-host queues of work items
+#
+# assignment: dict from vh_id to the list of items initially given to it;
+#             hosts with no items are left out
+# steal: whether idle hosts take work queued for other hosts
+# straggler_factor: an item in flight longer than this multiple of the
+#                   median completion time is reported as a straggler
+# min_samples: completions needed before stragglers are looked for
+# on_straggler: optional callback(vh_id, item, elapsed, median)
+#
+class WorkStealingScheduler:
+
+    def __init__(self,
+                 assignment,
+                 steal=True,
+                 straggler_factor=3.0,
+                 min_samples=3,
+                 on_straggler=None):
+        self.queues = {vh_id: collections.deque(items)
+                       for vh_id, items in assignment.items() if items}
+        self.steal = steal
+        self.straggler_factor = straggler_factor
+        self.min_samples = min_samples
+        self.on_straggler = on_straggler
+        self.durations = []
+        self.in_flight = {}
+        self.stragglers = []
+        self.steals = []
+
+    ##
+    # next_item: Pick the next item for a host to work on
+    #
+    # vh_id: host asking for work
+    #
+    # Returns the item, or None when there is nothing left for this host.
+    #
+    def next_item(self, vh_id):
+        if self.queues[vh_id]:
+            return self.queues[vh_id].popleft()
+        if not self.steal:
+            return None
+        self.check_stragglers()
+        if self.is_slow(vh_id):
+            return None
+        victim = max(self.queues, key=lambda x: len(self.queues[x]))
+        if not self.queues[victim]:
+            return None
+        item = self.queues[victim].pop()
+        self.steals.append((item, victim, vh_id))
+        return item
+
+    ##
+    # is_slow: Whether a host has a straggler in flight
+    #
+    def is_slow(self, vh_id):
+        return any(key in self.stragglers
+                   for key, (host, _, _) in self.in_flight.items()
+                   if host == vh_id)
+
+    def median(self):
+        if len(self.durations) < self.min_samples:
+            return None
+        return statistics.median(self.durations)
+
+    ##
+    # check_stragglers: Report in-flight items far slower than the median
+    #
+    def check_stragglers(self):
+        median = self.median()
+        if median is None:
+            return
+        now = time.monotonic()
+        for key, (vh_id, item, start) in list(self.in_flight.items()):
+            elapsed = now - start
+            if elapsed > self.straggler_factor * median \
+                    and key not in self.stragglers:
+                self.stragglers.append(key)
+                if self.on_straggler:
+                    self.on_straggler(vh_id, item, elapsed, median)
+
+    ##
+    # run_slot: Work through items for one host slot until none remain
+    #
+    # vh_id: host to work for
+    # worker: coroutine function worker(vh_id, item); an item fails if
+    #         it raises or returns False
+    # limits: semaphores to hold while an item is in flight
+    #
+    # The limits are acquired before an item is taken, so items stay
+    # queued (and can be stolen) while a slot waits for capacity.
+    #
+    async def run_slot(self, vh_id, worker, limits):
+        while True:
+            held = []
+            try:
+                for limit in limits:
+                    await limit.acquire()
+                    held.append(limit)
+                item = self.next_item(vh_id)
+                if item is None:
+                    return
+                key = (vh_id, item)
+                start = time.monotonic()
+                self.in_flight[key] = (vh_id, item, start)
+                try:
+                    if await worker(vh_id, item) is not False:
+                        self.durations.append(time.monotonic() - start)
+                finally:
+                    del self.in_flight[key]
+            finally:
+                for limit in reversed(held):
+                    limit.release()
+
+    async def watch(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.check_stragglers()
+
+    ##
+    # run: Run worker over every item
+    #
+    # worker: coroutine function worker(vh_id, item), as for run_slot
+    # slots_per_host: items each host may have in flight at once
+    # max_inflight: cap on items in flight across all hosts (None: no cap)
+    # group_of: optional function from vh_id to a shared resource key
+    # max_per_group: cap on items in flight per group_of key
+    # watch_interval: seconds between straggler checks
+    # host_limits: optional dict from vh_id to a semaphore held while an
+    #              item runs on that host, shared with other work on the
+    #              hosts; semaphores missing from it are added with
+    #              slots_per_host places
+    #
+    async def run(self,
+                  worker,
+                  slots_per_host=1,
+                  max_inflight=None,
+                  group_of=None,
+                  max_per_group=None,
+                  watch_interval=5.0,
+                  host_limits=None):
+        global_limit = asyncio.Semaphore(max_inflight) \
+            if max_inflight else None
+        group_limits = {}
+        tasks = []
+        for vh_id in self.queues:
+            limits = []
+            if host_limits is not None:
+                if vh_id not in host_limits:
+                    host_limits[vh_id] = asyncio.Semaphore(slots_per_host)
+                limits.append(host_limits[vh_id])
+            if group_of and max_per_group:
+                group = group_of(vh_id)
+                if group not in group_limits:
+                    group_limits[group] = asyncio.Semaphore(max_per_group)
+                limits.append(group_limits[group])
+            if global_limit:
+                limits.append(global_limit)
+            for _ in range(max(slots_per_host, 1)):
+                tasks.append(asyncio.create_task(
+                    self.run_slot(vh_id, worker, limits)))
+
+        watcher = asyncio.create_task(self.watch(watch_interval))
+        try:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            watcher.cancel()
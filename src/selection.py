@@ -0,0 +1,105 @@
+'''
+selection.py
+
+Selection of pods, VMs and accounts by name expressions.
+
+The scripts take a list of regular expressions on the command line and
+pick the inventory items whose names match any of them.  Rather than
+scanning the inventory once per expression (which also lists an item
+twice when two expressions match it), the expressions are compiled into
+a single matcher and the inventory is scanned once.  Expressions that
+are plain literals (optionally followed by .*) are treated as name
+prefixes and checked with one str.startswith call.  Expressions with
+backreferences are compiled on their own, as joining them to others
+would renumber their groups.  Exclude expressions remove items that
+would otherwise be selected.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import re
+
+# An expression made only of ordinary characters, possibly ending in .*
+# matches (with re.match) exactly the names that start with it.
+_LITERAL_PREFIX = re.compile(r'([^.^$*+?{}\[\]\\|()]*)(?:\.\*)?$')
+
+# Backreferences by number or name, which refer to the wrong group once
+# the expression is joined to others.
+_BACKREF = re.compile(r'\\[1-9]|\(\?P=')
+
+
+##
+# Matcher: tests names against a set of expressions at once
+#
+# exprs: regular expressions (re.match semantics: anchored at the start)
+#
+class Matcher:
+
+    def __init__(self, exprs):
+        prefixes = []
+        patterns = []
+        self.progs = []
+        for expr in exprs or []:
+            literal = _LITERAL_PREFIX.fullmatch(expr)
+            if literal:
+                prefixes.append(literal.group(1))
+            elif _BACKREF.search(expr):
+                self.progs.append(re.compile(expr))
+            else:
+                patterns.append(expr)
+        self.prefixes = tuple(prefixes)
+        if patterns:
+            try:
+                self.progs.append(re.compile('|'.join(f'(?:{expr})'
+                                                      for expr in patterns)))
+            except re.error:
+                # Expressions that cannot share one pattern (duplicate
+                # group names, inline flags, ...) are kept separate.
+                self.progs += [re.compile(expr) for expr in patterns]
+
+    def __call__(self, name):
+        if self.prefixes and name.startswith(self.prefixes):
+            return True
+        return any(prog.match(name) for prog in self.progs)
+
+
+##
+# select: Pick the items whose names match the expressions
+#
+# items: list of dicts (pods, VMs, accounts, ...)
+# key: name of the field holding the item's name (e.g. 'pod_name')
+# includes: expressions naming items to select
+# excludes: expressions naming items to leave out even if included
+#
+# Returns the selected items in their original order, each at most once.
+#
+def select(items, key, includes, excludes=None):
+    include = Matcher(includes)
+    exclude = Matcher(excludes)
+
+    chosen = [item for item in items if include(item[key])]
+
+    if excludes:
+        chosen = [item for item in chosen if not exclude(item[key])]
+    return chosen
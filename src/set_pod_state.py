@@ -2,7 +2,14 @@
 '''
 set_pod_state.py
 
-usage: set_pod_state.py [-h] [--state {online,offline,resume}] [-n] ...
+usage: set_pod_state.py [-h] [--state {online,offline,resume}] [-n]
+                        [--datacenter DATACENTER] [--exclude EXPR]
+                        [--max_inflight MAX_INFLIGHT]
+                        [--max_per_host MAX_PER_HOST] [--rate RATE]
+                        [--wave_size WAVE_SIZE]
+                        [--settle_timeout SETTLE_TIMEOUT]
+                        [--ready_by "[MM/DD/YYYY ]HH:MM"] [-fresh]
+                        [--retries RETRIES] [-adaptive] ...
 
 Online a number of NDG Pods
 
@@ -13,6 +20,43 @@ options:
   -h, --help            show this help message and exit
   --state {online,offline,resume}
   -n                    dry run
+  --datacenter DATACENTER
+                        datacenter used to order pods by host
+                        (from environment var NETLAB_VDC if not specified)
+  --exclude EXPR        regular expression for names of pods to leave out
+                        (repeatable)
+  --max_inflight MAX_INFLIGHT
+                        state changes that may run at once (default 16)
+  --max_per_host MAX_PER_HOST
+                        state changes that may run at once per vm_host
+                        (default 4)
+  --rate RATE           most state changes started per second
+                        (default no limit)
+  --wave_size WAVE_SIZE
+                        change pods in waves of at most this many pods
+                        per vm_host
+  --settle_timeout SETTLE_TIMEOUT
+                        seconds to wait for a wave to reach the state
+                        (default 300)
+  --ready_by "[MM/DD/YYYY ]HH:MM"
+                        spread waves to finish by this time
+  -fresh                list from the server, not a saved snapshot
+                        (dry runs use a snapshot up to five minutes old)
+  --retries RETRIES     times to retry a call that failed transiently
+                        (default 3)
+  -adaptive             tune calls in flight to server latency and errors
+
+Pods are ordered so that consecutive state changes go to different hosts,
+and all state changes run concurrently within the limits above.  The time
+each pod's state change took is reported at the end.
+
+Bringing a whole class online at once boots every VM on a host together.
+With --wave_size, pods change state in waves of at most that many pods
+per host, and each wave must reach the new state (or --settle_timeout
+pass) before the next starts.  A state a pod never reports being in
+(such as resume) cannot be waited for, so its waves start back to back.
+--ready_by spreads the waves out so the last one is due to settle by
+that time (e.g. the start of a lab).
 
 MIT License
 
@@ -40,14 +84,28 @@ SOFTWARE.
 
 import argparse
 import enum
+import os
+import statistics
 import sys
+import time
 
 import datetime
-import re
 import asyncio
-from netlab.async_client import NetlabClient
 from netlab.enums import PodState
 
+import api_trace
+import pod_index
+import retry
+import selection
+import snapshot
+from reservations import parse_time
+from throttle import TokenBucket
+
+# States a pod's pod_current_state can show, and so can be waited for
+SETTLED_STATES = ('ONLINE', 'OFFLINE')
+
+Quiet = False
+
 
 ##
 #
@@ -57,14 +115,222 @@ from netlab.enums import PodState
 # pod_id: id pod to change
 # pod_name: name of pod to change
 # state: PodState to change to
+# limits: semaphores to hold while the change is in flight
+# bucket: optional TokenBucket limiting the rate of state changes
+#
+# Returns the time in seconds the state change took.
 #
 async def change_one_pod_state(api,
                                pod_id,
                                pod_name,
-                               state):
-    result = await api.pod_state_change(pod_id=pod_id,
-                                        state=state)
-    print(f'{pod_name} state {state} {datetime.datetime.now()} {result}')
+                               state,
+                               limits=(),
+                               bucket=None):
+    held = []
+    try:
+        for limit in limits:
+            await limit.acquire()
+            held.append(limit)
+        if bucket:
+            await bucket.acquire()
+        start = time.monotonic()
+        result = await api.pod_state_change(pod_id=pod_id,
+                                            state=state)
+        latency = time.monotonic() - start
+    finally:
+        for limit in reversed(held):
+            limit.release()
+    if not Quiet:
+        print(f'{pod_name} state {state} {datetime.datetime.now()} {result}'
+              f' ({latency:.1f}s)')
+    return latency
+
+
+##
+# change_pod_states: Change the state of many pods concurrently
+#
+# api: netlab client connection
+# pod_pids: ids of pods to change
+# pod_names: names of those pods
+# state: PodState to change to
+# pod_hosts: pod to vh_id index from pod_index.get_pod_hosts
+# max_inflight: state changes that may run at once overall
+# max_per_host: state changes that may run at once on one vm_host
+# rate: most state changes started per second (None: no limit)
+#
+# Returns a dict from pod_id to the latency in seconds of its state
+# change, or to the exception that stopped it.
+#
+async def change_pod_states(api,
+                            pod_pids,
+                            pod_names,
+                            state,
+                            pod_hosts=None,
+                            max_inflight=16,
+                            max_per_host=4,
+                            rate=None):
+    pod_hosts = pod_hosts or {}
+    global_limit = asyncio.Semaphore(max_inflight)
+    host_limits = {}
+    for pod_id in pod_pids:
+        vh_id = pod_hosts.get(pod_id)
+        if vh_id not in host_limits:
+            host_limits[vh_id] = asyncio.Semaphore(max_per_host)
+    bucket = TokenBucket(rate) if rate else None
+
+    # Take the host's slot before a global one so pods waiting on a
+    # busy host do not hold up pods on idle hosts.
+    results = await asyncio.gather(
+        *[change_one_pod_state(api,
+                               pod_id,
+                               pod_name,
+                               state,
+                               (host_limits[pod_hosts.get(pod_id)],
+                                global_limit),
+                               bucket)
+          for pod_id, pod_name in zip(pod_pids, pod_names)],
+        return_exceptions=True)
+    return dict(zip(pod_pids, results))
+
+
+##
+# wait_for_state: Wait until pods reach a state or a timeout passes
+#
+# Only states in SETTLED_STATES can be reached; pods never reach others.
+#
+# api: netlab client connection
+# pod_pids: ids of pods to watch
+# state: PodState the pods should reach
+# timeout: seconds to wait at most
+# poll: seconds between checks
+#
+# Returns the ids of pods that had not reached the state.
+#
+async def wait_for_state(api, pod_pids, state, timeout, poll=5.0):
+    deadline = time.monotonic() + timeout
+    pending = list(pod_pids)
+    while pending:
+        props = await asyncio.gather(
+            *[api.pod_get(pod_id=pod_id, properties='pod_current_state')
+              for pod_id in pending],
+            return_exceptions=True)
+        pending = [pod_id for pod_id, prop in zip(pending, props)
+                   if isinstance(prop, BaseException)
+                   or prop['pod_current_state'].name != state.name]
+        if not pending or time.monotonic() + poll > deadline:
+            break
+        await asyncio.sleep(poll)
+    return pending
+
+
+##
+# make_waves: Split pods into waves with at most wave_size per host
+#
+# pod_pids: ids of pods to change
+# pod_hosts: pod to vh_id index from pod_index.get_pod_hosts
+# wave_size: pods per host in each wave
+#
+# Returns a list of waves, each a list of pod ids.
+#
+def make_waves(pod_pids, pod_hosts, wave_size):
+    waves = []
+    for host_pids in pod_index.group_by_host(pod_pids, pod_hosts).values():
+        for i in range(0, len(host_pids), wave_size):
+            wave = i // wave_size
+            if wave == len(waves):
+                waves.append([])
+            waves[wave] += host_pids[i:i+wave_size]
+    return waves
+
+
+##
+# change_pod_states_in_waves: Change pod states a wave at a time
+#
+# Each wave holds at most wave_size pods per host; the next wave starts
+# once every pod in the current one has reached the new state or
+# settle_timeout seconds have passed (waves of a state the pods never
+# report being in are not waited for).  With ready_by, waves are spread
+# evenly over the time until then rather than started back to back.
+#
+# api: netlab client connection
+# pod_pids: ids of pods to change
+# pod_names: names of those pods
+# state: PodState to change to
+# pod_hosts: pod to vh_id index from pod_index.get_pod_hosts
+# wave_size: pods per host in each wave
+# settle_timeout: seconds to wait for a wave to settle
+# ready_by: optional datetime by which all waves should be done
+# rate: most state changes started per second (None: no limit)
+# max_inflight: state changes that may run at once overall
+#
+# Returns the same dict as change_pod_states.
+#
+async def change_pod_states_in_waves(api,
+                                     pod_pids,
+                                     pod_names,
+                                     state,
+                                     pod_hosts,
+                                     wave_size,
+                                     settle_timeout,
+                                     ready_by=None,
+                                     rate=None,
+                                     max_inflight=16):
+    names = dict(zip(pod_pids, pod_names))
+    waves = make_waves(pod_pids, pod_hosts, wave_size)
+    spacing = 0
+    if ready_by and waves:
+        remaining = (ready_by - datetime.datetime.now()).total_seconds()
+        spacing = max(remaining - settle_timeout, 0) / len(waves)
+    start = time.monotonic()
+
+    latencies = {}
+    for number, wave in enumerate(waves):
+        delay = start + number * spacing - time.monotonic()
+        if delay > 0:
+            print(f'Wave {number+1} starts in {delay:.0f}s')
+            await asyncio.sleep(delay)
+        print(f'Wave {number+1} of {len(waves)}: {len(wave)} pods')
+        latencies.update(
+            await change_pod_states(api,
+                                    wave,
+                                    [names[pod_id] for pod_id in wave],
+                                    state,
+                                    pod_hosts,
+                                    max_inflight=min(max_inflight,
+                                                     len(wave)),
+                                    max_per_host=wave_size,
+                                    rate=rate))
+        if state.name not in SETTLED_STATES:
+            continue
+        changed = [pod_id for pod_id in wave
+                   if not isinstance(latencies[pod_id], BaseException)]
+        unsettled = await wait_for_state(api, changed, state, settle_timeout)
+        if unsettled:
+            print(f'Wave {number+1}: not {state} after {settle_timeout}s:'
+                  f' {[names[pod_id] for pod_id in unsettled]}')
+    if ready_by and datetime.datetime.now() > ready_by:
+        print(f'Warning: finished after requested ready time {ready_by}')
+    return latencies
+
+
+##
+# report_latencies: Print per-pod state change latency and totals
+#
+# latencies: dict returned by change_pod_states
+# names: dict from pod id to pod name
+#
+def report_latencies(latencies, names):
+    ok = []
+    print('State change summary:')
+    for pod_id, latency in latencies.items():
+        if isinstance(latency, BaseException):
+            print(f'  {names[pod_id]}: failed {latency}')
+        else:
+            ok.append(latency)
+            print(f'  {names[pod_id]}: {latency:.1f}s')
+    if ok:
+        print(f'{len(ok)} of {len(latencies)} pods changed;'
+              f' median {statistics.median(ok):.1f}s, max {max(ok):.1f}s')
 
 
 async def main():
@@ -78,28 +344,79 @@ async def main():
                         action='store_const',
                         const=True,
                         help='dry run')
+    parser.add_argument('--datacenter',
+                        help='datacenter used to order pods by host '
+                        '(from environment var NETLAB_VDC if not specified)',
+                        default=os.environ.get('NETLAB_VDC'))
+    parser.add_argument('--exclude',
+                        action='append',
+                        metavar='EXPR',
+                        help='regular expression for names of pods to leave '
+                        'out (repeatable)')
+    parser.add_argument('--max_inflight',
+                        type=int,
+                        default=16,
+                        help='state changes that may run at once')
+    parser.add_argument('--max_per_host',
+                        type=int,
+                        default=4,
+                        help='state changes that may run at once per vm_host')
+    parser.add_argument('--rate',
+                        type=float,
+                        help='most state changes started per second')
+    parser.add_argument('--wave_size',
+                        type=int,
+                        help='change pods in waves of at most this many '
+                        'pods per vm_host')
+    parser.add_argument('--settle_timeout',
+                        type=float,
+                        default=300,
+                        help='seconds to wait for a wave to reach the state')
+    parser.add_argument('--ready_by',
+                        help='spread waves to finish by "[MM/DD/YYYY ]HH:MM"')
+    parser.add_argument('-fresh',
+                        action='store_const',
+                        const=True,
+                        help='list from the server, not a saved snapshot '
+                        '(dry runs only)')
+    retry.add_arguments(parser)
     parser.add_argument('podexprs',
                         help='regular expression for names of pods to set',
                         nargs=argparse.REMAINDER)
     args = parser.parse_args()
 
     args.state = PodState[args.state.upper()]
+    ready_by = None
+    if args.ready_by:
+        if not args.wave_size:
+            print('--ready_by needs --wave_size', file=sys.stderr)
+            sys.exit(1)
+        ready_by = parse_time(args.ready_by)
 
     # Get list of all VMs.
-    async with NetlabClient() as api:
-        all_pods = await api.pod_list()
-        pod_indices = []
-        for expr in args.podexprs:
-            prog = re.compile(expr)
-            pod_indices = pod_indices + \
-                list(filter(lambda x: x is not None,
-                            list(map(lambda x, y: y
-                                     if prog.match(x['pod_name'])
-                                     else None,
-                                     all_pods,
-                                     range(len(all_pods))))))
-        pod_names = [all_pods[x]['pod_name'] for x in pod_indices]
-        pod_pids = [all_pods[x]['pod_id'] for x in pod_indices]
+    async with api_trace.open_client() as api:
+        api = retry.wrap(api, args)
+        # A dry run may use a saved snapshot; real changes list afresh
+        all_pods = await snapshot.pod_list(api, fresh=args.fresh or not args.n)
+        pods = selection.select(all_pods,
+                                'pod_name',
+                                args.podexprs,
+                                args.exclude)
+        pod_names = [x['pod_name'] for x in pods]
+        pod_pids = [x['pod_id'] for x in pods]
+        if not pods:
+            print('No pods match')
+            return
+
+        # Order pods so that consecutive state changes land on
+        # different hosts
+        pod_hosts = {}
+        if args.datacenter:
+            pod_hosts = await pod_index.get_pod_hosts(
+                api, args.datacenter, fresh=args.fresh or not args.n)
+            names = dict(zip(pod_pids, pod_names))
+            pod_pids = pod_index.interleave_by_host(pod_pids, pod_hosts)
+            pod_names = [names[pod_id] for pod_id in pod_pids]
 
         # Verify intent to change pod state
         print('Pods to set to ' + str(args.state))
@@ -108,20 +425,39 @@ async def main():
         yes_no = input(f'Do you want to set these pods to {args.state}'
                        ' (y/n)?')
 
-        # Create and await tasks to change pod states
+        # Change pod states concurrently
         if yes_no[0].lower() == 'y':
-            tasks = []
-            for index in range(len(pod_indices)):
-                if (args.n):
-                    print(f'Setting State to {args.state}'
-                          f'{pod_pids[index]}:{pod_names[index]}')
-                else:
-                    tasks.append(asyncio.create_task(
-                        change_one_pod_state(api,
-                                             pod_pids[index],
-                                             pod_names[index],
-                                             args.state)))
-                await asyncio.gather(*tasks, return_exceptions=True)
+            if args.n:
+                for pod_id, pod_name in zip(pod_pids, pod_names):
+                    print(f'Setting State to {args.state} '
+                          f'{pod_id}:{pod_name}')
+                return
+            start = time.monotonic()
+            if args.wave_size:
+                latencies = await change_pod_states_in_waves(
+                    api,
+                    pod_pids,
+                    pod_names,
+                    args.state,
+                    pod_hosts,
+                    args.wave_size,
+                    args.settle_timeout,
+                    ready_by,
+                    args.rate,
+                    args.max_inflight)
+            else:
+                latencies = await change_pod_states(api,
+                                                    pod_pids,
+                                                    pod_names,
+                                                    args.state,
+                                                    pod_hosts,
+                                                    args.max_inflight,
+                                                    args.max_per_host,
+                                                    args.rate)
+            snapshot.invalidate('pods')
+            report_latencies(latencies, dict(zip(pod_pids, pod_names)))
+            print(f'Elapsed {time.monotonic() - start:.1f}s')
+            print(api.report())
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,204 @@
+'''
+snapshot.py
+
+Shared on-disk snapshots of Netlab-VE+ inventory listings.
+
+Listing every pod (pod_list) or every VM in a datacenter
+(vm_inventory_list) takes seconds and is repeated by every script run.
+The listings are saved as compressed snapshot files, keyed by Netlab
+system and datacenter, and reused until they are older than a TTL.
+Scripts that change pods or VMs invalidate the snapshots when they are
+done, and their -fresh options bypass them.
+
+Snapshots live in $NETLAB_CACHE_DIR (default ~/.cache/netlab35).  The
+Netlab system is taken from $NETLAB_SYSTEM (default "default") so that
+snapshots of different servers are never mixed.  Operators may share
+the directory, so snapshots are gzipped JSON (never pickles), readable
+by all; netlab enums and datetimes are stored by name and ISO time and
+rebuilt on load.
+
+MIT License
+
+Copyright (c) 2022 Joseph N. Wilson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+'''
+
+import datetime
+import enum
+import glob
+import gzip
+import json
+import os
+import re
+import tempfile
+import time
+
+from netlab import enums
+
+DEFAULT_TTL = 300
+SUFFIX = '.json.gz'
+
+CACHE_DIR = os.environ.get('NETLAB_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'),
+                                        '.cache', 'netlab35'))
+
+
+def system():
+    return os.environ.get('NETLAB_SYSTEM', 'default')
+
+
+##
+# snapshot_path: File holding a snapshot
+#
+# kind: what was listed ('pods' or 'vms')
+# datacenter: datacenter name, or None for system-wide listings
+#
+def snapshot_path(kind, datacenter=None):
+    name = '_'.join(re.sub(r'[^\w.-]', '_', part)
+                    for part in (system(), kind, datacenter or '') if part)
+    return os.path.join(CACHE_DIR, name + SUFFIX)
+
+
+##
+# encode: JSON form of the values listings hold that JSON lacks
+#
+# Netlab enums become {"__enum__": class name, "name": member name} and
+# datetimes {"__datetime__": ISO time}.  Use as json.dumps(default=).
+#
+def encode(value):
+    if isinstance(value, enum.Enum):
+        return {'__enum__': type(value).__name__, 'name': value.name}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+##
+# decode: Rebuild what encode wrote.  Use as json.loads(object_hook=).
+#
+# Only enums of netlab.enums are rebuilt; any other class name is left
+# as the member name.
+#
+def decode(obj):
+    if '__enum__' in obj:
+        cls = getattr(enums, obj['__enum__'], None)
+        if isinstance(cls, type) and issubclass(cls, enum.Enum) \
+                and obj['name'] in cls.__members__:
+            return cls[obj['name']]
+        return obj['name']
+    if '__datetime__' in obj:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+def load(path, ttl):
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with gzip.open(path, 'rt') as snap:
+            return json.load(snap, object_hook=decode)
+    except (OSError, EOFError, ValueError):
+        return None
+
+
+##
+# save: Write a snapshot, if the cache directory lets us
+#
+# The directory may be shared and not writable by this user; the run
+# then goes on without caching.  No partial file is left behind.
+#
+def save(path, data):
+    payload = json.dumps(data, default=encode).encode()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(dir=CACHE_DIR)
+    except OSError:
+        return
+    try:
+        with os.fdopen(handle, 'wb') as raw, \
+                gzip.GzipFile(fileobj=raw, mode='wb') as snap:
+            snap.write(payload)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+##
+# cached: Return a snapshot, refreshing it with list_call if needed
+#
+# path: snapshot file
+# list_call: coroutine function making the listing
+# fresh: ignore any saved snapshot
+# ttl: seconds a snapshot stays valid
+#
+async def cached(path, list_call, fresh=False, ttl=DEFAULT_TTL):
+    data = None if fresh else load(path, ttl)
+    if data is None:
+        data = await list_call()
+        save(path, data)
+    return data
+
+
+##
+# pod_list: All pods, as api.pod_list() returns them
+#
+# api: netlab client connection
+# fresh: list from the server even if a snapshot is valid
+# ttl: seconds a snapshot stays valid
+#
+async def pod_list(api, fresh=False, ttl=DEFAULT_TTL):
+    return await cached(snapshot_path('pods'), api.pod_list, fresh, ttl)
+
+
+##
+# vm_inventory_list: All VMs of a datacenter, as
+# api.vm_inventory_list(vdc_id=...) returns them
+#
+# api: netlab client connection
+# datacenter: datacenter name
+# fresh: list from the server even if a snapshot is valid
+# ttl: seconds a snapshot stays valid
+#
+async def vm_inventory_list(api, datacenter, fresh=False, ttl=DEFAULT_TTL):
+
+    async def list_vms():
+        datacenter_id = await api.vm_datacenter_find(vdc_name=datacenter)
+        return await api.vm_inventory_list(vdc_id=datacenter_id)
+
+    return await cached(snapshot_path('vms', datacenter), list_vms, fresh, ttl)
+
+
+##
+# invalidate: Remove snapshots after pods or VMs have changed
+#
+# kinds: which snapshots to remove ('pods', 'vms')
+#
+def invalidate(*kinds):
+    for kind in kinds or ('pods', 'vms'):
+        for path in glob.glob(snapshot_path(kind).replace(SUFFIX, '*')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,19 @@
+import argparse
+
+import pytest
+
+pytest.importorskip('netlab.enums')
+
+from autoscale_pods import parse_buffer  # noqa: E402
+
+
+def test_count_and_percentage():
+    assert parse_buffer('3') == (3, 0.0)
+    assert parse_buffer('0') == (0, 0.0)
+    assert parse_buffer('25%') == (0, 0.25)
+
+
+@pytest.mark.parametrize('text', ['-1', '-5%', 'lots', '%', '1.5'])
+def test_bad_buffers(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_buffer(text)
@@ -0,0 +1,47 @@
+import pytest
+
+from journal import Journal, JournalError, read_journal
+
+
+def test_read_journal_skips_torn_line(tmp_path):
+    path = str(tmp_path / 'job.jsonl')
+    journal = Journal(path)
+    journal.open({'job': 'delete', 'pod_ids': [1, 2]})
+    journal.start(1)
+    journal.finish(1, True)
+    journal.start(2)
+    journal.close()
+    with open(path, 'a') as out:
+        out.write('{"event": "done", "pod_')
+
+    plan, states = read_journal(path)
+    assert plan == {'job': 'delete', 'pod_ids': [1, 2]}
+    assert states == {1: 'done', 2: 'start'}
+
+
+def test_open_ends_torn_line_before_appending(tmp_path):
+    path = str(tmp_path / 'job.jsonl')
+    journal = Journal(path)
+    journal.open({'job': 'clone'})
+    journal.close()
+    with open(path, 'a') as out:
+        out.write('{"event": "st')
+
+    journal.open()
+    journal.finish(5, False, 'boom')
+    journal.close()
+    assert read_journal(path)[1] == {5: 'failed'}
+
+
+def test_journal_needs_plan(tmp_path):
+    path = tmp_path / 'empty.jsonl'
+    path.write_text('{"event": "start", "pod_id": 1}\n')
+    with pytest.raises(JournalError):
+        read_journal(str(path))
+
+
+def test_new_job_refuses_used_journal(tmp_path):
+    path = str(tmp_path / 'job.jsonl')
+    Journal(path).open({'job': 'clone'})
+    with pytest.raises(JournalError):
+        Journal(path).open({'job': 'clone'})
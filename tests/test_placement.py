@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import placement
+
+
+def loads(**vms):
+    return {int(vh_id[1:]): {'vms': count, 'pods': 0}
+            for vh_id, count in vms.items()}
+
+
+def fake_loads(layout):
+    fake_netlab = pytest.importorskip('fake_netlab')
+    fake = fake_netlab.FakeNetlabClient(hosts=3, time_scale=0)
+    for pod_id, (vh_id, vms) in layout.items():
+        fake.add_pod(pod_id, f'pod{pod_id}', vh_id, vms=vms)
+    return asyncio.run(placement.get_host_loads(fake, 1))
+
+
+def test_weighted_assignment_needs_hosts():
+    assert placement.weighted_assignment([], {}) == {}
+    with pytest.raises(ValueError):
+        placement.weighted_assignment([1, 2], {})
+    with pytest.raises(ValueError):
+        placement.round_robin_assignment([1, 2], [])
+
+
+def test_weighted_assignment_favours_light_hosts():
+    host_loads = {1: {'vms': 8, 'pods': 4}, 2: {'vms': 0, 'pods': 0}}
+    assignment = placement.weighted_assignment([1, 2, 3, 4], host_loads, 2)
+    assert sorted(assignment[2]) == [1, 2, 3, 4]
+    assert assignment.get(1, []) == []
+
+
+def test_drain_moves_largest_first_to_least_loaded():
+    host_loads = fake_loads({1: (1, 4), 2: (1, 1), 3: (2, 2)})
+    targets = placement.drain_moves(host_loads, [1, 2], {1: 4, 2: 1}, [1])
+    # The 4-VM pod goes to the empty host 3, then the 1-VM pod to host 2
+    assert targets == {1: 3, 2: 2}
+
+
+def test_drain_moves_without_other_hosts():
+    assert placement.drain_moves(loads(h1=3), [1], {1: 3}, [1]) == {}
+
+
+def test_drain_moves_follow_weights():
+    targets = placement.drain_moves(loads(h1=4, h2=0, h3=0), [1, 2, 3],
+                                    {}, [1], weights={3: 2.0})
+    assert sorted(targets.values()) == [2, 3, 3]
+
+
+def test_rebalance_moves_even_out_hosts():
+    host_loads = fake_loads({1: (1, 2), 2: (1, 2), 3: (1, 2)})
+    moves = placement.rebalance_moves(host_loads, {1: [1, 2, 3]},
+                                      {1: 2, 2: 2, 3: 2})
+    assert [(giver, taker) for _, giver, taker in moves] == [(1, 2), (1, 3)]
+
+
+def test_rebalance_moves_stop_when_balanced_or_limited():
+    assert placement.rebalance_moves(loads(h1=2, h2=2), {1: [1]},
+                                     {1: 2}) == []
+    moves = placement.rebalance_moves(loads(h1=6, h2=0), {1: [1, 2, 3]},
+                                      {1: 2, 2: 2, 3: 2}, limit=1)
+    assert len(moves) == 1
@@ -0,0 +1,74 @@
+import asyncio
+import datetime
+
+import pytest
+
+from reservations import ReservationIndex, list_reservations, parse_time
+
+START = datetime.datetime(2026, 10, 20, 9, 0)
+
+
+def at(hours):
+    return START + datetime.timedelta(hours=hours)
+
+
+def index(*reservations):
+    return ReservationIndex([{'res_id': number, 'pod_id': pod_id,
+                              'res_start': at(start), 'res_end': at(end)}
+                             for number, (pod_id, start, end)
+                             in enumerate(reservations)])
+
+
+def test_is_free_around_reservations():
+    reservations = ReservationIndex([{'res_id': 1, 'pod_id': 1,
+                                      'res_start': at(1),
+                                      'res_end': at(2)}])
+    assert reservations.is_free(1, at(0), at(1))
+    assert reservations.is_free(1, at(2), at(3))
+    assert not reservations.is_free(1, at(1.5), at(3))
+    assert reservations.is_free(2, at(1), at(2))
+
+
+def test_list_reservations_from_fake():
+    fake_netlab = pytest.importorskip('fake_netlab')
+    fake = fake_netlab.FakeNetlabClient(time_scale=0)
+    fake.add_pod(1, 'pod1', 1)
+    asyncio.run(fake.reservation_make(pod_id=1, start_time=at(0),
+                                      end_time=at(2)))
+    fake.reservations[9] = {'res_id': 9, 'pod_id': 1,
+                            'res_start': '2026-10-20T12:00:00',
+                            'res_end': '2026-10-20 13:00'}
+    reservations = ReservationIndex(asyncio.run(list_reservations(fake)))
+    assert not reservations.is_free(1, at(1), at(4))
+    assert not reservations.is_free(1, at(3.5), at(3.75))
+    assert reservations.is_free(1, at(2), at(3))
+
+
+
+def test_parse_time_forms():
+    assert parse_time('10/20/2026 09:30') == datetime.datetime(2026, 10, 20,
+                                                               9, 30)
+    assert parse_time('2026-10-20 09:30') == datetime.datetime(2026, 10, 20,
+                                                               9, 30)
+    assert parse_time(START) is START
+    assert parse_time('09:30').time() == datetime.time(9, 30)
+    with pytest.raises(ValueError):
+        parse_time('soon')
+
+
+def test_peak_demand_counts_overlaps():
+    reservations = index((1, 0, 2), (2, 1, 3), (3, 1, 2), (4, 5, 6))
+    assert reservations.peak_demand([1, 2, 3, 4], at(0), at(8)) == 3
+    assert reservations.peak_demand([1, 2], at(0), at(8)) == 2
+    assert reservations.peak_demand([1, 2, 3, 4], at(4), at(8)) == 1
+
+
+def test_peak_demand_back_to_back_counts_once():
+    reservations = index((1, 0, 1), (1, 1, 2))
+    assert reservations.peak_demand([1], at(0), at(3)) == 1
+
+
+def test_peak_demand_outside_window():
+    reservations = index((1, 0, 1))
+    assert reservations.peak_demand([1], at(1), at(3)) == 0
+    assert reservations.peak_demand([2], at(0), at(3)) == 0
@@ -0,0 +1,61 @@
+import asyncio
+
+from scheduler import WorkStealingScheduler
+
+
+def run(sched, times, slots_per_host=1):
+    async def worker(vh_id, item):
+        await asyncio.sleep(times.get(item, 0.02))
+        return not item.startswith('fail')
+
+    asyncio.run(sched.run(worker, slots_per_host=slots_per_host,
+                          watch_interval=0.01))
+
+
+def test_idle_host_steals_from_busy_host():
+    sched = WorkStealingScheduler({1: ['a'], 2: [f'b{i}' for i in range(6)]})
+    run(sched, {})
+    assert sched.steals
+    assert all(thief == 1 for _, _, thief in sched.steals)
+
+
+def test_no_steal_keeps_items_on_their_hosts():
+    sched = WorkStealingScheduler({1: ['a'], 2: ['b0', 'b1', 'b2']},
+                                  steal=False)
+    run(sched, {})
+    assert sched.steals == []
+
+
+def test_host_with_straggler_does_not_steal():
+    stragglers = []
+    sched = WorkStealingScheduler(
+        {1: ['slow', 'a0', 'a1', 'a2', 'a3'],
+         2: [f'b{i}' for i in range(20)]},
+        straggler_factor=2,
+        min_samples=1,
+        on_straggler=lambda *args: stragglers.append(args[:2]))
+    run(sched, {'slow': 1.0}, slots_per_host=2)
+    assert stragglers == [(1, 'slow')]
+    assert sched.stragglers == [(1, 'slow')]
+    assert sched.steals == []
+
+
+def test_failed_items_are_left_out_of_the_median():
+    sched = WorkStealingScheduler({1: ['fail0', 'fail1', 'ok']})
+    run(sched, {'fail0': 0, 'fail1': 0, 'ok': 0.05})
+    assert len(sched.durations) == 1
+    assert sched.durations[0] >= 0.05
+
+
+def test_host_given_no_items_does_not_steal():
+    sched = WorkStealingScheduler({1: [], 2: ['b0', 'b1', 'b2'],
+                                   3: ['c0', 'c1', 'c2']})
+    hosts = []
+
+    async def worker(vh_id, item):
+        hosts.append(vh_id)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(sched.run(worker, watch_interval=0.01))
+    assert len(hosts) == 6
+    assert 1 not in hosts
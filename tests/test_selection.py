@@ -0,0 +1,35 @@
+import selection
+
+NAMES = ['CSE235-1', 'CSE235-2', 'CSE310-1', 'seed7', 'aa', 'ab']
+ITEMS = [{'pod_name': name} for name in NAMES]
+
+
+def names(includes, excludes=None):
+    return [item['pod_name']
+            for item in selection.select(ITEMS, 'pod_name', includes,
+                                         excludes)]
+
+
+def test_prefixes_and_patterns():
+    assert names(['CSE235-']) == ['CSE235-1', 'CSE235-2']
+    assert names(['CSE.*-1']) == ['CSE235-1', 'CSE310-1']
+    assert names(['seed.*', 'CSE310']) == ['CSE310-1', 'seed7']
+
+
+def test_each_item_once_in_original_order():
+    assert names(['seed', 'CSE', 'CSE235-1']) == \
+        ['CSE235-1', 'CSE235-2', 'CSE310-1', 'seed7']
+
+
+def test_excludes():
+    assert names(['CSE'], ['CSE310', '.*-2']) == ['CSE235-1']
+
+
+def test_no_expressions_select_nothing():
+    assert names([]) == []
+    assert names(None) == []
+
+
+def test_backreferences_keep_their_groups():
+    assert names(['(a)\\1', '(C)SE2']) == ['CSE235-1', 'CSE235-2', 'aa']
+    assert names(['(?P<x>a)(?P=x)', 'seed']) == ['seed7', 'aa']
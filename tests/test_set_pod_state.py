@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('netlab.enums')
+
+from netlab.enums import PodState  # noqa: E402
+
+import fake_netlab  # noqa: E402
+from set_pod_state import (change_pod_states_in_waves,  # noqa: E402
+                           make_waves, report_latencies)
+
+
+def test_waves_hold_at_most_wave_size_per_host():
+    pod_hosts = {1: 10, 2: 10, 3: 10, 4: 20, 5: 20}
+    assert make_waves([1, 2, 3, 4, 5], pod_hosts, 2) == [[1, 2, 4, 5], [3]]
+
+
+def test_waves_of_one_per_host():
+    pod_hosts = {1: 10, 2: 20, 3: 10}
+    assert make_waves([1, 2, 3], pod_hosts, 1) == [[1, 2], [3]]
+
+
+def test_pods_on_unknown_hosts_share_waves():
+    assert make_waves([1, 2, 3], {}, 2) == [[1, 2], [3]]
+
+
+def test_no_pods_no_waves():
+    assert make_waves([], {}, 3) == []
+
+
+def test_wave_latencies_report_each_pods_own_name(capsys):
+    fake = fake_netlab.FakeNetlabClient(hosts=2, time_scale=0)
+    pod_hosts = {1: 1, 2: 2, 3: 1, 4: 2}
+    for pod_id, vh_id in pod_hosts.items():
+        fake.add_pod(pod_id, 'abcd'[pod_id - 1], vh_id)
+    pod_pids = [1, 2, 3, 4]
+    pod_names = ['a', 'b', 'c', 'd']
+    latencies = asyncio.run(change_pod_states_in_waves(
+        fake, pod_pids, pod_names, PodState.ONLINE, pod_hosts, 2, 5))
+    assert list(latencies) == [1, 3, 2, 4]
+
+    capsys.readouterr()
+    report_latencies(latencies, dict(zip(pod_pids, pod_names)))
+    lines = capsys.readouterr().out.splitlines()[1:5]
+    assert [line.split(':')[0].strip() for line in lines] == \
+        ['a', 'c', 'b', 'd']